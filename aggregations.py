@@ -0,0 +1,82 @@
+# aggregations.py
+# statistics over a set of tracks, calculated by the database
+from peewee import fn
+from models import Track, Statistic, Tag, TrackTag
+import rollups
+
+# Dimensions for grouped statistics, track dates are stored as "YYYY-MM-DD..." strings
+DIMENSIONS = {
+    "year": fn.SUBSTR(Track.date, 1, 4),
+    "month": fn.SUBSTR(Track.date, 1, 7),
+    "tag": Tag.value,
+}
+
+
+def _aggregates():
+    return [
+        fn.COUNT(Track.id.distinct()).alias("count"),
+        fn.COALESCE(fn.SUM(Statistic.distance_m), 0).alias("distance_m"),
+        fn.COALESCE(fn.SUM(Statistic.duration_s), 0).alias("duration"),
+        fn.COALESCE(fn.MAX(Statistic.max_speed), 0).alias("max_speed"),
+        fn.COALESCE(fn.AVG(Statistic.avg_speed), 0).alias("avg_speed"),
+        fn.COALESCE(fn.SUM(Statistic.elevation_up_m), 0).alias("elevation_up_m"),
+        fn.COALESCE(fn.SUM(Statistic.elevation_down_m), 0).alias("elevation_down_m"),
+    ]
+
+
+def overall_statistics(tracks):
+    """return the overall statistics of all tracks in one aggregate query
+
+    @param tracks: Track query selecting the tracks, e.g. filtered by tags
+    @return: dict with count, distance_m, duration, max_speed, avg_speed, elevation_up_m, elevation_down_m
+    """
+    track_ids = tracks.select(Track.id)
+    return (Statistic
+            .select(*_aggregates())
+            .join(Track)
+            .where(Track.id.in_(track_ids))
+            .dicts()
+            .get())
+
+
+def grouped_statistics(tracks, dimension):
+    """return the statistics of all tracks, grouped by year, month or tag
+
+    @param tracks: Track query selecting the tracks, e.g. filtered by tags
+    @param dimension: one of DIMENSIONS
+    @return: list of dicts like overall_statistics, with the additional key "group"
+    """
+    if dimension not in DIMENSIONS:
+        raise ValueError("Unknown dimension: %s" % dimension)
+
+    group = DIMENSIONS[dimension]
+    track_ids = tracks.select(Track.id)
+    query = (Statistic
+             .select(group.alias("group"), *_aggregates())
+             .join(Track))
+    if dimension == "tag":
+        query = query.join(TrackTag).join(Tag)
+    return list(query
+                .where(Track.id.in_(track_ids))
+                .group_by(group)
+                .order_by(group)
+                .dicts())
+
+
+def filtered_statistics(tracks, sel_tags, dimension):
+    """return overall and grouped statistics of the tracks matching the selected tags
+
+    Filters by at most one tag are read from the precomputed rollups,
+    other filters are aggregated from the statistics of the tracks.
+
+    @param tracks: Track query selecting the tracks having all of sel_tags
+    @return: tuple (overall statistics, grouped statistics)
+    """
+    sel_tags = set(sel_tags)
+    if len(sel_tags) <= 1:
+        tag = sel_tags.pop() if sel_tags else rollups.ALL
+        grouped = rollups.grouped_statistics(tag, dimension)
+        if grouped is not None:
+            return rollups.overall_statistics(tag), grouped
+
+    return overall_statistics(tracks), grouped_statistics(tracks, dimension)
@@ -3,14 +3,51 @@ import os
 
 from flask import Flask
 from peewee import SqliteDatabase
+from lib import activity
 # from revproxy import ReverseProxied
 
 APP_ROOT = os.path.dirname(os.path.realpath(__file__))
 DATABASE = os.path.join(APP_ROOT, 'tracks.db')
 DEBUG = False
+MAX_CONTENT_LENGTH = 64 * 2 ** 20  # max. size of uploaded files in bytes
+MAX_TRACKPOINTS = 1000000  # max. number of trackpoints of uploaded files
+INGEST_WORKERS = 1  # threads processing uploads in the background, 0 if ingest.py runs as separate process
+SHOW_CACHE_SIZE = 500  # rendered parts of /show/ kept in memory per process, 0 to disable (see lib/fragment_cache.py)
+# activity detection, changes the statistics: run recompute.py after modifying the thresholds (see lib/activity.py)
+ACTIVITY_PAUSE_SECONDS = 30  # more seconds between two trackpoints are considered a break
+ACTIVITY_STILL_DISTANCE = 0.75  # less meters between two trackpoints are considered standing still
+ACTIVITY_MAX_SPEED = 30  # faster calculated speeds (m/s) are gps errors and ignored
+GPX_TRACE_MEMORY = False  # measure memory allocations of the gpx processing stages (slow), see /metrics/
+# sqlite settings of every connection: with the write-ahead log, readers are not blocked by a writing upload or import
+DATABASE_PRAGMAS = {
+    'foreign_keys': 1,
+    'journal_mode': 'wal',
+    'synchronous': 'normal',  # safe with the write-ahead log, syncs only on checkpoints
+    'cache_size': -16 * 1024,  # page cache per connection in KiB (negative value)
+    'mmap_size': 128 * 2 ** 20,  # bytes of the database file read via memory mapping
+}
+DATABASE_TIMEOUT = 10  # seconds to wait for the write lock held by another connection (busy timeout)
 
 app = Flask(__name__)
 app.config.from_object(__name__)
+activity.configure(app.config['ACTIVITY_PAUSE_SECONDS'], app.config['ACTIVITY_STILL_DISTANCE'],
+                   app.config['ACTIVITY_MAX_SPEED'])
 # Activate following line, if you want to access the app through a reverse proxy from a different url-path than /
 # app.wsgi_app = ReverseProxied(app.wsgi_app, script_name="/trackdb-test")
-db = SqliteDatabase(app.config['DATABASE'], pragmas={'foreign_keys': 1})
+# transactions take the write lock when they begin (IMMEDIATE), so they wait for concurrent writers up to the
+# busy timeout, instead of failing with "database is locked" when a read transaction is upgraded to a write transaction
+db = SqliteDatabase(app.config['DATABASE'], pragmas=app.config['DATABASE_PRAGMAS'],
+                    timeout=app.config['DATABASE_TIMEOUT'], lock_type="IMMEDIATE")
+
+
+@app.before_request
+def _db_connect():
+    """open the connection of the request's thread, it is closed after the request
+    """
+    db.connect(reuse_if_open=True)
+
+
+@app.teardown_request
+def _db_close(exc):  # pylint: disable=unused-argument
+    if not db.is_closed():
+        db.close()
@@ -0,0 +1,172 @@
+# db_concurrency.py
+# Load test of concurrent database access: reader threads request /show/ and /tracks/ (as threads of a wsgi process)
+# while a separate process imports batches of tracks (tracks, statistics, tags and rollups in one transaction,
+# as bulk_import.py does). Reports the read latencies, failed requests and committed batches on a temporary database.
+#
+# Compare the journal modes (readers and the writer), and the transaction lock types with several writers:
+# deferred transactions reading before writing fail with "database is locked" instead of waiting for the lock.
+# usage: python3 benchmarks/db_concurrency.py [--readers 4] [--writers 1] [--seconds 10]
+#                                             [--journal-mode wal|delete] [--lock-type immediate|deferred]
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+import threading
+import multiprocessing
+from datetime import date, timedelta
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), ".."))
+
+from app import app, db  # pylint: disable=wrong-import-position
+from models import Track, Statistic, tag_tracks, increment_counter  # pylint: disable=wrong-import-position
+from migrations import upgrade_database  # pylint: disable=wrong-import-position
+import rollups  # pylint: disable=wrong-import-position
+import views  # pylint: disable=wrong-import-position,unused-import
+
+TAGS = ["hiking", "cycling", "running", "alps", "commute"]
+
+
+def insert_tracks(count, rand, hold=0.0, lock_type=None):
+    """insert count synthetic tracks in one transaction, hold: seconds to keep the transaction open
+    the transaction reads before it writes, like deleting a track does
+
+    @param lock_type: lock type of the transaction (BEGIN ...), None for the default of the database
+    """
+    with db.atomic(lock_type=lock_type):
+        first = Track.select().count()
+        tracks = []
+        for number in range(first, first + count):
+            day = date(2010, 1, 1) + timedelta(days=rand.randrange(5000))
+            tracks.append(Track.create(name="track %d" % number, date=day, path="upload-data/track_%d.gpx.gz" % number,
+                                       content_hash="%064x" % rand.getrandbits(256)))
+        track_tags = []
+        for track in tracks:
+            statistic = Statistic.create(track=track, distance_m=rand.randrange(1000, 100000),
+                                         duration_s=rand.randrange(600, 20000), duration_total_s=20000,
+                                         max_speed=rand.uniform(10, 60), avg_speed=rand.uniform(5, 30),
+                                         elevation_up_m=rand.randrange(2000), elevation_down_m=rand.randrange(2000))
+            tags = rand.sample(TAGS, 2) + [str(track.date)[:4]]
+            track_tags.append((track.id, tags))
+            rollups.add_track(track.date, statistic, tags)
+        tag_tracks(track_tags)
+        increment_counter()
+        time.sleep(hold)
+
+
+def init_database(path, journal_mode):
+    pragmas = dict(app.config["DATABASE_PRAGMAS"], journal_mode=journal_mode)
+    db.init(path, pragmas=pragmas, timeout=app.config["DATABASE_TIMEOUT"])
+
+
+def writer(path, journal_mode, lock_type, stop_event, batch_size, hold, queue, seed):
+    """import batches until stop_event is set, runs in a separate process, puts its results into queue
+    """
+    init_database(path, journal_mode)
+    results = {"seconds": [], "errors": [], "batches": 0}
+    rand = random.Random(seed)
+    db.connect()
+    try:
+        while not stop_event.is_set():
+            start = time.perf_counter()
+            try:
+                insert_tracks(batch_size, rand, hold, lock_type)
+                results["batches"] += 1
+            except Exception as e:
+                results["errors"].append(str(e))
+            results["seconds"].append(time.perf_counter() - start)
+    finally:
+        db.close()
+        queue.put(results)
+
+
+def reader(stop_event, results):
+    client = app.test_client()
+    urls = ["/show/", "/tracks/?limit=50", "/show/?track=1"]
+    number = 0
+    while not stop_event.is_set():
+        url = urls[number % len(urls)]
+        number += 1
+        start = time.perf_counter()
+        try:
+            response = client.get(url)
+            if response.status_code != 200:
+                results["errors"].append("%s: HTTP %d" % (url, response.status_code))
+        except Exception as e:
+            results["errors"].append("%s: %s" % (url, e))
+        results["seconds"].append(time.perf_counter() - start)
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)] if values else float("nan")
+
+
+def print_results(name, results, duration):
+    seconds = results["seconds"]
+    print("%-7s %6d requests %7.1f/s   p50 %7.1f ms   p95 %7.1f ms   max %7.1f ms   errors %d" % (
+        name, len(seconds), len(seconds) / duration, percentile(seconds, 0.5) * 1000,
+        percentile(seconds, 0.95) * 1000, max(seconds or [0]) * 1000, len(results["errors"])))
+    for error in sorted(set(results["errors"]))[:5]:
+        print("        %s" % error)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load test of concurrent reads during imports.")
+    parser.add_argument("--readers", type=int, default=4, help="number of reader threads")
+    parser.add_argument("--writers", type=int, default=1, help="number of importing processes")
+    parser.add_argument("--seconds", type=float, default=10, help="duration of the test")
+    parser.add_argument("--tracks", type=int, default=2000, help="number of tracks in the database before the test")
+    parser.add_argument("--batch-size", type=int, default=100, help="number of tracks imported per transaction")
+    parser.add_argument("--hold", type=float, default=0.05, help="seconds the writer keeps each transaction open")
+    parser.add_argument("--journal-mode", default=app.config["DATABASE_PRAGMAS"]["journal_mode"],
+                        choices=["wal", "delete"], help="sqlite journal mode")
+    parser.add_argument("--lock-type", default="immediate", choices=["immediate", "deferred"],
+                        help="lock type of the import transactions")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "tracks.db")
+        init_database(path, args.journal_mode)
+        db.connect()
+        upgrade_database()
+        rand = random.Random(1)
+        for _ in range(0, args.tracks, 500):
+            insert_tracks(500, rand)
+        db.close()
+
+        context = multiprocessing.get_context("spawn")
+        write_stop_event = context.Event()
+        queue = context.Queue()
+        processes = [context.Process(target=writer, args=(path, args.journal_mode, args.lock_type.upper(),
+                                                          write_stop_event, args.batch_size, args.hold, queue, seed))
+                     for seed in range(2, 2 + args.writers)]
+        for process in processes:
+            process.start()
+
+        stop_event = threading.Event()
+        read_results = {"seconds": [], "errors": []}
+        threads = [threading.Thread(target=reader, args=(stop_event, read_results)) for _ in range(args.readers)]
+        for thread in threads:
+            thread.start()
+        time.sleep(args.seconds)
+        stop_event.set()
+        write_stop_event.set()
+        for thread in threads:
+            thread.join()
+        write_results = {"seconds": [], "errors": [], "batches": 0}
+        for process in processes:
+            results = queue.get()
+            for key in write_results:
+                write_results[key] += results[key]
+        for process in processes:
+            process.join()
+
+    print("journal mode %s, lock type %s, %d readers, %d writers: %d batches of %d tracks imported" % (
+        args.journal_mode, args.lock_type, args.readers, args.writers, write_results["batches"], args.batch_size))
+    print_results("reads", read_results, args.seconds)
+    print_results("writes", write_results, args.seconds)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,51 @@
+# elevation_filters.py
+# Benchmark of the elevation filters: the cost per point has to stay constant with growing track length
+#
+# usage: python3 benchmarks/elevation_filters.py [--sizes 10000,100000,1000000]
+import os
+import sys
+import math
+import time
+import random
+import argparse
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), ".."))
+
+from lib.elevation import parse_filters, numpy  # pylint: disable=wrong-import-position
+
+SPECS = ["average:5", "median:5", "hysteresis:3", "kalman", "median:5,hysteresis:3"]
+
+
+def synthetic_elevations(count, seed=1):
+    """smooth hills with gaussian GPS noise
+    """
+    rand = random.Random(seed)
+    return [500 + 200 * math.sin(i / 2000.0) + rand.gauss(0, 3) for i in range(count)]
+
+
+def measure(function, elevations):
+    start = time.perf_counter()
+    function(elevations)
+    return time.perf_counter() - start
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark of the elevation filters.")
+    parser.add_argument("--sizes", default="10000,100000,1000000", help="comma separated list of track lengths")
+    args = parser.parse_args(argv)
+
+    print("%-24s %-8s %10s %10s %14s" % ("filter", "mode", "points", "time [s]", "per point [ns]"))
+    for size in [int(size) for size in args.sizes.split(",")]:
+        elevations = synthetic_elevations(size)
+        array = numpy.array(elevations) if numpy is not None else None
+        for spec in SPECS:
+            elevation_filter = parse_filters(spec)
+            modes = [("list", elevation_filter.apply, elevations)]
+            if array is not None:
+                modes.append(("array", elevation_filter.apply_array, array))
+            for mode, function, data in modes:
+                duration = measure(function, data)
+                print("%-24s %-8s %10d %10.3f %14.1f" % (spec, mode, size, duration, duration / size * 1e9))
+
+
+if __name__ == '__main__':
+    main()
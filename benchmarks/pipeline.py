@@ -0,0 +1,251 @@
+# pipeline.py
+# Benchmark of the gpx processing pipeline: time and peak memory of every stage of Gpx.process
+#
+# Inputs are synthetic gpx files of growing length, test/integration/valid.gpx and the tracks of
+# example-data.tar.gz. Every input is measured in a fresh process, so the peak RSS is not inherited.
+# The points backend processes the point store (lib/point_store.py) of the input instead of the gpx file.
+# The results are written as json (--output), compare them between versions with --compare.
+#
+# usage: python3 benchmarks/pipeline.py [--sizes 1000,10000,100000,1000000] [--output results.json]
+#                                       [--compare baseline.json]
+import os
+import sys
+import json
+import math
+import time
+import random
+import tarfile
+import argparse
+import platform
+import resource
+import tempfile
+import tracemalloc
+import multiprocessing
+from datetime import datetime, timedelta
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), ".."))
+
+from lxml import etree  # pylint: disable=wrong-import-position
+from lib import gpx_arrays, point_store  # pylint: disable=wrong-import-position
+from lib.gpx import Gpx, STATISTICS_VERSION, VALIDATION_FULL, VALIDATION_OFF  # pylint: disable=wrong-import-position
+
+BASE_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), "..")
+VALID_GPX = os.path.join(BASE_DIR, "test", "integration", "valid.gpx")
+EXAMPLE_DATA = os.path.join(BASE_DIR, "example-data.tar.gz")
+
+STAGES = ["parse", "validate", "extract", "diff", "metadata"]
+BACKENDS = ["list", "columnar", "streaming", "points"]
+
+GPX_HEADER = """<?xml version="1.0" encoding="UTF-8"?>
+<gpx xmlns="http://www.topografix.com/GPX/1/1" creator="trackdb benchmark" version="1.1">
+<trk><name>synthetic %d</name><trkseg>
+"""
+GPX_TRKPT = '<trkpt lat="%.7f" lon="%.7f"><ele>%.1f</ele><time>%s</time></trkpt>\n'
+GPX_FOOTER = "</trkseg></trk>\n</gpx>\n"
+
+
+def write_synthetic_gpx(path, count, seed=1):
+    """write a gpx file with count trackpoints: a random walk at cycling speed with hills, noise and pauses
+    """
+    rand = random.Random(seed)
+    lat, lon = 47.5, 11.0
+    timestamp = datetime(2018, 6, 1, 8, 0, 0)
+    with open(path, "w") as gpx_file:
+        gpx_file.write(GPX_HEADER % count)
+        heading = 0.0
+        for i in range(count):
+            if i % 5000 == 4999:  # pause
+                timestamp += timedelta(seconds=600)
+            else:
+                heading += rand.gauss(0, 0.2)
+                lat += 0.00005 * math.cos(heading)
+                lon += 0.00007 * math.sin(heading)
+                timestamp += timedelta(seconds=1)
+            elevation = 800 + 300 * math.sin(i / 3000.0) + rand.gauss(0, 2)
+            gpx_file.write(GPX_TRKPT % (lat, lon, elevation, timestamp.strftime("%Y-%m-%dT%H:%M:%SZ")))
+        gpx_file.write(GPX_FOOTER)
+
+
+def prepare_inputs(sizes, data_dir):
+    """return a list of (name, path) of all inputs, synthetic files are generated once per data_dir
+    """
+    inputs = []
+    for size in sizes:
+        path = os.path.join(data_dir, "synthetic_%d.gpx" % size)
+        if not os.path.isfile(path):
+            write_synthetic_gpx(path, size)
+        inputs.append(("synthetic_%d" % size, path))
+
+    inputs.append(("valid.gpx", VALID_GPX))
+
+    if os.path.isfile(EXAMPLE_DATA):
+        with tarfile.open(EXAMPLE_DATA, "r:*") as archive:
+            for member in archive:
+                if member.isfile() and member.name.endswith(".gpx"):
+                    path = os.path.join(data_dir, "example_" + os.path.basename(member.name))
+                    if not os.path.isfile(path):
+                        with open(path, "wb") as gpx_file:
+                            gpx_file.write(archive.extractfile(member).read())
+                    inputs.append(("example-data/" + os.path.basename(member.name), path))
+    return inputs
+
+
+def run_stages(gpx_fspath, backend, measure):
+    """process the file stage by stage, measure(stage, function) calls function and records its cost
+    """
+    if backend == "streaming":
+        gpx = Gpx(gpx_fspath, streaming=True)
+        measure("process", lambda: gpx.process(force=True, validation=VALIDATION_FULL))  # as views.add
+        return gpx.statistics.point_count
+    if backend == "points":
+        gpx = Gpx(gpx_fspath, columnar=gpx_arrays.available())
+        measure("process", gpx.process)
+        return len(gpx.geo_data["lats"])
+
+    gpx = Gpx(gpx_fspath, columnar=(backend == "columnar"))
+    measure("parse", lambda: gpx._parse(validation=VALIDATION_OFF))  # pylint: disable=protected-access
+    measure("validate", lambda: gpx._is_valid(VALIDATION_FULL))  # pylint: disable=protected-access
+
+    def extract():
+        gpx._extract_geo_data()  # pylint: disable=protected-access
+        gpx._filter_elevations()  # pylint: disable=protected-access
+    measure("extract", extract)
+    measure("diff", gpx._calc_diff_geo_data)  # pylint: disable=protected-access
+    measure("metadata", gpx.metadata)
+    return len(gpx.geo_data["lats"])
+
+
+def measure_time(gpx_fspath, backend, repeat):
+    """return the minimum duration in seconds of each stage over repeat runs
+    """
+    durations = {}
+
+    def measure(stage, function):
+        start = time.perf_counter()
+        function()
+        duration = time.perf_counter() - start
+        durations[stage] = min(duration, durations.get(stage, duration))
+
+    points = None
+    for _ in range(repeat):
+        points = run_stages(gpx_fspath, backend, measure)
+    return durations, points
+
+
+def measure_memory(gpx_fspath, backend):
+    """return the peak of the python heap in bytes allocated by each stage, measured with tracemalloc
+
+    Memory allocated by libxml2 (the element tree) is not traced, it is part of the peak RSS.
+    """
+    peaks = {}
+
+    def measure(stage, function):
+        baseline = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        function()
+        peaks[stage] = tracemalloc.get_traced_memory()[1] - baseline
+
+    tracemalloc.start()
+    try:
+        run_stages(gpx_fspath, backend, measure)
+    finally:
+        tracemalloc.stop()
+    return peaks
+
+
+def benchmark_input(name, gpx_fspath, backend, repeat):
+    """measure one input with one backend, runs in a fresh worker process
+    """
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        if backend == "points":
+            points_fspath = os.path.join(tmp_dir, "points" + point_store.SUFFIX)
+            Gpx(gpx_fspath, streaming=True, point_store=points_fspath).process(force=True, validation=VALIDATION_OFF)
+            gpx_fspath = points_fspath
+        durations, points = measure_time(gpx_fspath, backend, repeat)
+        peaks = measure_memory(gpx_fspath, backend)
+        file_bytes = os.path.getsize(gpx_fspath)
+    return {
+        "input": name,
+        "backend": backend,
+        "file_bytes": file_bytes,
+        "points": points,
+        "stages": {stage: {"seconds": durations[stage], "py_peak_bytes": peaks[stage]} for stage in durations},
+        "total_seconds": sum(durations.values()),
+        "peak_rss_bytes": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,  # kilobytes on linux
+    }
+
+
+def environment():
+    return {
+        "date": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "lxml": ".".join(str(part) for part in etree.LXML_VERSION),
+        "numpy": gpx_arrays.numpy.__version__ if gpx_arrays.available() else None,
+        "statistics_version": STATISTICS_VERSION,
+    }
+
+
+def print_results(results, baseline=None):
+    """print a table of the results, with the relative change of the total time to a baseline
+    """
+    reference = {}
+    for result in (baseline or {}).get("results", []):
+        reference[(result["input"], result["backend"])] = result["total_seconds"]
+
+    print("%-44s %-9s %9s" % ("input", "backend", "points") +
+          "".join(" %9s" % stage for stage in STAGES + ["total [s]"]) + " %10s %8s" % ("rss [MB]", "change"))
+    for result in results:
+        line = "%-44s %-9s %9s" % (result["input"][:44], result["backend"], result["points"])
+        for stage in STAGES:
+            line += " %9.4f" % result["stages"][stage]["seconds"] if stage in result["stages"] else " %9s" % "-"
+        line += " %9.4f %10.1f" % (result["total_seconds"], result["peak_rss_bytes"] / 2 ** 20)
+        key = (result["input"], result["backend"])
+        if key in reference and reference[key] > 0:
+            line += " %+7.1f%%" % ((result["total_seconds"] / reference[key] - 1) * 100)
+        print(line)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark of the gpx processing pipeline.")
+    parser.add_argument("--sizes", default="1000,10000,100000,1000000",
+                        help="comma separated list of trackpoint counts of the synthetic gpx files")
+    parser.add_argument("--backends", default=",".join(BACKENDS), help="comma separated list of %s" % ", ".join(BACKENDS))
+    parser.add_argument("--repeat", type=int, default=3, help="number of timed runs, the fastest run counts")
+    parser.add_argument("--data-dir", default=None, help="directory of the generated inputs, default: temporary")
+    parser.add_argument("--output", default=None, help="write the results as json to this file")
+    parser.add_argument("--compare", default=None, help="json results of a previous run to compare with")
+    args = parser.parse_args(argv)
+
+    sizes = [int(size) for size in args.sizes.split(",") if size != ""]
+    backends = [backend for backend in args.backends.split(",") if backend != ""]
+    for backend in backends:
+        if backend not in BACKENDS:
+            parser.error("Unknown backend: %s" % backend)
+    if "columnar" in backends and not gpx_arrays.available():
+        print("numpy is not installed, skipping the columnar backend")
+        backends.remove("columnar")
+    baseline = None
+    if args.compare:
+        with open(args.compare, "r") as baseline_file:
+            baseline = json.load(baseline_file)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        data_dir = args.data_dir or tmp_dir
+        os.makedirs(data_dir, exist_ok=True)
+        inputs = prepare_inputs(sizes, data_dir)
+
+        results = []
+        # a fresh process per measurement, so the peak RSS belongs to this input only
+        with multiprocessing.get_context("spawn").Pool(1, maxtasksperchild=1) as pool:
+            for name, gpx_fspath in inputs:
+                for backend in backends:
+                    results.append(pool.apply(benchmark_input, (name, gpx_fspath, backend, args.repeat)))
+
+    print_results(results, baseline)
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump({"environment": environment(), "results": results}, output_file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,249 @@
+# bulk_import.py
+# Command line import of many gpx files: directories, single files and tar.gz archives
+#
+# usage: python3 bulk_import.py [--tags hiking,alps] [--workers 4] path [path ...]
+
+import os
+import sys
+import argparse
+import tarfile
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from werkzeug.utils import secure_filename
+from app import db
+from models import Track, Statistic, tag_tracks, increment_counter
+import rollups
+import spatial
+import splits
+import storage
+from migrations import upgrade_database
+from views import UPLOAD_BASE_DIR, UPLOAD_DIR, CACHE_DIR, allowed_file, track_geometry, track_points, point_store_path
+from lib.gpx import Gpx, STATISTICS_VERSION, VALIDATION_POLICIES, VALIDATION_STRUCTURAL
+from lib.gpx_cache import ResultCache, hash_bytes
+from lib.elevation import parse_filters
+from lib import activity
+
+IN_FLIGHT_PER_WORKER = 2  # files read and submitted ahead per worker process, while earlier results are stored
+
+
+def find_sources(paths):
+    """yield (name, read function) of all gpx files in the given files, directories and tar.gz archives
+    """
+    for path in paths:
+        if os.path.isdir(path):
+            for dirpath, _, filenames in os.walk(path):
+                for filename in sorted(filenames):
+                    fspath = os.path.join(dirpath, filename)
+                    if allowed_file(filename):
+                        yield fspath, _file_reader(fspath)
+                    elif tarfile.is_tarfile(fspath):
+                        yield from _tar_sources(fspath)
+        elif tarfile.is_tarfile(path):
+            yield from _tar_sources(path)
+        elif allowed_file(path):
+            yield path, _file_reader(path)
+        else:
+            print("Skipping unsupported file: %s" % path)
+
+
+def _file_reader(fspath):
+    def read():
+        with open(fspath, "rb") as gpx_file:
+            return gpx_file.read()
+    return read
+
+
+def _tar_sources(archive_path):
+    with tarfile.open(archive_path, "r:*") as archive:
+        for member in archive:
+            if member.isfile() and allowed_file(member.name):
+                content = archive.extractfile(member).read()
+                yield "%s:%s" % (archive_path, member.name), (lambda content=content: content)
+
+
+def target_filename(name, content_hash):
+    """return the file name in the upload directory, derived from the source name and its content hash
+    the files are stored gzip compressed
+    """
+    gpx_filename = secure_filename(os.path.basename(name))
+    return "%s_%s.gpx%s" % (gpx_filename[:-4], content_hash[:12], storage.COMPRESSED_SUFFIX)
+
+
+def process_file(gpx_fspath, content_hash, force, validation, elevation_filter):
+    """process a gpx file in a worker process, results are reused from the result cache
+    the simplified map geometry and the split tables are built as well
+
+    @return: tuple (gpx metadata, bounding box [[south, west], [north, east]], splits, best efforts)
+    """
+    gpx = Gpx(gpx_fspath, True, streaming=True, elevation_filter=elevation_filter,
+              point_store=point_store_path(content_hash))
+    gpx_metadata = ResultCache(CACHE_DIR).process(gpx, content_hash, force=force, validation=validation)
+    geometry = track_geometry(content_hash, gpx_fspath)
+    track_splits, best_efforts = splits.analyze_file(track_points(content_hash, gpx_fspath), elevation_filter)
+    return gpx_metadata, geometry["bounds"], track_splits, best_efforts
+
+
+def store_batch(batch, tags, elevation_filter=""):
+    """write tracks, statistics, tags and spatial index of a batch of processed files in one transaction
+
+    @param batch: list of dicts with path, name, content_hash, metadata (gpx metadata), bounds, splits and
+        best_efforts of each track
+    @param tags: tags added to every track, the year is added implicitly
+    @param elevation_filter: specification of the elevation filters applied to all tracks
+    """
+    with db.atomic():
+        Track.insert_many([
+            dict(name=item["name"], date=item["metadata"]["date"], path=item["path"], content_hash=item["content_hash"],
+                 **spatial.bounds_fields(item["bounds"]))
+            for item in batch
+        ]).execute()
+
+        track_ids = {track.path: track.id for track in
+                     Track.select(Track.id, Track.path).where(Track.path.in_([item["path"] for item in batch]))}  # pylint: disable=E1111
+
+        statistics = []
+        track_tags = []
+        for item in batch:
+            gpx_metadata = item["metadata"]
+            track_id = track_ids[item["path"]]
+            statistics.append({
+                "track": track_id,
+                "distance_m": gpx_metadata["total_distance"],
+                "duration_s": gpx_metadata["duration"],
+                "duration_total_s": gpx_metadata["total_duration"],
+                "max_speed": gpx_metadata["max_speed"],
+                "avg_speed": gpx_metadata["avg_speed"],
+                "elevation_up_m": gpx_metadata["total_ascent"],
+                "elevation_down_m": gpx_metadata["total_descent"],
+                "version": STATISTICS_VERSION,
+                "elevation_filter": elevation_filter,
+                "activity_thresholds": activity.fingerprint(),
+            })
+            track_tags.append((track_id, tags + [gpx_metadata["date"][:4]]))  # implicit add of the year
+
+        Statistic.insert_many(statistics).execute()
+        tag_tracks(track_tags)
+        for item, statistic, (track_id, tag_values) in zip(batch, statistics, track_tags):
+            rollups.add_track(item["metadata"]["date"], Statistic(**statistic), tag_values)
+            spatial.index_track(track_id, item["bounds"])
+            splits.store_track(track_id, item["splits"], item["best_efforts"])
+        increment_counter()
+
+
+def run_import(paths, tags, workers=None, batch_size=100, force=False, validation=VALIDATION_STRUCTURAL,
+               elevation_filter=""):
+    """import all gpx files found in paths
+
+    The sources are read and submitted while the results of earlier files are stored: at most
+    IN_FLIGHT_PER_WORKER files per worker are stored in the upload folder without being in the database.
+    If the import is interrupted, these files are removed again.
+
+    @return: tuple of (imported, skipped, failed) counts
+    """
+    upload_dir = os.path.join(UPLOAD_BASE_DIR, UPLOAD_DIR)
+    os.makedirs(upload_dir, exist_ok=True)
+    filter_spec = parse_filters(elevation_filter).spec()
+    max_in_flight = IN_FLIGHT_PER_WORKER * (workers or os.cpu_count() or 1)
+    imported = skipped = failed = 0
+    batch = []
+    in_flight = {}  # future: (name, gpx_fspath, track path, content_hash)
+    pending = set()  # content hashes of the submitted files
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        try:
+            sources = find_sources(paths)
+            exhausted = False
+            while not exhausted or in_flight:
+                while not exhausted and len(in_flight) < max_in_flight:
+                    source = next(sources, None)
+                    if source is None:
+                        exhausted = True
+                        break
+                    name, read = source
+                    content = read()
+                    content_hash = hash_bytes(content)
+                    if content_hash in pending or Track.select().where(Track.content_hash == content_hash).exists():  # already imported
+                        skipped += 1
+                        print("[%d] %s: skipped, already imported" % (imported + len(batch) + skipped + failed, name))
+                        continue
+                    pending.add(content_hash)
+
+                    gpx_filename = target_filename(name, content_hash)
+                    gpx_fspath = os.path.join(upload_dir, gpx_filename)
+                    with open(gpx_fspath, "wb") as gpx_file:
+                        gpx_file.write(storage.compress_bytes(content))
+                    future = executor.submit(process_file, gpx_fspath, content_hash, force, validation, elevation_filter)
+                    in_flight[future] = (name, gpx_fspath, os.path.join(UPLOAD_DIR, gpx_filename), content_hash)
+                if not in_flight:
+                    break
+
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name, gpx_fspath, track_path, content_hash = in_flight.pop(future)
+                    try:
+                        gpx_metadata, bounds, track_splits, best_efforts = future.result()
+                    except Exception as e:
+                        failed += 1
+                        print("[%d] %s: error during gpx file processing: %s" % (
+                            imported + len(batch) + skipped + failed, name, e))
+                        os.remove(gpx_fspath)
+                        continue
+
+                    track_name = os.path.splitext(os.path.basename(name))[0]
+                    batch.append({"path": track_path, "fspath": gpx_fspath, "name": track_name,
+                                  "content_hash": content_hash, "metadata": gpx_metadata, "bounds": bounds,
+                                  "splits": track_splits, "best_efforts": best_efforts})
+                    print("[%d] %s: processed" % (imported + len(batch) + skipped + failed, name))
+
+                if len(batch) >= batch_size:
+                    store_batch(batch, tags, filter_spec)
+                    imported += len(batch)
+                    batch = []
+                    print("imported: %d, skipped: %d, failed: %d" % (imported, skipped, failed))
+
+            if batch:
+                store_batch(batch, tags, filter_spec)
+                imported += len(batch)
+                batch = []
+        except BaseException:
+            # interrupted (or the database failed): remove the files of the tracks not stored in the database
+            executor.shutdown(wait=True, cancel_futures=True)
+            for gpx_fspath in [item[1] for item in in_flight.values()] + [item["fspath"] for item in batch]:
+                if os.path.exists(gpx_fspath):
+                    os.remove(gpx_fspath)
+            raise
+    print("imported: %d, skipped: %d, failed: %d" % (imported, skipped, failed))
+
+    return imported, skipped, failed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Import gpx files from directories and tar.gz archives.")
+    parser.add_argument("paths", nargs="+", help="gpx files, directories or tar.gz archives")
+    parser.add_argument("--tags", default="", help="comma separated list of tags added to every track")
+    parser.add_argument("--workers", type=int, default=None, help="number of worker processes, default: all cores")
+    parser.add_argument("--batch-size", type=int, default=100, help="number of tracks stored per transaction")
+    parser.add_argument("--validation", choices=VALIDATION_POLICIES, default=VALIDATION_STRUCTURAL,
+                        help="validation policy for the gpx files")
+    parser.add_argument("--force", action="store_true", help="continue processing files with validation errors")
+    parser.add_argument("--elevation-filter", default="",
+                        help="filters to smooth the elevations, e.g. median:5,hysteresis:3 (see lib/elevation.py)")
+    args = parser.parse_args(argv)
+    try:
+        parse_filters(args.elevation_filter)  # fail early on invalid filter specifications
+    except ValueError as e:
+        parser.error(str(e))
+
+    tags = [tag for tag in args.tags.replace(" ", "").split(",") if tag != ""]
+
+    db.connect()
+    upgrade_database()
+    try:
+        _, _, failed = run_import(args.paths, tags, args.workers, args.batch_size, args.force, args.validation,
+                                  args.elevation_filter)
+    finally:
+        db.close()
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,185 @@
+# ingest.py
+# background processing of uploaded gpx files: a job queue in the database (Job), worked off by local threads
+#
+# The web application starts INGEST_WORKERS threads (see app.py). Set it to 0 and run the workers
+# in a separate process instead:
+# usage: python3 ingest.py [--workers 2]
+import sys
+import time
+import logging
+import argparse
+import threading
+from datetime import datetime, timedelta
+from app import db
+from models import Job, increment_counter
+
+JOB_PENDING = "pending"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+
+POLL_INTERVAL = 5  # seconds between checks for jobs enqueued by other processes
+STALE_AFTER = timedelta(minutes=30)  # running jobs without update are considered crashed and restarted
+HEARTBEAT_INTERVAL = 60  # seconds between the updates of a running job, keeps it from being considered crashed
+
+_wakeup = threading.Event()  # set on enqueue, so local workers start without waiting for the next poll
+
+
+def enqueue(name, path, content_hash, tags, elevation_filter=""):
+    """add an uploaded gpx file to the queue
+
+    @param path: stored gpx file, relative to the static folder
+    @param tags: iterable of tag values
+    @return: the new Job
+    """
+    now = datetime.now()
+    with db.atomic():
+        job = Job.create(name=name, path=path, content_hash=content_hash, tags=",".join(tags),
+                         elevation_filter=elevation_filter, status=JOB_PENDING, created=now, updated=now)
+        increment_counter()
+    _wakeup.set()
+    return job
+
+
+def is_queued(content_hash):
+    """return True if a gpx file with the content hash is waiting for or in processing
+    """
+    return (Job.select()
+            .where(Job.content_hash == content_hash, Job.status.in_([JOB_PENDING, JOB_RUNNING]))
+            .exists())
+
+
+def claim_job():
+    """mark the oldest pending job as running and return it, None if there is no pending job
+
+    The status check in the update makes sure only one worker (thread or process) gets a job.
+    """
+    while True:
+        job = Job.select().where(Job.status == JOB_PENDING).order_by(Job.id).first()  # pylint: disable=E1111
+        if job is None:
+            return None
+        with db.atomic():
+            claimed = (Job
+                       .update(status=JOB_RUNNING, updated=datetime.now())
+                       .where(Job.id == job.id, Job.status == JOB_PENDING)
+                       .execute())
+            if claimed:
+                increment_counter()  # /show/ lists the status of the job
+        if claimed:
+            job.status = JOB_RUNNING
+            return job
+
+
+def finish_job(job, track=None, error=None):
+    """store the result of a job: the created track or the error message
+    """
+    status = JOB_FAILED if error is not None else JOB_DONE
+    with db.atomic():
+        Job.update(status=status, track=track, error=error, updated=datetime.now()).where(Job.id == job.id).execute()
+        increment_counter()
+
+
+def requeue_stale_jobs():
+    """set running jobs, whose worker crashed, back to pending
+    """
+    return (Job
+            .update(status=JOB_PENDING, updated=datetime.now())
+            .where(Job.status == JOB_RUNNING, Job.updated < datetime.now() - STALE_AFTER)
+            .execute())
+
+
+def _heartbeat(job, stop_event):
+    """refresh the update time of a running job every HEARTBEAT_INTERVAL until stop_event is set,
+    so long running jobs are not requeued by requeue_stale_jobs
+    """
+    db.connect(reuse_if_open=True)
+    try:
+        while not stop_event.wait(HEARTBEAT_INTERVAL):
+            try:
+                Job.update(updated=datetime.now()).where(Job.id == job.id, Job.status == JOB_RUNNING).execute()
+            except Exception as e:
+                logging.getLogger("ingest").warning("Update of the running job '%s' failed: %s", job.path, e)
+    finally:
+        db.close()
+
+
+def run_job(job, handler):
+    """run the handler of a claimed job and store its result, the job is kept alive by a heartbeat meanwhile
+    """
+    stop_heartbeat = threading.Event()
+    heartbeat = threading.Thread(target=_heartbeat, args=(job, stop_heartbeat), daemon=True)
+    heartbeat.start()
+    try:
+        track = handler(job)
+    except Exception as e:
+        logging.getLogger("ingest").warning("Processing of '%s' failed: %s", job.path, e)
+        error = str(e)
+    else:
+        error = None
+    finally:
+        stop_heartbeat.set()
+        heartbeat.join()
+    if error is not None:
+        finish_job(job, error=error)
+    else:
+        finish_job(job, track=track)
+
+
+def run_worker(handler, stop_event=None):
+    """process jobs until stop_event is set
+
+    Errors of the queue itself (e.g. the database is locked longer than its timeout) are logged,
+    the worker continues after POLL_INTERVAL.
+
+    @param handler: function processing a Job, returns the created Track or raises an exception
+    """
+    db.connect(reuse_if_open=True)
+    try:
+        while stop_event is None or not stop_event.is_set():
+            _wakeup.clear()
+            try:
+                job = claim_job()
+                if job is None:
+                    requeue_stale_jobs()
+                    _wakeup.wait(POLL_INTERVAL)
+                    continue
+                run_job(job, handler)
+            except Exception:
+                logging.getLogger("ingest").exception("Error in the ingest worker, retrying in %s seconds", POLL_INTERVAL)
+                time.sleep(POLL_INTERVAL)
+    finally:
+        db.close()
+
+
+def start_workers(count, handler):
+    """start count daemon threads working off the queue
+
+    @return: list of the threads
+    """
+    threads = []
+    for number in range(count):
+        thread = threading.Thread(target=run_worker, args=(handler,), name="ingest-%d" % number, daemon=True)
+        thread.start()
+        threads.append(thread)
+    return threads
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Process uploaded gpx files in the background.")
+    parser.add_argument("--workers", type=int, default=1, help="number of worker threads")
+    args = parser.parse_args(argv)
+
+    from migrations import upgrade_database
+    import views
+
+    logging.basicConfig(level=logging.INFO)
+    db.connect()
+    upgrade_database()
+    db.close()
+    for thread in start_workers(args.workers, views.process_job):
+        thread.join()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,56 @@
+"""activity detection: when a track counts as paused, standing still or affected by gps errors
+
+The thresholds are shared by the list based, columnar and streaming processing in lib.gpx and by the split
+analysis in lib.segments. The application sets them from its configuration with configure().
+They change the calculated statistics: fingerprint() identifies them in the cached processing results
+(lib.gpx_cache) and in the stored statistics, recompute.py updates statistics calculated with other thresholds.
+"""
+
+DEFAULTS = {
+    "pause_seconds": 30,  # more seconds between two trackpoints are considered a break (inactive)
+    "still_distance": 0.75,  # less meters between two trackpoints are considered standing still
+    "max_speed": 30,  # faster calculated speeds (m/s, 110 km/h) are gps errors and ignored
+}
+
+PAUSE_SECONDS = DEFAULTS["pause_seconds"]
+STILL_DISTANCE = DEFAULTS["still_distance"]
+MAX_SPEED = DEFAULTS["max_speed"]
+
+
+def configure(pause_seconds=DEFAULTS["pause_seconds"], still_distance=DEFAULTS["still_distance"],
+              max_speed=DEFAULTS["max_speed"]):
+    """set the thresholds of this process, before any track is processed
+    """
+    global PAUSE_SECONDS, STILL_DISTANCE, MAX_SPEED  # pylint: disable=global-statement
+    if pause_seconds <= 0 or still_distance < 0 or max_speed <= 0:
+        raise ValueError("Invalid activity thresholds: pause %s s, still %s m, max. speed %s m/s" % (
+            pause_seconds, still_distance, max_speed))
+    PAUSE_SECONDS = pause_seconds
+    STILL_DISTANCE = still_distance
+    MAX_SPEED = max_speed
+
+
+def fingerprint(pause_seconds=None, still_distance=None, max_speed=None):
+    """return a short text identifying the thresholds, the configured ones by default
+    """
+    return "p%g_s%g_v%g" % (PAUSE_SECONDS if pause_seconds is None else pause_seconds,
+                            STILL_DISTANCE if still_distance is None else still_distance,
+                            MAX_SPEED if max_speed is None else max_speed)
+
+
+def is_active(delta):
+    """return True if the time delta (seconds) between two trackpoints belongs to the activity, False for a break
+    """
+    return delta < PAUSE_SECONDS
+
+
+def is_moving(distance):
+    """return True if the distance (meters) between two trackpoints is a movement
+    """
+    return distance > STILL_DISTANCE
+
+
+def clamp_speed(speed):
+    """return the speed (m/s) between two trackpoints, 0 if it is implausible
+    """
+    return 0 if speed > MAX_SPEED else speed
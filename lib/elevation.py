@@ -0,0 +1,331 @@
+"""filters to smooth the elevation series of a track
+
+GPS elevations are noisy, summing up the raw point to point differences overestimates the total ascent.
+All filters are causal: the filtered value of a point only depends on the point and its predecessors.
+So they can be applied point by point while streaming (push), on a list (apply) or on a numpy array
+(apply_array), with the same result (up to rounding errors for Kalman) and linear cost in the number of points
+(Kalman.apply_array: log2(n) vectorized steps). Hysteresis depends on its previous output and can not be
+vectorized, its apply_array converts to and from a list.
+
+Filters are selected by a specification string, e.g. "median:5,hysteresis:3" (see parse_filters).
+"""
+
+from abc import ABC, abstractmethod
+from bisect import insort, bisect_left
+from collections import deque
+
+try:
+    import numpy
+except ImportError:  # numpy is optional, apply_array is only used with the columnar backend
+    numpy = None
+
+
+class ElevationFilter(ABC):
+    """base class of all filters, subclasses implement reset(), push() and spec()
+    """
+    name = None
+
+    @abstractmethod
+    def reset(self):
+        """forget all previous points, e.g. before filtering the next track
+        """
+
+
+    @abstractmethod
+    def push(self, elevation):
+        """filter the next elevation of the series
+
+        @return: filtered elevation
+        """
+
+
+    def apply(self, elevations):
+        """filter a complete series
+
+        @return: list of filtered elevations
+        """
+        self.reset()
+        return [self.push(elevation) for elevation in elevations]
+
+
+    def apply_array(self, elevations):
+        """filter a complete series given as numpy array, subclasses may override with vectorized versions
+
+        @return: array of filtered elevations
+        """
+        return numpy.array(self.apply(elevations.tolist()), dtype=numpy.float64)
+
+
+    @abstractmethod
+    def spec(self):
+        """return the specification string of the filter, see parse_filters
+        """
+
+
+class MovingAverage(ElevationFilter):
+    """average of the last window elevations
+    """
+    name = "average"
+
+    def __init__(self, window=5):
+        self.window = int(window)
+        if self.window < 1:
+            raise ValueError("Window of moving average must be at least 1")
+        self.reset()
+
+
+    def reset(self):
+        self.values = deque()
+        self.sum = 0.0
+
+
+    def push(self, elevation):
+        self.values.append(elevation)
+        self.sum += elevation
+        if len(self.values) > self.window:
+            self.sum -= self.values.popleft()
+        return self.sum / len(self.values)
+
+
+    def apply_array(self, elevations):
+        cumsum = numpy.concatenate(([0.0], numpy.cumsum(elevations)))
+        index = numpy.arange(1, len(elevations) + 1)
+        start = numpy.maximum(index - self.window, 0)
+        return (cumsum[index] - cumsum[start]) / (index - start)
+
+
+    def spec(self):
+        return "%s:%d" % (self.name, self.window)
+
+
+class MovingMedian(ElevationFilter):
+    """median of the last window elevations, removes single outliers
+    """
+    name = "median"
+
+    def __init__(self, window=5):
+        self.window = int(window)
+        if self.window < 1:
+            raise ValueError("Window of moving median must be at least 1")
+        self.reset()
+
+
+    def reset(self):
+        self.values = deque()
+        self.sorted_values = []
+
+
+    def push(self, elevation):
+        self.values.append(elevation)
+        insort(self.sorted_values, elevation)
+        if len(self.values) > self.window:
+            del self.sorted_values[bisect_left(self.sorted_values, self.values.popleft())]
+        count = len(self.sorted_values)
+        middle = count // 2
+        if count % 2:
+            return self.sorted_values[middle]
+        return (self.sorted_values[middle - 1] + self.sorted_values[middle]) / 2.0
+
+
+    def apply_array(self, elevations):
+        filtered = numpy.empty(len(elevations), dtype=numpy.float64)
+        head = min(self.window - 1, len(elevations))
+        for i in range(head):  # less than window points available
+            filtered[i] = numpy.median(elevations[:i + 1])
+        if len(elevations) >= self.window:
+            windows = numpy.lib.stride_tricks.sliding_window_view(elevations, self.window)
+            filtered[head:] = numpy.median(windows, axis=1)
+        return filtered
+
+
+    def spec(self):
+        return "%s:%d" % (self.name, self.window)
+
+
+class Hysteresis(ElevationFilter):
+    """keep the elevation constant until it differs by at least threshold meters
+    """
+    name = "hysteresis"
+
+    def __init__(self, threshold=3.0):
+        self.threshold = float(threshold)
+        self.reset()
+
+
+    def reset(self):
+        self.reference = None
+
+
+    def push(self, elevation):
+        if self.reference is None or abs(elevation - self.reference) >= self.threshold:
+            self.reference = elevation
+        return self.reference
+
+
+    def apply(self, elevations):
+        # each value depends on the previous output, so it can not be vectorized: loop with local variables
+        filtered = []
+        append = filtered.append
+        reference = None
+        threshold = self.threshold
+        for elevation in elevations:
+            if reference is None or abs(elevation - reference) >= threshold:
+                reference = elevation
+            append(reference)
+        self.reference = reference
+        return filtered
+
+
+    def apply_array(self, elevations):
+        return numpy.array(self.apply(elevations.tolist()), dtype=numpy.float64)
+
+
+    def spec(self):
+        return "%s:%g" % (self.name, self.threshold)
+
+
+class Kalman(ElevationFilter):
+    """one dimensional kalman filter with constant elevation model
+
+    @param process_variance: expected variance of the real elevation between two points in m^2
+    @param measurement_variance: variance of the measured elevation in m^2
+    """
+    name = "kalman"
+
+    def __init__(self, process_variance=1.0, measurement_variance=4.0):
+        self.process_variance = float(process_variance)
+        self.measurement_variance = float(measurement_variance)
+        self.reset()
+
+
+    def reset(self):
+        self.estimate = None
+        self.error = 1.0
+
+
+    def push(self, elevation):
+        if self.estimate is None:
+            self.estimate = elevation
+            return self.estimate
+        self.error += self.process_variance
+        gain = self.error / (self.error + self.measurement_variance)
+        self.estimate += gain * (elevation - self.estimate)
+        self.error *= 1 - gain
+        return self.estimate
+
+
+    def apply(self, elevations):
+        # each estimate depends on the previous one, so it can not be vectorized: loop with local variables
+        self.reset()
+        filtered = []
+        append = filtered.append
+        estimate = None
+        error = self.error
+        process_variance = self.process_variance
+        measurement_variance = self.measurement_variance
+        for elevation in elevations:
+            if estimate is None:
+                estimate = elevation
+            else:
+                error += process_variance
+                gain = error / (error + measurement_variance)
+                estimate += gain * (elevation - estimate)
+                error *= 1 - gain
+            append(estimate)
+        self.estimate = estimate
+        self.error = error
+        return filtered
+
+
+    def apply_array(self, elevations):
+        # The gains do not depend on the elevations: they are computed until they converge. Then the estimates
+        # are the linear recurrence estimate[i] = (1 - gain[i]) * estimate[i - 1] + gain[i] * elevation[i],
+        # solved by a prefix scan in log2(n) vectorized steps (equal to push up to rounding errors).
+        self.reset()
+        count = len(elevations)
+        if count == 0:
+            return numpy.zeros(0)
+        gains = numpy.empty(count)
+        gains[0] = 1.0  # the first estimate is the first elevation
+        error = self.error
+        for i in range(1, count):
+            error += self.process_variance
+            gain = error / (error + self.measurement_variance)
+            error *= 1 - gain
+            gains[i] = gain
+            if gain == gains[i - 1]:  # steady state, all following gains are equal
+                gains[i + 1:] = gain
+                break
+
+        factors = 1.0 - gains
+        estimates = gains * elevations
+        shift = 1
+        while shift < count:  # combine each estimate with the one shift points before
+            estimates[shift:] += factors[shift:] * estimates[:-shift]
+            factors[shift:] *= factors[:-shift]
+            shift *= 2
+        self.estimate = float(estimates[-1])
+        self.error = error
+        return estimates
+
+
+    def spec(self):
+        return "%s:%g:%g" % (self.name, self.process_variance, self.measurement_variance)
+
+
+FILTERS = {elevation_filter.name: elevation_filter for elevation_filter in (MovingAverage, MovingMedian, Hysteresis, Kalman)}
+
+
+class FilterChain(ElevationFilter):
+    """apply several filters one after another
+    """
+
+    def __init__(self, filters):
+        self.filters = list(filters)
+
+
+    def reset(self):
+        for elevation_filter in self.filters:
+            elevation_filter.reset()
+
+
+    def push(self, elevation):
+        for elevation_filter in self.filters:
+            elevation = elevation_filter.push(elevation)
+        return elevation
+
+
+    def apply(self, elevations):
+        for elevation_filter in self.filters:
+            elevations = elevation_filter.apply(elevations)
+        return list(elevations)
+
+
+    def apply_array(self, elevations):
+        for elevation_filter in self.filters:
+            elevations = elevation_filter.apply_array(elevations)
+        return elevations
+
+
+    def spec(self):
+        return ",".join(elevation_filter.spec() for elevation_filter in self.filters)
+
+
+def parse_filters(spec):
+    """create a FilterChain from a specification string
+
+    The specification is a comma separated list of filter names with optional parameters separated by colon:
+    "average:5", "median:5", "hysteresis:3", "kalman:1:4". An empty specification applies no filter.
+    """
+    filters = []
+    for item in (spec or "").replace(" ", "").split(","):
+        if item == "":
+            continue
+        name, *params = item.split(":")
+        if name not in FILTERS:
+            raise ValueError("Unknown elevation filter: %s" % name)
+        try:
+            filters.append(FILTERS[name](*params))
+        except TypeError:  # too many parameters
+            raise ValueError("Invalid parameters of elevation filter: %s" % item)
+    return FilterChain(filters)
@@ -0,0 +1,68 @@
+"""in-process cache of rendered html fragments
+
+The rendered parts of a page (e.g. the tag list of /show/) only change with the data. FragmentCache keeps
+the fragments of the current data generation (models.get_counter), a new generation discards all of them.
+The number of fragments is bounded, the least recently used fragment is dropped first.
+"""
+
+import threading
+from collections import OrderedDict
+
+
+class FragmentCache(object):
+    """thread safe LRU cache of rendered fragments of one data generation
+
+    @param max_entries: max. number of cached fragments, 0 disables the cache
+    """
+
+    def __init__(self, max_entries):
+        self.lock = threading.Lock()
+        self.max_entries = max_entries
+        self.generation = None
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+
+    def get(self, generation, key, render):
+        """return the cached fragment of key, call render() and cache its result if not cached
+
+        Fragments are rendered outside the lock, concurrent requests may render the same fragment twice.
+
+        @param generation: data generation the caller read before querying the data of the fragment
+        @param key: hashable key of the fragment, e.g. a tuple of its name and parameters
+        @param render: function returning the fragment
+        """
+        with self.lock:
+            if self.generation is None or generation > self.generation:
+                self.generation = generation
+                self.entries.clear()
+            if generation == self.generation and key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key]
+            self.misses += 1
+
+        fragment = render()
+        with self.lock:
+            # requests of an older generation may not fill the cache of the current one
+            if generation == self.generation and self.max_entries > 0:
+                self.entries[key] = fragment
+                self.entries.move_to_end(key)
+                while len(self.entries) > self.max_entries:
+                    self.entries.popitem(last=False)
+        return fragment
+
+
+    def clear(self):
+        with self.lock:
+            self.generation = None
+            self.entries.clear()
+
+
+    def as_dict(self):
+        """return the size and the hit and miss counts of the cache
+        """
+        with self.lock:
+            return {"generation": self.generation, "entries": len(self.entries), "max_entries": self.max_entries,
+                    "hits": self.hits, "misses": self.misses}
@@ -0,0 +1,152 @@
+"""compact, simplified track geometry for the map
+
+The trackpoints of a gpx file are reduced with the Douglas-Peucker algorithm at several tolerances,
+so the browser loads a small GeoJSON LineString instead of the complete gpx file.
+"""
+
+from math import radians, cos
+from .gpx import Gpx, VALIDATION_OFF
+from .point_store import PointStore, is_point_store
+
+# Tolerance in meters of each level of detail, from overview to close zoom levels
+DETAIL_TOLERANCES = {
+    "low": 25.0,
+    "medium": 5.0,
+    "high": 1.0,
+}
+DEFAULT_DETAIL = "medium"
+
+METERS_PER_DEGREE_LAT = 110540
+METERS_PER_DEGREE_LON = 111320  # at the equator
+
+
+def _project(lats, lons):
+    """project lat/lon to planar coordinates in meters (equirectangular, sufficient for a single track)
+    """
+    kx = METERS_PER_DEGREE_LON * cos(radians(sum(lats) / len(lats)))
+    return [lon * kx for lon in lons], [lat * METERS_PER_DEGREE_LAT for lat in lats]
+
+
+def _segment_sq_distance(px, py, ax, ay, bx, by):
+    """squared distance of point p to the segment a-b
+    """
+    dx = bx - ax
+    dy = by - ay
+    if dx != 0 or dy != 0:
+        t = ((px - ax) * dx + (py - ay) * dy) / (dx * dx + dy * dy)
+        if t > 1:
+            ax, ay = bx, by
+        elif t > 0:
+            ax += dx * t
+            ay += dy * t
+    dx = px - ax
+    dy = py - ay
+    return dx * dx + dy * dy
+
+
+def simplify(xs, ys, tolerance):
+    """simplify a line with the Douglas-Peucker algorithm, preceded by a radial distance filter
+
+    @param xs, ys: planar coordinates in meters
+    @param tolerance: max. deviation of the simplified line in meters
+    @return: list of the indices of the kept points
+    """
+    if len(xs) < 3:
+        return list(range(len(xs)))
+    sq_tolerance = tolerance * tolerance
+
+    # radial distance filter: drop points closer than tolerance to the previously kept point
+    candidates = [0]
+    for i in range(1, len(xs) - 1):
+        last = candidates[-1]
+        if (xs[i] - xs[last]) ** 2 + (ys[i] - ys[last]) ** 2 > sq_tolerance:
+            candidates.append(i)
+    candidates.append(len(xs) - 1)
+
+    # Douglas-Peucker, iterative to avoid recursion limits on long tracks
+    keep = [False] * len(candidates)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(candidates) - 1)]
+    while stack:
+        first, last = stack.pop()
+        a = candidates[first]
+        b = candidates[last]
+        max_sq_distance = sq_tolerance
+        index = None
+        for i in range(first + 1, last):
+            p = candidates[i]
+            sq_distance = _segment_sq_distance(xs[p], ys[p], xs[a], ys[a], xs[b], ys[b])
+            if sq_distance > max_sq_distance:
+                index = i
+                max_sq_distance = sq_distance
+        if index is not None:
+            keep[index] = True
+            stack.append((first, index))
+            stack.append((index, last))
+
+    return [candidate for candidate, kept in zip(candidates, keep) if kept]
+
+
+def build_geometry(lats, lons, elevations):
+    """build the simplified geometry of all levels of detail
+
+    @return: dict with bounds [[south, west], [north, east]] and
+        levels {detail: [[lon, lat, elevation], ...]}
+    """
+    lats = list(lats)
+    lons = list(lons)
+    elevations = list(elevations)
+    if len(lats) == 0:
+        raise ValueError("No trackpoints for the track geometry.")
+
+    xs, ys = _project(lats, lons)
+    levels = {}
+    for detail, tolerance in DETAIL_TOLERANCES.items():
+        levels[detail] = [[round(lons[i], 6), round(lats[i], 6), round(elevations[i], 1)]
+                          for i in simplify(xs, ys, tolerance)]
+
+    return {
+        "bounds": [[min(lats), min(lons)], [max(lats), max(lons)]],
+        "levels": levels,
+    }
+
+
+def geometry_from_geo_data(geo_data):
+    """build the geometry from the geo_data of a processed (not streamed) Gpx object
+    """
+    return build_geometry(geo_data["lats"], geo_data["lons"], geo_data["elevations"])
+
+
+def geometry_from_file(gpx_file):
+    """build the geometry from a gpx file or point store, the gpx file is streamed and not validated again
+    """
+    if is_point_store(gpx_file):
+        _, lats, lons, elevations = PointStore(gpx_file).columns()
+        return build_geometry(lats, lons, elevations)
+
+    lats = []
+    lons = []
+    elevations = []
+    for _, lat, lon, elevation in Gpx(gpx_file, streaming=True).iter_trackpoints(validation=VALIDATION_OFF):
+        if elevation is None:  # Skip incomplete trackpoints, as Gpx does
+            continue
+        lats.append(lat)
+        lons.append(lon)
+        elevations.append(elevation)
+    return build_geometry(lats, lons, elevations)
+
+
+def geojson_feature(geometry, detail=DEFAULT_DETAIL):
+    """return one level of detail of the geometry as GeoJSON Feature with a 3D LineString
+    """
+    return {
+        "type": "Feature",
+        "geometry": {
+            "type": "LineString",
+            "coordinates": geometry["levels"][detail],
+        },
+        "properties": {
+            "bounds": geometry["bounds"],
+            "detail": detail,
+        },
+    }
@@ -2,11 +2,23 @@
 """
 
 import os
+import gzip
 import logging
-import time
-import datetime
+import re
+import calendar
+import threading
+from array import array
+from bisect import bisect_left, bisect_right
+from contextlib import nullcontext, contextmanager
+from functools import lru_cache
 from math import radians, atan2, sin, cos, sqrt
 from lxml import etree
+from . import gpx_arrays
+from . import activity
+from .activity import is_active, is_moving, clamp_speed
+from .elevation import parse_filters
+from .point_store import PointStore, PointStoreWriter, is_point_store
+from .instrumentation import LapTimer
 
 # The schema file is based on the original gpx.xsd from topografix.com
 # Differences:
@@ -15,20 +27,127 @@ from lxml import etree
 # - MinOccurs of wpt: 3 instead of 0
 GPX_SCHEMA_FILE = os.path.join(os.path.dirname(__file__), "gpx_lib.xsd")
 
+# Version of the statistics calculation, increase on every change that modifies the results of Gpx.metadata()
+# and update the stored statistics with recompute.py. The configurable activity thresholds are tracked
+# separately by lib.activity.fingerprint().
+STATISTICS_VERSION = 2  # 2: standing still (lib.activity.is_moving) is inactive
+
 # Namespace of schema
 SCHEMAMAP = {'gpx': 'http://www.topografix.com/GPX/1/1'}
 
+# Fully qualified tag names, used when walking the tree without find()
+TRKPT_TAG = "{%s}trkpt" % SCHEMAMAP["gpx"]
+TIME_TAG = "{%s}time" % SCHEMAMAP["gpx"]
+ELE_TAG = "{%s}ele" % SCHEMAMAP["gpx"]
+GPX_TAG = "{%s}gpx" % SCHEMAMAP["gpx"]
+
+# Validation policies of Gpx.process
+VALIDATION_FULL = "full"  # validate against the xsd schema
+VALIDATION_STRUCTURAL = "structural"  # cheap checks of the elements used for processing
+VALIDATION_OFF = "off"  # trust the input, e.g. bulk import of device exports
+VALIDATION_POLICIES = (VALIDATION_FULL, VALIDATION_STRUCTURAL, VALIDATION_OFF)
+
+GZIP_MAGIC = b"\x1f\x8b"
+
+# Compiled schema, one per thread: the error_log of a lxml validator is not safe to share between threads
+_schema_cache = threading.local()
+
+
+def get_xmlschema():
+    """return the compiled gpx xsd schema, compiled lazily on first use in the current thread
+    """
+    xmlschema = getattr(_schema_cache, "xmlschema", None)
+    if xmlschema is None:
+        xmlschema = etree.XMLSchema(file=GPX_SCHEMA_FILE)  # pylint: disable=no-member
+        _schema_cache.xmlschema = xmlschema
+    return xmlschema
+
+
+def is_gzip_file(gpx_file):
+    """return True if the file at path gpx_file is gzip compressed
+    """
+    with open(gpx_file, "rb") as gpx_stream:
+        return gpx_stream.read(2) == GZIP_MAGIC
+
+
+@contextmanager
+def open_gpx_file(gpx_file):
+    """open a gpx file for reading, gzip compressed files are decompressed transparently
+
+    @param gpx_file: path or binary file-like object (seekable or with peek), file objects are not closed
+    @return: context manager of a binary file object with the uncompressed content
+    """
+    if isinstance(gpx_file, (str, bytes, os.PathLike)):
+        if not os.path.isfile(gpx_file):
+            raise RuntimeError("Can not find file: " + str(gpx_file))
+        with open(gpx_file, "rb") as gpx_stream:
+            with open_gpx_file(gpx_stream) as uncompressed:
+                yield uncompressed
+        return
+
+    if hasattr(gpx_file, "peek"):
+        magic = gpx_file.peek(2)[:2]
+    else:
+        position = gpx_file.tell()
+        magic = gpx_file.read(2)
+        gpx_file.seek(position)
+    if magic == GZIP_MAGIC:
+        with gzip.GzipFile(fileobj=gpx_file, mode="rb") as uncompressed:
+            yield uncompressed
+    else:
+        yield gpx_file
+
+
+def check_trackpoint(trkpt):
+    """structural check of a trkpt element: coordinates in range and a timestamp available
+
+    @return: error message, None if the trackpoint is fine
+    """
+    try:
+        lat = float(trkpt.get("lat"))
+        lon = float(trkpt.get("lon"))
+    except (TypeError, ValueError):
+        return "Trackpoint without valid lat/lon attributes"
+    if not -90.0 <= lat <= 90.0 or not -180.0 <= lon < 180.0:
+        return "Trackpoint coordinates out of range: %s, %s" % (lat, lon)
+    for child in trkpt:
+        if child.tag == TIME_TAG:
+            return None
+    return "Trackpoint without time element"
+
 
 class Gpx(object):
     """Read, validate and parse GPX File.
     Store and provide trackpoint information in class attributes.
 
-    @param gpx_file: file to the gpx track
+    @param gpx_file: path or binary file-like object of the gpx track, may be gzip compressed,
+        or path of a point store (see lib.point_store), which is loaded without xml parsing and validation
     @skip_inactive: only consider trackpoints with active movement
+    @streaming: parse the file incrementally, keep only running totals instead of geo_data lists
+    @columnar: store geo_data as numpy arrays and calculate differential values vectorized (requires numpy)
+    @elevation_filter: specification of filters to smooth the elevations, e.g. "median:5,hysteresis:3"
+        see lib.elevation.parse_filters
+    @instrumentation: optional object, whose stage(name) context manager is entered around every processing stage,
+        e.g. lib.instrumentation.StageRecorder
+    @point_store: optional path, the extracted trackpoints (before elevation filtering) are written to
+        as point store, so later processing of the track can skip the xml
+    @max_points: optional max. number of trackpoints in streaming mode, larger files raise a ValueError
+        as soon as the limit is exceeded
     """
 
-    def __init__(self, gpx_file, skip_inactive=True):
+    def __init__(self, gpx_file, skip_inactive=True, streaming=False, columnar=False, elevation_filter="",
+                 instrumentation=None, point_store=None, max_points=None):
+        if columnar and not gpx_arrays.available():
+            raise RuntimeError("The columnar geo_data backend requires numpy.")
+
         self.skip_inactive=skip_inactive
+        self.streaming = streaming
+        self.columnar = columnar
+        self.elevation_filter = parse_filters(elevation_filter)
+        self.instrumentation = instrumentation
+        self.point_store = point_store
+        self.max_points = max_points
+        self.statistics = None  # StreamingStatistics, only used in streaming mode
         self.gpx_etree = None
         self.gpx_trackpoints = []
         self.geo_data = {
@@ -46,15 +165,30 @@ class Gpx(object):
             }
 
         self.gpx_file = gpx_file
+        self.date = None
+
+
+    def _stage(self, name):
+        """return the instrumentation context manager of a processing stage, it yields a record dict
+        """
+        if self.instrumentation is None:
+            return nullcontext({})
+        return self.instrumentation.stage(name)
 
 
-    def _is_valid(self):
+    def _is_valid(self, validation=VALIDATION_FULL):
         """validate the gpx_etree object containing the gpx data against the gpx xsd schema
         log a warning if file is invalid
 
+        @param validation: validation policy, one of VALIDATION_POLICIES
         @return: False if validation error, True if valid gpx
         """
-        xmlschema = etree.XMLSchema(file=GPX_SCHEMA_FILE) # pylint: disable=no-member
+        if validation == VALIDATION_OFF:
+            return True
+        if validation == VALIDATION_STRUCTURAL:
+            return self._is_structurally_valid()
+
+        xmlschema = get_xmlschema()
 
         if not xmlschema.validate(self.gpx_etree):
             for error in xmlschema.error_log:
@@ -66,17 +200,48 @@ class Gpx(object):
             return True
 
 
-    def _parse(self, force=False):
+    def _is_structurally_valid(self):
+        """check only the elements needed for processing: gpx root element and the trackpoints
+        log a warning if file is invalid
+
+        @return: False if validation error, True if valid gpx
+        """
+        errors = []
+        if self.gpx_etree.getroot().tag != GPX_TAG:
+            errors.append("Root element is not a GPX 1.1 gpx element")
+        if len(self.gpx_trackpoints) == 0:
+            errors.append("No trackpoints found")
+        for trkpt in self.gpx_trackpoints:
+            error = check_trackpoint(trkpt)
+            if error:
+                errors.append("Line %s: %s" % (trkpt.sourceline, error))
+
+        for error in errors:
+            logging.getLogger("validation").warning("Invalid element in GPX File: " + error)
+        return len(errors) == 0
+
+
+    def _parse(self, force=False, validation=VALIDATION_FULL):
         """validate and parse the gpx file, store ElementTree objects of waypoints in attribute list
 
         @param force: boolean decision whether to continue processing the file on validation error
+        @param validation: validation policy, one of VALIDATION_POLICIES
         """
-        if not os.path.isfile(self.gpx_file):
-            raise RuntimeError("Can not find file: " + str(self.gpx_file))
+        with self._stage("parse") as record:
+            with open_gpx_file(self.gpx_file) as gpx_stream:
+                self.gpx_etree = etree.parse(gpx_stream)  # pylint: disable=no-member
+
+            root_elem = self.gpx_etree.getroot()
+
+            # find all gpx_trackpoints of all segments of all tracks
+            self.gpx_trackpoints.extend(root_elem.findall(".//gpx:trkpt", namespaces=SCHEMAMAP))
+            record["points"] = len(self.gpx_trackpoints)
 
-        self.gpx_etree = etree.parse(self.gpx_file)  # pylint: disable=no-member
+        with self._stage("validate") as record:
+            valid = self._is_valid(validation)
+            record["points"] = len(self.gpx_trackpoints)
 
-        if not self._is_valid():
+        if not valid:
             if force:
                 logging.getLogger("gpx").warning("--force option is set.\
                 I try to continue processing your broken GPX file. \
@@ -84,88 +249,305 @@ class Gpx(object):
             else:
                 raise ValueError("Invalid GPX File.")
 
-        root_elem = self.gpx_etree.getroot()
-
-        # find all gpx_trackpoints of all segments of all tracks
-        self.gpx_trackpoints.extend(root_elem.findall(".//gpx:trkpt", namespaces=SCHEMAMAP))
-
 
     def _extract_geo_data(self):
         """extract latitude, longitude, elevation and timestamp of each waypoint of the gpx.
         store values in geo_data attributes
+
+        In columnar mode the values are collected in typed arrays, the differential values are calculated
+        vectorized (see _set_points).
         """
         self.date = self.gpx_trackpoints[0].find("gpx:time", namespaces=SCHEMAMAP).text
         starttime = convert_date_to_timestamp(self.date)
+        writer = None
+        if self.point_store is not None:
+            writer = PointStoreWriter()
+            writer.start(self.date, starttime)
 
+        if self.columnar:
+            timestamps, lats, lons, elevations = array("d"), array("d"), array("d"), array("d")
+        else:
+            timestamps, lats, lons, elevations = [], [], [], []
+        float_timestamps = isinstance(starttime, float)
         for trkpt in self.gpx_trackpoints:
-            date = trkpt.find("gpx:time", namespaces=SCHEMAMAP).text
-            lon = trkpt.get("lon")
-            lat = trkpt.get("lat")
             elevation_element = trkpt.find("gpx:ele", namespaces=SCHEMAMAP)
             if elevation_element is None:  # Skip incomplete trackpoints
                 continue
+            timestamp = convert_date_to_timestamp(trkpt.find("gpx:time", namespaces=SCHEMAMAP).text)
+            if not float_timestamps and isinstance(timestamp, float):
+                float_timestamps = True
+            lat = float(trkpt.get("lat"))
+            lon = float(trkpt.get("lon"))
+            elevation = float(elevation_element.text)
+            timestamps.append(timestamp)
+            lats.append(lat)
+            lons.append(lon)
+            elevations.append(elevation)
+            if writer is not None:
+                writer.add(timestamp, lat, lon, elevation)
+
+        if writer is not None:
+            if writer.count:
+                writer.write(self.point_store)
+            else:
+                writer.close()
+
+        if self.columnar:
+            numpy = gpx_arrays.numpy
+            timestamps = numpy.frombuffer(timestamps, dtype=numpy.float64)
+            if not float_timestamps:  # whole seconds, unless the gpx file contains fractional seconds
+                timestamps = timestamps.astype(numpy.int64)
+            lats, lons, elevations = (numpy.frombuffer(column, dtype=numpy.float64)
+                                      for column in (lats, lons, elevations))
+        self._set_points(starttime, timestamps, lats, lons, elevations)
+
+
+    def _load_point_store(self):
+        """fill geo_data from the point store gpx_file, following the rules of _extract_geo_data
+        """
+        store = PointStore(self.gpx_file)
+        if store.count == 0:
+            raise ValueError("No complete trackpoints found in GPX File.")
+        self.date = store.date
+        self._set_points(store.starttime, *store.columns(arrays=self.columnar))
 
-            elevation = elevation_element.text
-            timestamp = convert_date_to_timestamp(date)
 
-            if len(self.geo_data["absolute_timestamps"]) == 0:
+    def _set_points(self, starttime, timestamps, lats, lons, elevations):
+        """fill geo_data from the absolute timestamps, coordinates and elevations of the complete trackpoints,
+        with the relative and differential timestamps and the activity of each point
+
+        @param timestamps, lats, lons, elevations: numpy arrays in columnar mode, else lists
+        """
+        if self.columnar:
+            numpy = gpx_arrays.numpy
+            differential_timestamps = numpy.zeros(len(timestamps), dtype=timestamps.dtype)
+            differential_timestamps[1:] = numpy.diff(timestamps)
+            active = differential_timestamps < activity.PAUSE_SECONDS  # see lib.activity.is_active
+            active[:1] = True
+            self.geo_data.update({
+                "absolute_timestamps": timestamps,
+                "relative_timestamps": timestamps - starttime,
+                "differential_timestamps": differential_timestamps,
+                "elevations": elevations,
+                "lons": lons,
+                "lats": lats,
+                "active": active,
+            })
+            return
+
+        previous = None
+        for timestamp in timestamps:
+            if previous is None:
                 self.geo_data["differential_timestamps"].append(0)  # first element
                 self.geo_data["active"].append(True)
             else:
-                delta = timestamp - self.geo_data["absolute_timestamps"][-1]
+                delta = timestamp - previous
                 self.geo_data["differential_timestamps"].append(delta)
-                if delta < 30:  # consider inactive (e.g. break)  if more than 30 sec between two points
-                    self.geo_data["active"].append(True)
-                else:
-                    self.geo_data["active"].append(False)
-
-            self.geo_data["absolute_timestamps"].append(timestamp)
+                self.geo_data["active"].append(is_active(delta))  # inactive (e.g. break), if too much time between two points
             self.geo_data["relative_timestamps"].append(timestamp - starttime)
-            self.geo_data["elevations"].append(float(elevation))
-            self.geo_data["lons"].append(float(lon))
-            self.geo_data["lats"].append(float(lat))
+            previous = timestamp
+        self.geo_data["absolute_timestamps"] = timestamps
+        self.geo_data["elevations"] = elevations
+        self.geo_data["lons"] = lons
+        self.geo_data["lats"] = lats
+
+
+    def _filter_elevations(self):
+        """smooth the elevations of geo_data with the configured elevation filters
+        """
+        if not self.elevation_filter.filters:
+            return
+        if self.columnar:
+            self.geo_data["elevations"] = self.elevation_filter.apply_array(self.geo_data["elevations"])
+        else:
+            self.geo_data["elevations"] = self.elevation_filter.apply(self.geo_data["elevations"])
 
 
     def _calc_diff_geo_data(self):
         """calculate the differential values of geo_data
         """
-        for elevation1, lat1, lon1, elevation2, lat2, lon2, active in zip(
+        if self.columnar:
+            gpx_arrays.calc_diff_geo_data(self.geo_data)
+            return
+
+        for index, (elevation1, lat1, lon1, elevation2, lat2, lon2) in enumerate(zip(
                 self.geo_data["elevations"][:-1],
                 self.geo_data["lats"][:-1],
                 self.geo_data["lons"][:-1],
                 self.geo_data["elevations"][1:],
                 self.geo_data["lats"][1:],
-                self.geo_data["lons"][1:],
-                self.geo_data["active"][:-1]):
+                self.geo_data["lons"][1:]), 1):
 
             diff_dist = distance_between(lon1, lon2, lat1, lat2)
-            if diff_dist <= 0.75:  # consider inactive (not moving), if diff distance < 0.75m between two points
-                active = False
+            if not is_moving(diff_dist):  # consider inactive (not moving), if the points are too close
+                self.geo_data["active"][index] = False
 
-            self.geo_data["differential_distances"].append(distance_between(lon1, lon2, lat1, lat2))
+            self.geo_data["differential_distances"].append(diff_dist)
             self.geo_data["differential_ascent"].append(ascent_between(elevation1, elevation2))
             self.geo_data["differential_descent"].append(descent_between(elevation1, elevation2))
 
+        implausible = 0
         for diff_time, diff_dist in zip(self.geo_data["differential_timestamps"], self.geo_data["differential_distances"]):
             if diff_time == 0:
                 continue
             diff_speed = float(diff_dist) / float(diff_time)
 
-            if diff_speed > 30:  # Set diff speed to zero, if calc speed is greater than 110km/h (30m/s)
+            if diff_speed > activity.MAX_SPEED:  # Set diff speed to zero, if calc speed is implausible (see lib.activity)
                 diff_speed = 0
-                print("Ignoring calculated speed greater than 110km/h")
+                implausible += 1
             self.geo_data["differential_speed"].append(diff_speed)
+        if implausible:
+            logging.getLogger("gpx").debug("Ignored %d implausible calculated speeds", implausible)
+
+
+    def iter_trackpoints(self, force=False, validation=VALIDATION_FULL, timer=None):
+        """parse the gpx file incrementally and yield one trackpoint at a time
+
+        Consumed elements are cleared right away, so memory usage does not grow with the track length.
+        The schema is validated while parsing. With force, an invalid element can only be detected after
+        the preceding points were already emitted, so the schema validation falls back to structural checks.
+
+        @param force: boolean decision whether to continue processing the file on validation error
+        @param validation: validation policy, one of VALIDATION_POLICIES
+        @param timer: optional lib.instrumentation.LapTimer, laps parse (iterparse and schema validation),
+            validate (structural checks) and extract (reading the child elements) per trackpoint
+        @return: generator of (date, lat, lon, elevation) tuples, elevation is None if missing
+        """
+        if validation == VALIDATION_FULL and force:
+            logging.getLogger("gpx").warning("--force option is set. Using structural validation of streamed GPX file.")
+            validation = VALIDATION_STRUCTURAL
+
+        with open_gpx_file(self.gpx_file) as gpx_stream:
+            yield from self._iter_trackpoint_elements(gpx_stream, force, validation, timer)
+
+
+    def _iter_trackpoint_elements(self, gpx_stream, force, validation, timer=None):
+        if validation == VALIDATION_FULL:
+            context = etree.iterparse(gpx_stream, events=("end",), tag=TRKPT_TAG,  # pylint: disable=no-member
+                                      schema=get_xmlschema())
+        else:
+            context = etree.iterparse(gpx_stream, events=("end",), tag=TRKPT_TAG)  # pylint: disable=no-member
+
+        try:
+            for _, trkpt in context:
+                if timer is not None:
+                    timer.lap("parse")
+                if validation == VALIDATION_STRUCTURAL:
+                    error = check_trackpoint(trkpt)
+                    if error is None and trkpt.getroottree().getroot().tag != GPX_TAG:
+                        error = "Root element is not a GPX 1.1 gpx element"
+                    if error:
+                        logging.getLogger("validation").warning("Invalid element in GPX File in Line " +
+                                                                str(trkpt.sourceline) + ": " + error)
+                        if not force:
+                            raise ValueError("Invalid GPX File.")
+                    if timer is not None:
+                        timer.lap("validate")
+
+                date = None
+                elevation = None
+                for child in trkpt:
+                    if child.tag == TIME_TAG:
+                        date = child.text
+                    elif child.tag == ELE_TAG:
+                        elevation = float(child.text)
+                if timer is not None:
+                    timer.lap("extract")
+
+                yield date, float(trkpt.get("lat")), float(trkpt.get("lon")), elevation
+
+                # free the consumed element and all of its already processed siblings
+                trkpt.clear()
+                while trkpt.getprevious() is not None:
+                    del trkpt.getparent()[0]
+        except etree.XMLSyntaxError as e:  # pylint: disable=no-member
+            logging.getLogger("validation").warning("Invalid element in GPX File: " + str(e))
+            raise ValueError("Invalid GPX File: " + str(e))
+        finally:
+            del context
+
+
+    def _process_streaming(self, force=False, validation=VALIDATION_FULL, timer=None):
+        """feed the streamed trackpoints into running totals, without keeping geo_data lists
+
+        @param timer: optional lib.instrumentation.LapTimer, timing the work per trackpoint (see iter_trackpoints),
+            timestamps (parsing the time), point_store, filter (elevation filter) and statistics
+        """
+        self.statistics = StreamingStatistics()
+        self.elevation_filter.reset()
+        writer = PointStoreWriter() if self.point_store is not None else None
+        for number, (date, lat, lon, elevation) in enumerate(self.iter_trackpoints(force, validation, timer), 1):
+            if self.max_points is not None and number > self.max_points:
+                if writer is not None:
+                    writer.close()
+                raise ValueError("The track has more than %d trackpoints." % self.max_points)
+            if self.date is None:
+                self.date = date
+                self.statistics.start(convert_date_to_timestamp(date))
+                if writer is not None:
+                    writer.start(date, self.statistics.starttime)
+            if elevation is None:  # Skip incomplete trackpoints
+                continue
+            timestamp = convert_date_to_timestamp(date)
+            if timer is not None:
+                timer.lap("timestamps")
+            if writer is not None:
+                writer.add(timestamp, lat, lon, elevation)
+                if timer is not None:
+                    timer.lap("point_store")
+            elevation = self.elevation_filter.push(elevation)
+            if timer is not None:
+                timer.lap("filter")
+            self.statistics.add(timestamp, lat, lon, elevation)
+            if timer is not None:
+                timer.lap("statistics")
+
+        if self.date is None:
+            raise ValueError("No trackpoints found in GPX File.")
+        if writer is not None:
+            if writer.count:
+                writer.write(self.point_store)
+            else:
+                writer.close()
 
 
-    def process(self, force=False):
+    def process(self, force=False, validation=VALIDATION_FULL):
         """validate and parse the gpx file, extract and store waypoint information in lists
 
         @param force: boolean decision whether to continue processing the file on validation error
+        @param validation: validation policy, one of VALIDATION_POLICIES:
+            VALIDATION_FULL (xsd schema), VALIDATION_STRUCTURAL (trackpoints only) or VALIDATION_OFF
+            point stores were checked when they were written, they are never validated
         """
-        self._parse(force)
-        self._extract_geo_data()
-        self._calc_diff_geo_data()
-        return self.metadata()
+        if validation not in VALIDATION_POLICIES:
+            raise ValueError("Unknown validation policy: " + str(validation))
+
+        if is_point_store(self.gpx_file):
+            # the points are in memory (or memory mapped) anyway, streaming would not save anything
+            for name, stage in (("load", self._load_point_store), ("filter", self._filter_elevations),
+                                ("diff", self._calc_diff_geo_data)):
+                with self._stage(name) as record:
+                    stage()
+                    record["points"] = len(self.geo_data["lats"])
+        elif self.streaming:
+            timer = LapTimer() if self.instrumentation is not None else None
+            with self._stage("stream") as record:
+                self._process_streaming(force, validation, timer)
+                record["points"] = self.statistics.point_count
+                if timer is not None:
+                    record["substages"] = timer.seconds
+        else:
+            self._parse(force, validation)
+            for name, stage in (("extract", self._extract_geo_data), ("filter", self._filter_elevations),
+                                ("diff", self._calc_diff_geo_data)):
+                with self._stage(name) as record:
+                    stage()
+                    record["points"] = len(self.geo_data["lats"])
+
+        with self._stage("metadata") as record:
+            metadata = self.metadata()
+            record["points"] = self.statistics.point_count if self.statistics is not None else len(self.geo_data["lats"])
+        return metadata
 
 
     def gpx_update_elevation(self):
@@ -182,6 +564,9 @@ class Gpx(object):
     def metadata(self):
         """return all metadata as dictionary
         """
+        if self.statistics is not None:
+            return self.statistics.metadata(self.skip_inactive, self.date)
+
         return {
             "total_distance": total_distance(self.geo_data, self.skip_inactive),
             "duration": total_duration(self.geo_data, self.skip_inactive),
@@ -195,6 +580,86 @@ class Gpx(object):
 
 
 
+class StreamingStatistics(object):
+    """Running totals of a track, updated point by point.
+
+    Applies the same rules as _extract_geo_data, _calc_diff_geo_data and the geo_data level
+    helper functions, so metadata() matches Gpx.metadata() of the list based processing.
+    """
+
+    def __init__(self):
+        self.point_count = 0
+        self.starttime = None
+        self.last_timestamp = None
+        self.last_lat = None
+        self.last_lon = None
+        self.last_elevation = None
+        self.relative_time = 0
+        self.inactive_time = 0
+        self.distance = 0.0
+        self.active_distance = 0.0
+        self.ascent = 0.0
+        self.descent = 0.0
+        self.max_diff_speed = 0
+
+
+    def start(self, timestamp):
+        """set the reference time for relative timestamps (time of the first trackpoint)
+        """
+        self.starttime = timestamp
+
+
+    def add(self, timestamp, lat, lon, elevation):
+        """add the next complete trackpoint to the totals
+        """
+        if self.point_count > 0:
+            delta = timestamp - self.last_timestamp
+            diff_dist = distance_between(self.last_lon, lon, self.last_lat, lat)
+            # consider inactive if too much time between two points (e.g. break) or if they are too close (not moving)
+            active = is_active(delta) and is_moving(diff_dist)
+            if not active:
+                self.inactive_time += delta
+
+            self.distance += diff_dist
+            if active:
+                self.active_distance += diff_dist
+            self.ascent += ascent_between(self.last_elevation, elevation)
+            self.descent += descent_between(self.last_elevation, elevation)
+
+            if delta != 0:
+                diff_speed = clamp_speed(float(diff_dist) / float(delta))
+                if diff_speed > self.max_diff_speed:
+                    self.max_diff_speed = diff_speed
+
+        self.point_count += 1
+        self.last_timestamp = timestamp
+        self.last_lat = lat
+        self.last_lon = lon
+        self.last_elevation = elevation
+        self.relative_time = timestamp - self.starttime
+
+
+    def metadata(self, skip_inactive, date):
+        """return all metadata as dictionary, same layout as Gpx.metadata()
+        """
+        if self.point_count == 0:
+            raise ValueError("No complete trackpoints found in GPX File.")
+
+        duration = self.relative_time - self.inactive_time if skip_inactive else self.relative_time
+        distance = self.active_distance if skip_inactive else self.distance
+        return {
+            "total_distance": distance,
+            "duration": duration,
+            "total_duration": self.relative_time,
+            "total_ascent": self.ascent,
+            "total_descent": self.descent,
+            "avg_speed": 3.6 * distance / float(duration),
+            "max_speed": round(self.max_diff_speed * 3.6, 1),
+            "date": date,
+        }
+
+
+
 # Helper functions at trackpoint level
 
 def distance_between(lon1, lon2, lat1, lat2):
@@ -249,6 +714,9 @@ def total_duration(geo_data, skip_inactive):
     @param: geo_data: dict with geografic data
     @param: skip_inactive: consider only trackpoints with movement (active)
     """
+    if gpx_arrays.is_columnar(geo_data):
+        return gpx_arrays.total_duration(geo_data, skip_inactive)
+
     rel_time = geo_data["relative_timestamps"][-1]
 
     if skip_inactive:
@@ -266,6 +734,9 @@ def total_distance(geo_data, skip_inactive):
     @param: geo_data: dict with geografic data
     @param: skip_inactive: consider only trackpoints with movement (active)
     """
+    if gpx_arrays.is_columnar(geo_data):
+        return gpx_arrays.total_distance(geo_data, skip_inactive)
+
     sum_distance = 0.0
     for distance, active in zip(geo_data["differential_distances"], geo_data["active"]):
         if skip_inactive and active == False:
@@ -278,6 +749,9 @@ def total_distance(geo_data, skip_inactive):
 def avg_speed(geo_data, skip_inactive):
     """return the average speed in km/h as float
     """
+    if gpx_arrays.is_columnar(geo_data):
+        return gpx_arrays.avg_speed(geo_data, skip_inactive)
+
     speed = 3.6 * total_distance(geo_data, skip_inactive) / float(total_duration(geo_data, skip_inactive))
     return speed
 
@@ -286,30 +760,31 @@ def avg_speed(geo_data, skip_inactive):
 def max_speed(geo_data):
     """return the max. speed  in km/h as float
     """
+    if gpx_arrays.is_columnar(geo_data):
+        return gpx_arrays.max_speed(geo_data)
+
     max_speed = max(geo_data["differential_speed"])
     max_speed = round(max_speed * 3.6, 1)  # differential_speed is in m/s, we need km/h
     return max_speed
 
 
 
-# TODO: unify distance_in_time and total_distance
 def distance_in_time(geo_data, start_time=0, end_time=float("inf")):
     """return the distance between start_time and end_time
-    """
-    sum_distance = 0
-
-    for number, distance in enumerate(geo_data["differential_distances"]):
-        if geo_data["relative_timestamps"][number] > end_time:
-            break
-        if geo_data["relative_timestamps"][number] >= start_time:
-            sum_distance += distance
 
-    return sum_distance
+    For many windows of the same track, use lib.segments.TrackSegments, which accumulates the distances once.
+    """
+    first = bisect_left(geo_data["relative_timestamps"], start_time)
+    last = bisect_right(geo_data["relative_timestamps"], end_time)
+    return sum(geo_data["differential_distances"][first:last])
 
 
 def total_ascent(geo_data):
     """return the total ascent in meters
     """
+    if gpx_arrays.is_columnar(geo_data):
+        return gpx_arrays.total_ascent(geo_data)
+
     sum_ascent = 0.0
     for ascent in geo_data["differential_ascent"]:
         sum_ascent += ascent
@@ -320,6 +795,9 @@ def total_ascent(geo_data):
 def total_descent(geo_data):
     """return the total descent in meters
     """
+    if gpx_arrays.is_columnar(geo_data):
+        return gpx_arrays.total_descent(geo_data)
+
     sum_descent = 0.0
     for ascent in geo_data["differential_descent"]:
         sum_descent += ascent
@@ -328,11 +806,40 @@ def total_descent(geo_data):
 
 
 # Generic helper functions:
-def convert_date_to_timestamp(date):
-    """take a date (as defined in gpx standard), return the corresponding timestamp
 
-    @return: timestamp
+# ISO-8601 date time as used in gpx files: 2015-08-16T09:00:50Z, 2015-08-16T09:00:50.250+02:00, ...
+ISO_DATE_REGEX = re.compile(r"^(\d{4}-\d{2}-\d{2})T(\d{2}):(\d{2}):(\d{2})(\.\d+)?(Z|[+-]\d{2}:?\d{2})?$")
+
+
+@lru_cache(maxsize=1024)
+def _day_to_timestamp(day):
+    """return the UTC timestamp of midnight of a date prefix "YYYY-MM-DD"
+
+    cached, because all trackpoints of a track share very few distinct days
     """
-    date_format = "%Y-%m-%dT%H:%M:%SZ"
+    return calendar.timegm((int(day[0:4]), int(day[5:7]), int(day[8:10]), 0, 0, 0))
+
+
+def convert_date_to_timestamp(date):
+    """take a date (as defined in gpx standard), return the corresponding UTC timestamp
+
+    Supports fractional seconds and timezone offsets, a date without timezone is considered as UTC.
 
-    return int(time.mktime(datetime.datetime.strptime(date, date_format).timetuple()))
+    @return: timestamp (int, float if the date has a fractional part)
+    """
+    # fast path for the most common format "YYYY-MM-DDTHH:MM:SSZ"
+    if len(date) == 20 and date[19] == "Z" and date[10] == "T":
+        return _day_to_timestamp(date[:10]) + int(date[11:13]) * 3600 + int(date[14:16]) * 60 + int(date[17:19])
+
+    match = ISO_DATE_REGEX.match(date.strip())
+    if match is None:
+        raise ValueError("Invalid date in GPX File: " + str(date))
+    day, hour, minute, second, fraction, zone = match.groups()
+
+    timestamp = _day_to_timestamp(day) + int(hour) * 3600 + int(minute) * 60 + int(second)
+    if zone and zone != "Z":
+        offset = int(zone[1:3]) * 3600 + int(zone[-2:]) * 60
+        timestamp = timestamp - offset if zone[0] == "+" else timestamp + offset
+    if fraction and float(fraction) != 0:
+        timestamp += float(fraction)
+    return timestamp
@@ -0,0 +1,119 @@
+"""columnar representation of geo_data, backed by numpy arrays
+
+The differential values and aggregates are calculated in vectorized passes over the whole track,
+following the same rules as the list based functions in lib.gpx.
+numpy is an optional dependency: check available() before using this module.
+"""
+
+try:
+    import numpy
+except ImportError:  # numpy is optional, the list based processing in lib.gpx works without it
+    numpy = None
+
+from . import activity
+
+EARTH_RADIUS = 6379000  # Radius of earth in meters, same as lib.gpx.distance_between
+
+
+def available():
+    """return True if numpy is installed and the array backend can be used
+    """
+    return numpy is not None
+
+
+def is_columnar(geo_data):
+    """return True if geo_data holds numpy arrays instead of python lists
+    """
+    return numpy is not None and isinstance(geo_data.get("lats"), numpy.ndarray)
+
+
+def distances_between(lon1, lon2, lat1, lat2):
+    """vectorized haversine formula, see lib.gpx.distance_between
+
+    @return: array of distances in meters
+    """
+    lon1 = numpy.radians(lon1)
+    lon2 = numpy.radians(lon2)
+    lat1 = numpy.radians(lat1)
+    lat2 = numpy.radians(lat2)
+
+    a = numpy.sin((lat2 - lat1) / 2) ** 2 + numpy.cos(lat1) * numpy.cos(lat2) * numpy.sin((lon2 - lon1) / 2) ** 2  # pylint: disable=invalid-name
+    c = 2 * numpy.arctan2(numpy.sqrt(a), numpy.sqrt(1 - a))  # pylint: disable=invalid-name
+    return EARTH_RADIUS * c
+
+
+def calc_diff_geo_data(geo_data):
+    """calculate the differential values of a columnar geo_data dict in place
+
+    All differential arrays are aligned with the trackpoints, the first element is 0.
+    Trackpoints too close to their predecessor (standing still) become inactive.
+    """
+    elevations = geo_data["elevations"]
+    diff_time = geo_data["differential_timestamps"]
+
+    diff_dist = numpy.zeros(len(elevations))
+    diff_dist[1:] = distances_between(geo_data["lons"][:-1], geo_data["lons"][1:],
+                                      geo_data["lats"][:-1], geo_data["lats"][1:])
+
+    diff_ele = numpy.zeros(len(elevations))
+    diff_ele[1:] = numpy.diff(elevations)
+
+    moving = diff_dist > activity.STILL_DISTANCE  # see lib.activity.is_moving
+    moving[:1] = True
+    geo_data["active"] = geo_data["active"] & moving
+
+    diff_speed = numpy.zeros(len(elevations))
+    timed = diff_time != 0
+    diff_speed[timed] = diff_dist[timed] / diff_time[timed]
+    diff_speed[diff_speed > activity.MAX_SPEED] = 0  # Ignore implausible calculated speeds (see lib.activity)
+
+    geo_data["differential_distances"] = diff_dist
+    geo_data["differential_ascent"] = numpy.clip(diff_ele, 0, None)
+    geo_data["differential_descent"] = numpy.clip(-diff_ele, 0, None)
+    geo_data["differential_speed"] = diff_speed
+
+
+# Aggregates on columnar geo_data, see the functions with the same name in lib.gpx
+def total_duration(geo_data, skip_inactive):
+    """return the total duration in sec
+    """
+    if len(geo_data["relative_timestamps"]) == 0:
+        raise IndexError("geo_data contains no trackpoints")
+
+    rel_time = geo_data["relative_timestamps"][-1]
+    if skip_inactive:
+        rel_time -= geo_data["differential_timestamps"][~geo_data["active"]].sum()
+    return rel_time.item()
+
+
+def total_distance(geo_data, skip_inactive):
+    """return the total distance in meters
+    """
+    distances = geo_data["differential_distances"]
+    if skip_inactive:
+        distances = distances[geo_data["active"]]
+    return float(distances.sum())
+
+
+def avg_speed(geo_data, skip_inactive):
+    """return the average speed in km/h as float
+    """
+    return 3.6 * total_distance(geo_data, skip_inactive) / float(total_duration(geo_data, skip_inactive))
+
+
+def max_speed(geo_data):
+    """return the max. speed in km/h as float
+    """
+    return round(float(geo_data["differential_speed"].max()) * 3.6, 1)
+
+
+def total_ascent(geo_data):
+    """return the total ascent in meters
+    """
+    return float(geo_data["differential_ascent"].sum())
+
+
+def total_descent(geo_data):
+    """return the total descent in meters
+    """
+    return float(geo_data["differential_descent"].sum())
@@ -0,0 +1,113 @@
+"""content hashing of gpx files and on-disk cache of processing results
+
+Results of Gpx.process are stored as json files, keyed by the content hash of the gpx file.
+The cache directory is split by STATISTICS_VERSION, so a change of the statistics calculation
+invalidates all cached results at once. The activity thresholds (lib.activity) are part of the key.
+"""
+
+import os
+import glob
+import json
+import hashlib
+import tempfile
+from . import activity
+from .gpx import STATISTICS_VERSION, open_gpx_file
+
+HASH_CHUNK_SIZE = 64 * 1024
+
+
+def hash_stream(stream):
+    """return the sha256 hex digest of a binary file-like object, read in chunks
+    """
+    content_hash = hashlib.sha256()
+    for chunk in iter(lambda: stream.read(HASH_CHUNK_SIZE), b""):
+        content_hash.update(chunk)
+    return content_hash.hexdigest()
+
+
+def hash_file(path):
+    """return the sha256 hex digest of the file content, of the uncompressed content for gzip compressed gpx files
+    """
+    with open_gpx_file(path) as gpx_file:
+        return hash_stream(gpx_file)
+
+
+def hash_bytes(content):
+    """return the sha256 hex digest of a bytes object
+    """
+    return hashlib.sha256(content).hexdigest()
+
+
+def read_json(path):
+    """return the content of a json file, None if the file is missing or broken
+    """
+    try:
+        with open(path, "r") as json_file:
+            return json.load(json_file)
+    except (OSError, ValueError):
+        return None
+
+
+def write_json(path, data):
+    """write data to a json file atomically, so concurrent workers never read partial files
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as json_file:
+            json.dump(data, json_file, separators=(",", ":"))
+        os.replace(tmp_path, path)
+    except OSError:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+class ResultCache(object):
+    """On-disk cache of Gpx.process results
+
+    @param cache_dir: base directory of the cache, created on first write
+    @param version: version of the statistics calculation, cached results of other versions are ignored
+    """
+
+    def __init__(self, cache_dir, version=STATISTICS_VERSION):
+        self.cache_dir = os.path.join(cache_dir, "v%s" % version)
+
+
+    def _path(self, content_hash, skip_inactive, elevation_filter):
+        options = "%d_%s" % (skip_inactive, activity.fingerprint())
+        if elevation_filter:
+            options += "_" + hash_bytes(elevation_filter.encode())[:12]
+        return os.path.join(self.cache_dir, content_hash[:2], "%s_%s.json" % (content_hash, options))
+
+
+    def get(self, content_hash, skip_inactive=True, elevation_filter=""):
+        """return the cached metadata of the gpx file with the given content hash, None if not cached
+
+        @param elevation_filter: specification of the elevation filters, see lib.elevation.parse_filters
+        """
+        return read_json(self._path(content_hash, skip_inactive, elevation_filter))
+
+
+    def put(self, content_hash, metadata, skip_inactive=True, elevation_filter=""):
+        """store the metadata of the gpx file with the given content hash
+        """
+        write_json(self._path(content_hash, skip_inactive, elevation_filter), metadata)
+
+
+    def remove(self, content_hash):
+        """remove the cached metadata of the gpx file with the given content hash, of all processing options
+        """
+        for path in glob.glob(os.path.join(self.cache_dir, content_hash[:2], "%s_*.json" % content_hash)):
+            os.remove(path)
+
+
+    def process(self, gpx, content_hash, **kwargs):
+        """return the cached metadata of gpx, call gpx.process(**kwargs) and store the result if not cached
+        """
+        elevation_filter = gpx.elevation_filter.spec()
+        metadata = self.get(content_hash, gpx.skip_inactive, elevation_filter)
+        if metadata is None:
+            metadata = gpx.process(**kwargs)
+            self.put(content_hash, metadata, gpx.skip_inactive, elevation_filter)
+        return metadata
@@ -0,0 +1,112 @@
+"""single pass handling of uploaded gpx files
+
+The chunks of an upload are written (optionally gzip compressed) to a temporary file and hashed at the same time,
+so the upload is read only once while it is received. Oversized files are detected while receiving the data,
+the rest of the upload is then discarded.
+The xml is parsed once afterwards by the background job processing the upload (see ingest.py): the streamed parse
+validates the schema, enforces the trackpoint limit and calculates the statistics in one pass.
+"""
+
+import os
+import zlib
+import hashlib
+import tempfile
+
+
+class GpxUploadWriter(object):
+    """writable and readable file object receiving an upload, e.g. as werkzeug file stream
+
+    @param upload_dir: directory of the temporary file, should be on the file system of the final location
+    @param max_bytes: maximum file size, None for no limit
+    @param compress_level: gzip compression level of the stored file, None to store it uncompressed
+        the size limit and the content hash refer to the uncompressed content
+    """
+
+    def __init__(self, upload_dir, max_bytes=None, compress_level=None):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.error = None  # reason of the rejection, further data is discarded
+        self.hash = hashlib.sha256()
+        os.makedirs(upload_dir, exist_ok=True)
+        self.file = tempfile.NamedTemporaryFile(dir=upload_dir, suffix=".part", delete=False)
+        self.compressor = zlib.compressobj(compress_level, zlib.DEFLATED, 16 + zlib.MAX_WBITS) \
+            if compress_level is not None else None
+        self.finished = False
+
+
+    def write(self, chunk):
+        if self.error is not None:
+            return len(chunk)
+        self.size += len(chunk)
+        if self.max_bytes is not None and self.size > self.max_bytes:
+            self._reject("The file is larger than %g MB." % (self.max_bytes / 2 ** 20))
+            return len(chunk)
+
+        self._append(self.compressor.compress(chunk) if self.compressor is not None else chunk)
+        self.hash.update(chunk)
+        return len(chunk)
+
+
+    def _append(self, data):
+        # werkzeug seeks to the start after the last chunk, the gzip trailer still belongs to the end
+        self.file.seek(0, os.SEEK_END)
+        self.file.write(data)
+
+
+    def _reject(self, error):
+        self.error = error
+        self.compressor = None
+        self.file.truncate(0)
+
+
+    def finish(self):
+        """complete the stored file after the last chunk
+
+        @return: None if the upload is accepted, else the reason of the rejection
+        """
+        if self.error is None and self.compressor is not None:
+            self._append(self.compressor.flush())
+        self.compressor = None
+        return self.error
+
+
+    @property
+    def content_hash(self):
+        """sha256 hex digest of the received content
+        """
+        return self.hash.hexdigest()
+
+
+    def save(self, fspath):
+        """move the received file to its final location
+        """
+        self.file.close()
+        os.replace(self.file.name, fspath)
+        self.finished = True
+
+
+    # file object interface used by werkzeug after the upload is received, reads the stored (compressed) content
+    def read(self, *args):
+        return self.file.read(*args)
+
+
+    def readline(self, *args):
+        return self.file.readline(*args)
+
+
+    def seek(self, *args):
+        return self.file.seek(*args)
+
+
+    def tell(self):
+        return self.file.tell()
+
+
+    def close(self):
+        """close and remove the temporary file, if it was not saved
+        """
+        if not self.finished:
+            self.file.close()
+            if os.path.exists(self.file.name):
+                os.remove(self.file.name)
+            self.finished = True
@@ -0,0 +1,150 @@
+"""opt-in instrumentation of the gpx processing stages
+
+Gpx calls instrumentation.stage(name) around every processing stage (parse, validate, extract, filter,
+diff, metadata; stream in streaming mode; load of point stores) and stores the number of processed
+trackpoints in the yielded record.
+StageRecorder records duration, point count and (optionally) allocated memory of each stage,
+StageStatistics aggregates the records of many files, e.g. for a metrics endpoint.
+Stages repeated per trackpoint (e.g. parse, timestamps and statistics inside the streamed loop) are timed
+with a LapTimer and reported as substages of the enclosing stage, named "<stage>.<substage>".
+"""
+
+import time
+import threading
+import tracemalloc
+from contextlib import contextmanager
+
+# tracemalloc is process wide: stages measuring memory run one at a time, so their peaks do not mix
+_TRACE_LOCK = threading.RLock()
+
+
+class LapTimer(object):
+    """accumulate the time between consecutive laps per name, for substages repeated per trackpoint
+
+    Every lap(name) adds the time since the previous lap (or the creation) to name.
+    """
+
+    def __init__(self):
+        self.seconds = {}
+        self.mark = time.perf_counter()
+
+
+    def lap(self, name):
+        now = time.perf_counter()
+        self.seconds[name] = self.seconds.get(name, 0.0) + now - self.mark
+        self.mark = now
+
+
+class StageRecorder(object):
+    """record the stages of processing one gpx file
+
+    @param trace_memory: measure python heap allocations of every stage with tracemalloc (slow),
+        tracing is started on first use and stays on, measured stages of concurrent threads run one at a time
+    @param callback: function called with every finished stage record
+    """
+
+    def __init__(self, trace_memory=False, callback=None):
+        self.trace_memory = trace_memory
+        self.callback = callback
+        self.records = []
+
+
+    @contextmanager
+    def stage(self, name):
+        """context manager around one stage, yields the record dict, the caller may set record["points"]
+        and record["substages"] (dict of name: seconds, e.g. LapTimer.seconds)
+        """
+        if not self.trace_memory:
+            with self._record(name) as record:
+                yield record
+            return
+        with _TRACE_LOCK:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            with self._record(name) as record:
+                memory_before = tracemalloc.get_traced_memory()[0]
+                tracemalloc.reset_peak()
+                try:
+                    yield record
+                finally:
+                    memory_after, memory_peak = tracemalloc.get_traced_memory()
+                    record["allocated_bytes"] = memory_after - memory_before
+                    record["peak_bytes"] = memory_peak - memory_before
+
+
+    @contextmanager
+    def _record(self, name):
+        record = {"stage": name, "seconds": None, "points": None, "allocated_bytes": None, "peak_bytes": None}
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record["seconds"] = time.perf_counter() - start
+            substages = record.pop("substages", None) or {}
+            self._add(record)
+            for substage, seconds in substages.items():
+                self._add({"stage": "%s.%s" % (name, substage), "seconds": seconds, "points": record["points"],
+                           "allocated_bytes": None, "peak_bytes": None, "parent": name})
+
+
+    def _add(self, record):
+        self.records.append(record)
+        if self.callback is not None:
+            self.callback(record)
+
+
+    def total_seconds(self):
+        return sum(record["seconds"] for record in self.records if "parent" not in record)
+
+
+    def summary(self):
+        """return a short one line description of all stages, e.g. for logging
+        """
+        parts = []
+        for record in self.records:
+            part = "%s %.3fs" % (record["stage"], record["seconds"])
+            if record["points"] is not None:
+                part += " %d pts" % record["points"]
+            if record["allocated_bytes"] is not None:
+                part += " %+.1fMB" % (record["allocated_bytes"] / 2 ** 20)
+            parts.append(part)
+        return ", ".join(parts)
+
+
+class StageStatistics(object):
+    """thread safe aggregate of the stage records of many processed files
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.files = 0
+        self.stages = {}
+
+
+    def add(self, recorder):
+        """add the records of one processed file
+        """
+        if not recorder.records:
+            return
+        with self.lock:
+            self.files += 1
+            for record in recorder.records:
+                stage = self.stages.setdefault(record["stage"], {
+                    "count": 0, "total_seconds": 0.0, "max_seconds": 0.0, "points": 0, "allocated_bytes": 0})
+                stage["count"] += 1
+                stage["total_seconds"] += record["seconds"]
+                stage["max_seconds"] = max(stage["max_seconds"], record["seconds"])
+                stage["points"] += record["points"] or 0
+                stage["allocated_bytes"] += record["allocated_bytes"] or 0
+
+
+    def as_dict(self):
+        """return the aggregates with average duration and throughput per stage
+        """
+        with self.lock:
+            stages = {}
+            for name, stage in self.stages.items():
+                stages[name] = dict(stage)
+                stages[name]["avg_seconds"] = stage["total_seconds"] / stage["count"]
+                stages[name]["points_per_second"] = stage["points"] / stage["total_seconds"] if stage["total_seconds"] else None
+            return {"files": self.files, "stages": stages}
@@ -0,0 +1,238 @@
+"""compact binary store of the extracted trackpoints of a track
+
+Re-analysis of a track (statistics, filters, geometry) reads this file instead of parsing and validating the xml.
+It holds the complete trackpoints (with elevation) as fixed-width columns, before any elevation filter:
+
+    header      magic, version, flags, point count, start timestamp, length of the date (32 bytes)
+    date        time of the first trackpoint as in the gpx file (utf-8, padded to 8 bytes)
+    timestamps  int32 deltas to the previous point, the first relative to the start timestamp
+                (float64 offsets to the start timestamp, if the gpx file contains fractional seconds)
+    lats, lons, elevations   float64
+
+All values are little endian and every column starts at a multiple of 8 bytes, so the columns
+can be memory mapped as numpy arrays (columnar processing), else they are read into lists.
+"""
+
+import os
+import sys
+import struct
+import tempfile
+from array import array
+from . import gpx_arrays
+
+MAGIC = b"TRKDBPTS"
+VERSION = 1
+HEADER = struct.Struct("<8sHHIdI4x")
+FLAG_FLOAT_TIMESTAMPS = 1
+SUFFIX = ".pts"
+SPOOL_CHUNK = 16384  # points per column kept in memory by PointStoreWriter
+
+INT32_MIN = -2 ** 31
+INT32_MAX = 2 ** 31 - 1
+
+
+def _padding(size):
+    return -size % 8
+
+
+def _little_endian_bytes(values):
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values.tobytes()
+
+
+def is_point_store(path):
+    """return True if the file at path is a point store (and not a gpx file)
+    """
+    if not isinstance(path, (str, bytes, os.PathLike)) or not os.path.isfile(path):
+        return False
+    with open(path, "rb") as store_file:
+        return store_file.read(len(MAGIC)) == MAGIC
+
+
+class PointStoreWriter(object):
+    """collect the complete trackpoints of a track and write them as point store
+
+    The columns are buffered in chunks of SPOOL_CHUNK points and spooled to temporary files, so the memory
+    use does not grow with the number of trackpoints (streaming processing).
+    """
+
+    def __init__(self):
+        self.date = None
+        self.starttime = None
+        self.count = 0
+        self.float_timestamps = False
+        self.previous = None
+        self.buffers = [array("d") for _ in range(4)]  # timestamp offsets to the start, lats, lons, elevations
+        self.spools = None
+
+
+    def start(self, date, starttime):
+        """set the time of the first trackpoint (as text and timestamp), the reference of the relative timestamps
+        """
+        self.date = date
+        self.starttime = starttime
+        self.previous = starttime
+        self.float_timestamps = isinstance(starttime, float)
+
+
+    def add(self, timestamp, lat, lon, elevation):
+        delta = timestamp - self.previous
+        if isinstance(delta, float) or not INT32_MIN <= delta <= INT32_MAX:
+            self.float_timestamps = True
+        self.previous = timestamp
+        offsets, lats, lons, elevations = self.buffers
+        offsets.append(timestamp - self.starttime)  # exact for integer timestamps
+        lats.append(lat)
+        lons.append(lon)
+        elevations.append(elevation)
+        self.count += 1
+        if len(offsets) >= SPOOL_CHUNK:
+            self._spool()
+
+
+    def _spool(self):
+        if self.spools is None:
+            self.spools = [tempfile.TemporaryFile() for _ in self.buffers]
+        for spool, buffer in zip(self.spools, self.buffers):
+            buffer.tofile(spool)
+            del buffer[:]
+
+
+    def _chunks(self, index):
+        """yield the spooled and buffered values of a column as arrays of at most SPOOL_CHUNK values
+        """
+        if self.spools is not None:
+            spool = self.spools[index]
+            spool.seek(0)
+            while True:
+                chunk = array("d")
+                chunk.frombytes(spool.read(SPOOL_CHUNK * chunk.itemsize))
+                if not chunk:
+                    break
+                yield chunk
+        yield array("d", self.buffers[index])
+
+
+    def _timestamp_chunks(self):
+        """yield the timestamp column: float64 offsets to the start or int32 deltas to the previous point
+        """
+        previous = 0
+        for offsets in self._chunks(0):
+            if self.float_timestamps:  # offsets instead of deltas, summing up float deltas would accumulate rounding errors
+                yield offsets
+                continue
+            deltas = array("i")
+            for offset in offsets:
+                offset = int(offset)
+                deltas.append(offset - previous)
+                previous = offset
+            yield deltas
+
+
+    def write(self, path):
+        """write the point store atomically and release the spooled columns
+        """
+        date = self.date.encode("utf-8")
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as store_file:
+                store_file.write(HEADER.pack(MAGIC, VERSION, FLAG_FLOAT_TIMESTAMPS if self.float_timestamps else 0,
+                                             self.count, float(self.starttime), len(date)))
+                store_file.write(date + b"\0" * _padding(len(date)))
+                timestamps_size = 0
+                for chunk in self._timestamp_chunks():
+                    timestamps_size += len(chunk) * chunk.itemsize
+                    store_file.write(_little_endian_bytes(chunk))
+                store_file.write(b"\0" * _padding(timestamps_size))
+                for index in (1, 2, 3):
+                    for chunk in self._chunks(index):
+                        store_file.write(_little_endian_bytes(chunk))
+            os.replace(tmp_path, path)
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        finally:
+            self.close()
+
+
+    def close(self):
+        """release the spooled columns, without writing them
+        """
+        if self.spools is not None:
+            for spool in self.spools:
+                spool.close()
+            self.spools = None
+        for buffer in self.buffers:
+            del buffer[:]
+
+
+class PointStore(object):
+    """read access to a point store
+
+    @param path: path of the point store file
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as store_file:
+            magic, version, flags, self.count, self.starttime, date_length = HEADER.unpack(store_file.read(HEADER.size))
+            if magic != MAGIC or version != VERSION:
+                raise ValueError("Unsupported point store: " + str(path))
+            self.date = store_file.read(date_length).decode("utf-8")
+        self.float_timestamps = bool(flags & FLAG_FLOAT_TIMESTAMPS)
+        if not self.float_timestamps:
+            self.starttime = int(self.starttime)
+
+        self.timestamps_offset = HEADER.size + date_length + _padding(date_length)
+        timestamp_size = 8 if self.float_timestamps else 4
+        self.lats_offset = self.timestamps_offset + self.count * timestamp_size + _padding(self.count * timestamp_size)
+        self.lons_offset = self.lats_offset + self.count * 8
+        self.elevations_offset = self.lons_offset + self.count * 8
+
+
+    def columns(self, arrays=False):
+        """return the absolute timestamps, lats, lons and elevations
+
+        @param arrays: return numpy arrays, coordinates and elevations memory mapped (read-only), requires numpy
+        @return: tuple of four lists, or numpy arrays
+        """
+        if arrays:
+            numpy = gpx_arrays.numpy
+            if self.count == 0:
+                empty = numpy.zeros(0)
+                return empty, empty, empty, empty
+            deltas = numpy.memmap(self.path, mode="r", dtype="<f8" if self.float_timestamps else "<i4",
+                                  offset=self.timestamps_offset, shape=(self.count,))
+            if self.float_timestamps:
+                timestamps = self.starttime + numpy.asarray(deltas, dtype=numpy.float64)
+            else:
+                timestamps = self.starttime + numpy.cumsum(deltas, dtype=numpy.int64)
+            return (timestamps,) + tuple(
+                numpy.memmap(self.path, mode="r", dtype="<f8", offset=offset, shape=(self.count,))
+                for offset in (self.lats_offset, self.lons_offset, self.elevations_offset))
+
+        with open(self.path, "rb") as store_file:
+            content = store_file.read()
+        deltas = array("d" if self.float_timestamps else "i")
+        deltas.frombytes(content[self.timestamps_offset:self.timestamps_offset + self.count * deltas.itemsize])
+        columns = []
+        for offset in (self.lats_offset, self.lons_offset, self.elevations_offset):
+            column = array("d")
+            column.frombytes(content[offset:offset + self.count * 8])
+            columns.append(column)
+        if sys.byteorder == "big":
+            for column in [deltas] + columns:
+                column.byteswap()
+
+        if self.float_timestamps:
+            timestamps = [self.starttime + offset for offset in deltas]
+        else:
+            timestamps = []
+            timestamp = self.starttime
+            for delta in deltas:
+                timestamp += delta
+                timestamps.append(timestamp)
+        return (timestamps,) + tuple(column.tolist() for column in columns)
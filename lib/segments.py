@@ -0,0 +1,176 @@
+"""split and segment analysis of a processed track
+
+TrackSegments accumulates distance, time, moving time, ascent and descent along the trackpoints once.
+Splits (e.g. per km), time and distance windows and best efforts (e.g. the fastest 5 km) are then answered
+by binary search and a sliding window over these cumulative series, instead of scanning geo_data per question.
+Values between two trackpoints are interpolated linearly.
+"""
+
+from bisect import bisect_left
+
+SPLIT_DISTANCE = 1000  # meters
+BEST_EFFORT_DISTANCES = (1000, 5000, 10000, 21097, 42195)  # meters
+
+
+def _interpolate(xs, ys, x):
+    """return y at x of the piecewise linear function through (xs, ys), xs is sorted ascending
+
+    On a flat section of xs (e.g. standing still), the first point reaching x is used.
+    """
+    index = bisect_left(xs, x)
+    if index == 0:
+        return ys[0]
+    if index == len(xs):
+        return ys[-1]
+    x0, x1 = xs[index - 1], xs[index]
+    if x1 == x0:
+        return ys[index]
+    return ys[index - 1] + (ys[index] - ys[index - 1]) * (x - x0) / (x1 - x0)
+
+
+class TrackSegments(object):
+    """cumulative series of a track, one value per trackpoint, the first is 0
+
+    @param times: seconds since the first trackpoint
+    @param distances: meters since the first trackpoint, without breaks (inactive) by default
+    @param moving_times: seconds of activity (no break, not standing still) since the first trackpoint
+    @param ascents: ascent in meters since the first trackpoint
+    @param descents: descent in meters since the first trackpoint
+    """
+
+    def __init__(self, times, distances, moving_times, ascents, descents):
+        self.times = times
+        self.distances = distances
+        self.moving_times = moving_times
+        self.ascents = ascents
+        self.descents = descents
+
+
+    @classmethod
+    def from_geo_data(cls, geo_data, skip_inactive=True):
+        """accumulate the differential values of the geo_data of a processed (not streamed) Gpx object
+
+        @param skip_inactive: count only the distance of active trackpoints, as the statistics (Gpx.metadata) do
+        """
+        columns = [geo_data[key] for key in ("relative_timestamps", "differential_timestamps", "active",
+                                             "differential_distances", "differential_ascent", "differential_descent")]
+        columns = [column.tolist() if hasattr(column, "tolist") else column for column in columns]
+        if not columns[0]:
+            raise ValueError("No complete trackpoints found in GPX File.")
+
+        distances = []
+        moving_times = []
+        ascents = []
+        descents = []
+        distance = moving_time = ascent = descent = 0.0
+        for diff_time, active, diff_dist, diff_ascent, diff_descent in zip(*columns[1:]):
+            if active or not skip_inactive:
+                distance += diff_dist
+            if active:  # no break and not standing still, see Gpx
+                moving_time += diff_time
+            ascent += diff_ascent
+            descent += diff_descent
+            distances.append(distance)
+            moving_times.append(moving_time)
+            ascents.append(ascent)
+            descents.append(descent)
+        return cls(columns[0], distances, moving_times, ascents, descents)
+
+
+    @property
+    def total_distance(self):
+        return self.distances[-1]
+
+
+    def time_at_distance(self, distance):
+        """return the seconds since the start, when the distance (meters) was reached
+        """
+        return _interpolate(self.distances, self.times, distance)
+
+
+    def distance_at_time(self, time):
+        """return the distance (meters) covered at time (seconds since the start)
+        """
+        return _interpolate(self.times, self.distances, time)
+
+
+    def distance_window(self, start_time, end_time):
+        """return the distance (meters) covered between two times (seconds since the start)
+        """
+        return self.distance_at_time(end_time) - self.distance_at_time(start_time)
+
+
+    def time_window(self, start_distance, end_distance):
+        """return the seconds needed between two distances (meters since the start)
+        """
+        return self.time_at_distance(end_distance) - self.time_at_distance(start_distance)
+
+
+    def section(self, start_distance, end_distance):
+        """return the statistics of the section between two distances (meters since the start) as dict
+        """
+        values = {}
+        for key, series in (("duration_s", self.times), ("moving_s", self.moving_times),
+                            ("elevation_up_m", self.ascents), ("elevation_down_m", self.descents)):
+            values[key] = (_interpolate(self.distances, series, end_distance) -
+                           _interpolate(self.distances, series, start_distance))
+        values["distance_m"] = end_distance - start_distance
+        return values
+
+
+    def splits(self, split_distance=SPLIT_DISTANCE):
+        """return the statistics of consecutive sections of split_distance meters, the last one may be shorter
+
+        @return: list of dicts with number (1 based), distance_m, duration_s, moving_s, elevation_up_m, elevation_down_m
+        """
+        splits = []
+        start = 0.0
+        while start < self.total_distance:
+            end = min(start + split_distance, self.total_distance)
+            split = self.section(start, end)
+            split["number"] = len(splits) + 1
+            splits.append(split)
+            start = end
+        return splits
+
+
+    def best_effort(self, distance):
+        """return the fastest section of the given length (meters)
+
+        Sliding window over the trackpoints as section starts, the section end moves forward with the start.
+
+        @return: dict with distance_m, duration_s and start_s (seconds since the start of the track),
+            None if the track is shorter
+        """
+        if distance <= 0 or distance > self.total_distance:
+            return None
+
+        best = None
+        end = 0
+        count = len(self.distances)
+        for start in range(count):
+            target = self.distances[start] + distance
+            while end < count and self.distances[end] < target:
+                end += 1
+            if end == count:
+                break
+            # interpolate the time at the target distance between the previous and the end trackpoint
+            previous = max(end - 1, start)
+            span = self.distances[end] - self.distances[previous]
+            end_time = self.times[end] if span == 0 else \
+                self.times[previous] + (self.times[end] - self.times[previous]) * (target - self.distances[previous]) / span
+            duration = end_time - self.times[start]
+            if best is None or duration < best["duration_s"]:
+                best = {"distance_m": distance, "duration_s": duration, "start_s": self.times[start]}
+        return best
+
+
+    def best_efforts(self, distances=BEST_EFFORT_DISTANCES):
+        """return the best efforts of all distances the track is long enough for
+        """
+        efforts = []
+        for distance in distances:
+            effort = self.best_effort(distance)
+            if effort is not None:
+                efforts.append(effort)
+        return efforts
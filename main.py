@@ -1,11 +1,13 @@
 # main.py
 from app import db
 from app import app as application
-from models import Track, Statistic, Tag
+from migrations import upgrade_database
 import views
+import ingest
 
 if __name__ == '__main__':
     db.connect()
-    db.create_tables([Track, Statistic, Tag])
+    upgrade_database()
     db.close()
+    ingest.start_workers(application.config["INGEST_WORKERS"], views.process_job)
     application.run()
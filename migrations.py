@@ -0,0 +1,127 @@
+# migrations.py
+# create missing tables and upgrade databases created by older versions of trackdb
+import os
+import logging
+from playhouse.migrate import SqliteMigrator, migrate
+from peewee import IntegrityError
+from app import db, APP_ROOT
+from models import Track, Statistic, Tag, TrackTag, Rollup, TrackBounds, Job, Counter, Split, BestEffort
+import rollups
+import spatial
+from lib.gpx_cache import hash_file
+from lib.geometry import geometry_from_file
+from lib import activity
+
+MODELS = [Track, Statistic, Tag, TrackTag, Rollup, TrackBounds, Job, Counter, Split, BestEffort]
+
+
+def _columns(table):
+    return [column.name for column in db.get_columns(table)]
+
+
+def _add_track_content_hash():
+    """add Track.content_hash and fill it for existing tracks
+    """
+    migrate(SqliteMigrator(db).add_column("track", "content_hash", Track.content_hash))
+
+    # select only existing columns, columns of later versions are added afterwards
+    for track in Track.select(Track.id, Track.path):  # pylint: disable=E1111
+        gpx_fspath = os.path.join(APP_ROOT, "static", track.path)
+        if not os.path.isfile(gpx_fspath):
+            continue
+        try:
+            with db.atomic():
+                Track.update(content_hash=hash_file(gpx_fspath)).where(Track.id == track.id).execute()
+        except IntegrityError:  # same file was uploaded twice before deduplication existed
+            pass
+
+
+def _normalize_tags():
+    """move the tag values stored per track into the tag table and the track/tag join table
+    """
+    with db.atomic():
+        db.execute_sql('ALTER TABLE "tag" RENAME TO "tag_old"')
+        db.create_tables([Tag, TrackTag])
+        db.execute_sql('INSERT INTO "tag" ("value") SELECT DISTINCT "value" FROM "tag_old"')
+        db.execute_sql('INSERT OR IGNORE INTO "tracktag" ("track_id", "tag_id") '
+                       'SELECT "tag_old"."track_id", "tag"."id" FROM "tag_old" '
+                       'JOIN "tag" ON "tag"."value" = "tag_old"."value"')
+        db.execute_sql('DROP TABLE "tag_old"')
+
+
+def _add_track_bounds():
+    """add the bounding box columns of Track and fill them from the gpx files of existing tracks
+    """
+    migrator = SqliteMigrator(db)
+    migrate(*[migrator.add_column("track", field, getattr(Track, field)) for field in spatial.BOUNDS_FIELDS])
+
+    for track in Track.select(Track.id, Track.name, Track.path):  # pylint: disable=E1111
+        gpx_fspath = os.path.join(APP_ROOT, "static", track.path)
+        if not os.path.isfile(gpx_fspath):
+            continue
+        try:
+            bounds = geometry_from_file(gpx_fspath)["bounds"]
+        except Exception as e:
+            print("Could not read bounding box of track '%s': %s" % (track.name, e))
+            continue
+        Track.update(**spatial.bounds_fields(bounds)).where(Track.id == track.id).execute()
+
+
+def _add_statistic_version():
+    """add Statistic.version and Statistic.elevation_filter, existing rows are recomputed by recompute.py
+    the elevation filters of uploaded tracks are taken from their jobs
+    """
+    migrator = SqliteMigrator(db)
+    migrate(migrator.add_column("statistic", "version", Statistic.version),
+            migrator.add_column("statistic", "elevation_filter", Statistic.elevation_filter))
+
+    if "job" in db.get_tables():
+        for job in Job.select(Job.track, Job.elevation_filter).where(Job.track.is_null(False), Job.elevation_filter != ""):  # pylint: disable=E1111
+            Statistic.update(elevation_filter=job.elevation_filter).where(Statistic.track == job.track_id).execute()
+
+
+def _add_statistic_activity_thresholds():
+    """add Statistic.activity_thresholds, the existing statistics were calculated with the default thresholds
+    """
+    migrator = SqliteMigrator(db)
+    migrate(migrator.add_column("statistic", "activity_thresholds", Statistic.activity_thresholds))
+    Statistic.update(activity_thresholds=activity.fingerprint(**activity.DEFAULTS)).execute()
+
+
+def upgrade_database():
+    """apply the schema changes missing in an existing database, then create all missing tables
+
+    Columns have to be added before create_tables, which also creates the indexes of existing tables.
+    """
+    tables = db.get_tables()
+
+    if "track" in tables and "content_hash" not in _columns("track"):
+        _add_track_content_hash()
+
+    if "track" in tables and "min_lat" not in _columns("track"):
+        _add_track_bounds()
+
+    if "tag" in tables and "track_id" in _columns("tag"):
+        _normalize_tags()
+
+    if "statistic" in tables and "version" not in _columns("statistic"):
+        _add_statistic_version()
+
+    if "statistic" in tables and "activity_thresholds" not in _columns("statistic"):
+        _add_statistic_activity_thresholds()
+
+    db.create_tables(MODELS)
+
+    if "track" in tables and "rollup" not in tables:  # database of a version without rollups
+        rollups.rebuild()
+
+    if "track" in tables and "trackbounds" not in tables:  # database of a version without spatial index
+        spatial.rebuild()
+
+    if "track" in tables and "split" not in tables:  # database of a version without split tables
+        Statistic.update(version=0).execute()
+        logging.getLogger("migrations").warning("Run recompute.py to analyze the splits of the existing tracks.")
+
+    if Statistic.select().where(Statistic.activity_thresholds != activity.fingerprint()).exists():
+        logging.getLogger("migrations").warning(
+            "Statistics were calculated with other activity thresholds, run recompute.py to update them.")
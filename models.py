@@ -1,11 +1,18 @@
 # models.py
 from app import db
 from peewee import *  # pylint: disable=W0614
+from playhouse.sqlite_ext import VirtualModel
 
 class Track(Model):
     name = CharField()
-    date = DateField()
+    date = DateField(index=True)
     path = CharField()
+    content_hash = CharField(null=True, unique=True)  # sha256 of the gpx file
+    # bounding box of the trackpoints
+    min_lat = FloatField(null=True)
+    min_lon = FloatField(null=True)
+    max_lat = FloatField(null=True)
+    max_lon = FloatField(null=True)
 
     class Meta:
         database = db  # This model uses the "tracks.db" database.
@@ -20,14 +27,166 @@ class Statistic(Model):
     avg_speed = FloatField()
     elevation_up_m = IntegerField()
     elevation_down_m = IntegerField()
+    version = IntegerField(default=0)  # lib.gpx.STATISTICS_VERSION of the calculation, 0 if unknown
+    elevation_filter = CharField(default="")  # elevation filters applied in the calculation
+    activity_thresholds = CharField(default="")  # lib.activity.fingerprint() of the calculation
 
     class Meta:
         database = db  # This model uses the "tracks.db" database.
 
 
-class Tag(Model):  # TODO: store tags diffently
-    track = ForeignKeyField(Track, backref="tags")
-    value = CharField()
+class Split(Model):
+    """statistics of a consecutive section (e.g. one km) of a track, see splits.py
+    """
+    track = ForeignKeyField(Track, backref="splits")
+    number = IntegerField()  # 1 based
+    distance_m = IntegerField()  # length of the section, the last one may be shorter
+    duration_s = IntegerField()
+    moving_s = IntegerField()  # without breaks and standing still
+    elevation_up_m = IntegerField()
+    elevation_down_m = IntegerField()
+
+    class Meta:
+        database = db  # This model uses the "tracks.db" database.
+        indexes = (
+            (("track", "number"), True),
+        )
+
+
+class BestEffort(Model):
+    """fastest section of a track with a given length (e.g. 5 km), see splits.py
+    """
+    track = ForeignKeyField(Track, backref="best_efforts")
+    distance_m = IntegerField()
+    duration_s = FloatField()
+    start_s = IntegerField()  # seconds since the start of the track
+
+    class Meta:
+        database = db  # This model uses the "tracks.db" database.
+        indexes = (
+            (("track", "distance_m"), True),
+        )
+
+
+class Tag(Model):
+    value = CharField(unique=True)
 
     class Meta:
         database = db  # This model uses the "tracks.db" database.
+
+
+class TrackTag(Model):
+    track = ForeignKeyField(Track, backref="track_tags")
+    tag = ForeignKeyField(Tag, backref="track_tags")
+
+    class Meta:
+        database = db  # This model uses the "tracks.db" database.
+        indexes = (
+            (("tag", "track"), True),  # filter tracks by tag
+        )
+
+
+class Rollup(Model):
+    """precomputed sums of the statistics of all tracks with a tag in a period, see rollups.py
+    """
+    tag = CharField()  # "" for all tracks
+    period = CharField()  # "" for all time, "YYYY" for a year, "YYYY-MM" for a month
+    count = IntegerField(default=0)
+    distance_m = IntegerField(default=0)
+    duration_s = IntegerField(default=0)
+    elevation_up_m = IntegerField(default=0)
+    elevation_down_m = IntegerField(default=0)
+    max_speed = FloatField(default=0)
+    avg_speed_sum = FloatField(default=0)  # sum of the average speeds of all tracks
+
+    class Meta:
+        database = db  # This model uses the "tracks.db" database.
+        indexes = (
+            (("tag", "period"), True),
+        )
+
+
+class TrackBounds(VirtualModel):
+    """R*Tree index of the track bounding boxes (32 bit floats, rounded outwards), id is the track id
+    """
+    id = IntegerField(primary_key=True)
+    min_lat = FloatField()
+    max_lat = FloatField()
+    min_lon = FloatField()
+    max_lon = FloatField()
+
+    class Meta:
+        database = db  # This model uses the "tracks.db" database.
+        extension_module = "rtree"
+
+
+class Job(Model):
+    """uploaded gpx file waiting for or finished with background processing, see ingest.py
+    """
+    name = CharField()  # track name entered in the upload form, may be empty
+    path = CharField()  # stored gpx file, relative to the static folder
+    content_hash = CharField(null=True, index=True)
+    tags = CharField(default="")  # comma separated
+    elevation_filter = CharField(default="")
+    status = CharField(index=True)  # pending, running, done or failed
+    error = TextField(null=True)
+    track = ForeignKeyField(Track, null=True, backref="jobs")  # the stored track, when done
+    created = DateTimeField()
+    updated = DateTimeField()
+
+    class Meta:
+        database = db  # This model uses the "tracks.db" database.
+
+
+class Counter(Model):
+    """named counters, e.g. the data generation, which changes with every added or deleted track
+    """
+    name = CharField(unique=True)
+    value = IntegerField(default=0)
+
+    class Meta:
+        database = db  # This model uses the "tracks.db" database.
+
+
+DATA_GENERATION = "data"  # counter of the changes of tracks and uploads shown in /show/
+
+
+def increment_counter(name=DATA_GENERATION):
+    """increment a counter, call inside the transaction of the change
+    """
+    (Counter
+     .insert(name=name, value=1)
+     .on_conflict(conflict_target=[Counter.name], update={Counter.value: Counter.value + 1})
+     .execute())
+
+
+def get_counter(name=DATA_GENERATION):
+    """return the value of a counter, 0 if it was never incremented
+    """
+    counter = Counter.get_or_none(Counter.name == name)
+    return counter.value if counter is not None else 0
+
+
+def tag_tracks(track_tags):
+    """assign tags to tracks, missing tags are created
+
+    @param track_tags: list of (track id, iterable of tag values)
+    """
+    values = set()
+    for _, tag_values in track_tags:
+        values.update(tag_values)
+    if not values:
+        return
+
+    Tag.insert_many([{"value": value} for value in values]).on_conflict_ignore().execute()
+    tag_ids = {tag.value: tag.id for tag in Tag.select().where(Tag.value.in_(values))}  # pylint: disable=E1111
+    TrackTag.insert_many([
+        {"track": track_id, "tag": tag_ids[value]}
+        for track_id, tag_values in track_tags for value in set(tag_values)
+    ]).on_conflict_ignore().execute()
+
+
+def delete_unused_tags():
+    """delete tags, that are not assigned to any track
+    """
+    Tag.delete().where(Tag.id.not_in(TrackTag.select(TrackTag.tag))).execute()
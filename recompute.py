@@ -0,0 +1,139 @@
+# recompute.py
+# recompute the statistics and split tables of stored tracks after a change of the statistics calculation in lib/gpx.py
+#
+# Only statistics calculated by an older version (lib.gpx.STATISTICS_VERSION) or with other activity thresholds
+# (ACTIVITY_* in app.py) are recomputed. Every batch
+# is committed together with its rollups, an interrupted run continues with the remaining tracks when restarted.
+#
+# usage: python3 recompute.py [--workers 4] [--batch-size 100] [--all]
+import os
+import sys
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from app import db
+from models import Track, Statistic, Tag, TrackTag, increment_counter
+import rollups
+import splits
+from migrations import upgrade_database
+from views import UPLOAD_BASE_DIR, track_points
+from lib import gpx_arrays, activity
+from lib.gpx import Gpx, STATISTICS_VERSION, VALIDATION_OFF
+
+
+def stale_statistics(recompute_all=False):
+    """return a query of the statistics to recompute, with their tracks, in the order of their ids
+
+    @param recompute_all: include statistics of the current version and activity thresholds
+    """
+    query = (Statistic
+             .select(Statistic, Track)
+             .join(Track)
+             .order_by(Statistic.id))
+    if not recompute_all:
+        query = query.where((Statistic.version < STATISTICS_VERSION) |
+                            (Statistic.activity_thresholds != activity.fingerprint()))
+    return query
+
+
+def compute_statistics(gpx_fspath, content_hash, elevation_filter):
+    """calculate the statistics and split tables of a stored track in a worker process
+
+    The trackpoints are read from the point store of the track, it is extracted from the gpx file if missing.
+    The gpx files were validated on upload, so they are not validated again.
+
+    @return: tuple (gpx metadata, splits, best efforts)
+    """
+    if content_hash is not None:
+        gpx_fspath = track_points(content_hash, gpx_fspath)
+    # else: track of a version without content hashes, whose file was missing on upgrade
+    gpx = Gpx(gpx_fspath, True, columnar=gpx_arrays.available(), elevation_filter=elevation_filter)
+    gpx_metadata = gpx.process(force=True, validation=VALIDATION_OFF)
+    return (gpx_metadata,) + splits.analyze(gpx)
+
+
+def store_batch(batch):
+    """update the statistics, rollups and split tables of a batch of recomputed tracks in one transaction
+
+    @param batch: list of (Statistic with track, (gpx metadata, splits, best efforts))
+    """
+    with db.atomic():
+        for statistic, (gpx_metadata, track_splits, best_efforts) in batch:
+            track = statistic.track
+            rollups.remove_track(track)
+            statistic.distance_m = gpx_metadata["total_distance"]
+            statistic.duration_s = gpx_metadata["duration"]
+            statistic.duration_total_s = gpx_metadata["total_duration"]
+            statistic.max_speed = gpx_metadata["max_speed"]
+            statistic.avg_speed = gpx_metadata["avg_speed"]
+            statistic.elevation_up_m = gpx_metadata["total_ascent"]
+            statistic.elevation_down_m = gpx_metadata["total_descent"]
+            statistic.version = STATISTICS_VERSION
+            statistic.activity_thresholds = activity.fingerprint()
+            statistic.save()
+            tags = [tag.value for tag in Tag.select(Tag.value).join(TrackTag).where(TrackTag.track == track)]  # pylint: disable=E1111
+            rollups.add_track(track.date, statistic, tags)
+            splits.store_track(track.id, track_splits, best_efforts)
+        increment_counter()
+
+
+def run_recompute(workers=None, batch_size=100, recompute_all=False):
+    """recompute all stale statistics
+
+    @return: tuple of (recomputed, failed) counts
+    """
+    statistics = list(stale_statistics(recompute_all))
+    total = len(statistics)
+    recomputed = failed = 0
+    batch = []
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {}
+        for statistic in statistics:
+            gpx_fspath = os.path.join(UPLOAD_BASE_DIR, statistic.track.path)
+            future = executor.submit(compute_statistics, gpx_fspath, statistic.track.content_hash,
+                                     statistic.elevation_filter)
+            futures[future] = statistic
+
+        for number, future in enumerate(as_completed(futures), 1):
+            statistic = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                print("Error during recomputing the statistics of track '%s': %s" % (statistic.track.name, e))
+                failed += 1
+                continue
+
+            batch.append((statistic, result))
+            if len(batch) >= batch_size:
+                store_batch(batch)
+                recomputed += len(batch)
+                batch = []
+                print("[%d/%d] recomputed: %d, failed: %d" % (number, total, recomputed, failed))
+
+        if batch:
+            store_batch(batch)
+            recomputed += len(batch)
+        print("[%d/%d] recomputed: %d, failed: %d" % (total, total, recomputed, failed))
+
+    return recomputed, failed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Recompute the statistics of all tracks calculated by an older version.")
+    parser.add_argument("--workers", type=int, default=None, help="number of worker processes, default: all cores")
+    parser.add_argument("--batch-size", type=int, default=100, help="number of tracks updated per transaction")
+    parser.add_argument("--all", action="store_true",
+                        help="recompute the statistics of all tracks, ignoring their version")
+    args = parser.parse_args(argv)
+
+    db.connect()
+    upgrade_database()
+    try:
+        _, failed = run_recompute(args.workers, args.batch_size, args.all)
+    finally:
+        db.close()
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,145 @@
+# rollups.py
+# maintain the precomputed statistics per tag and period (Rollup), which are updated on every add/delete
+#
+# usage: python3 rollups.py    rebuild all rollups from the statistics of the tracks
+from peewee import fn, Value, EXCLUDED
+from app import db
+from models import Track, Statistic, Tag, TrackTag, Rollup, increment_counter
+
+ALL = ""  # tag/period of the rollups over all tracks/all time
+PERIOD_LENGTHS = {"year": 4, "month": 7}
+
+
+def _keys(date, tags):
+    """return (tag, period) of all rollups a track with date and tags is counted in
+    """
+    date = str(date)
+    periods = [ALL] + [date[:length] for length in PERIOD_LENGTHS.values()]
+    return [(tag, period) for tag in [ALL] + sorted(set(tags)) for period in periods]
+
+
+def add_track(date, statistic, tags):
+    """add the statistics of a new track to all of its rollups, call inside the transaction storing the track
+
+    @param date: date of the track
+    @param statistic: Statistic object of the track
+    @param tags: tag values of the track
+    """
+    for tag, period in _keys(date, tags):
+        (Rollup
+         .insert(tag=tag, period=period, count=1,
+                 distance_m=statistic.distance_m, duration_s=statistic.duration_s,
+                 elevation_up_m=statistic.elevation_up_m, elevation_down_m=statistic.elevation_down_m,
+                 max_speed=statistic.max_speed, avg_speed_sum=statistic.avg_speed)
+         .on_conflict(conflict_target=[Rollup.tag, Rollup.period], update={
+             Rollup.count: Rollup.count + 1,
+             Rollup.distance_m: Rollup.distance_m + EXCLUDED.distance_m,
+             Rollup.duration_s: Rollup.duration_s + EXCLUDED.duration_s,
+             Rollup.elevation_up_m: Rollup.elevation_up_m + EXCLUDED.elevation_up_m,
+             Rollup.elevation_down_m: Rollup.elevation_down_m + EXCLUDED.elevation_down_m,
+             Rollup.max_speed: fn.MAX(Rollup.max_speed, EXCLUDED.max_speed),
+             Rollup.avg_speed_sum: Rollup.avg_speed_sum + EXCLUDED.avg_speed_sum})
+         .execute())
+
+
+def _max_speed(tag, period, exclude_track_id):
+    query = Statistic.select(fn.MAX(Statistic.max_speed)).join(Track).where(Track.id != exclude_track_id)
+    if tag != ALL:
+        query = query.join(TrackTag).join(Tag).where(Tag.value == tag)
+    if period != ALL:
+        query = query.where(fn.SUBSTR(Track.date, 1, len(period)) == period)
+    return query.scalar() or 0
+
+
+def remove_track(track):
+    """remove the statistics of a track from all of its rollups, call inside the transaction deleting the track
+    """
+    statistic = track.statistics.first()
+    if statistic is None:
+        return
+    tags = [tag.value for tag in Tag.select(Tag.value).join(TrackTag).where(TrackTag.track == track)]  # pylint: disable=E1111
+
+    for tag, period in _keys(track.date, tags):
+        rollup = Rollup.get_or_none(Rollup.tag == tag, Rollup.period == period)
+        if rollup is None:
+            continue
+        if rollup.count <= 1:
+            rollup.delete_instance()
+            continue
+        rollup.count -= 1
+        rollup.distance_m -= statistic.distance_m
+        rollup.duration_s -= statistic.duration_s
+        rollup.elevation_up_m -= statistic.elevation_up_m
+        rollup.elevation_down_m -= statistic.elevation_down_m
+        rollup.avg_speed_sum -= statistic.avg_speed
+        if statistic.max_speed >= rollup.max_speed:  # maximum can not be decremented, find the new one
+            rollup.max_speed = _max_speed(tag, period, track.id)
+        rollup.save()
+
+
+def rebuild():
+    """recalculate all rollups from the statistics of the tracks
+    """
+    fields = [Rollup.tag, Rollup.period, Rollup.count, Rollup.distance_m, Rollup.duration_s,
+              Rollup.elevation_up_m, Rollup.elevation_down_m, Rollup.max_speed, Rollup.avg_speed_sum]
+    periods = [Value(ALL)] + [fn.SUBSTR(Track.date, 1, length) for length in PERIOD_LENGTHS.values()]
+
+    with db.atomic():
+        Rollup.delete().execute()
+        for tag in (Value(ALL), Tag.value):
+            for period in periods:
+                query = (Statistic
+                         .select(tag, period, fn.COUNT(Track.id.distinct()), fn.SUM(Statistic.distance_m),
+                                 fn.SUM(Statistic.duration_s), fn.SUM(Statistic.elevation_up_m),
+                                 fn.SUM(Statistic.elevation_down_m), fn.MAX(Statistic.max_speed),
+                                 fn.SUM(Statistic.avg_speed))
+                         .join(Track))
+                if tag is Tag.value:
+                    query = query.join(TrackTag).join(Tag)
+                Rollup.insert_from(query.group_by(tag, period), fields).execute()
+        increment_counter()
+
+
+def _as_statistics(rollup, group=None):
+    """return a rollup as dict, in the layout of aggregations.overall_statistics
+    """
+    return {
+        "group": group,
+        "count": rollup.count,
+        "distance_m": rollup.distance_m,
+        "duration": rollup.duration_s,
+        "max_speed": rollup.max_speed,
+        "avg_speed": rollup.avg_speed_sum / rollup.count if rollup.count else 0,
+        "elevation_up_m": rollup.elevation_up_m,
+        "elevation_down_m": rollup.elevation_down_m,
+    }
+
+
+def overall_statistics(tag=ALL):
+    """return the statistics of all tracks with tag (or all tracks), read from one rollup row
+    """
+    rollup = Rollup.get_or_none(Rollup.tag == tag, Rollup.period == ALL)
+    return _as_statistics(rollup or Rollup(count=0))
+
+
+def grouped_statistics(tag, dimension):
+    """return the statistics of all tracks with tag (or all tracks) grouped by year, month or tag
+
+    @return: list of dicts like aggregations.grouped_statistics, None if the dimension is not available as rollup
+    """
+    if dimension in PERIOD_LENGTHS:
+        query = (Rollup.select()
+                 .where(Rollup.tag == tag, fn.LENGTH(Rollup.period) == PERIOD_LENGTHS[dimension])
+                 .order_by(Rollup.period))
+        return [_as_statistics(rollup, rollup.period) for rollup in query]
+    if dimension == "tag" and tag == ALL:
+        query = Rollup.select().where(Rollup.tag != ALL, Rollup.period == ALL).order_by(Rollup.tag)
+        return [_as_statistics(rollup, rollup.tag) for rollup in query]
+    return None
+
+
+if __name__ == '__main__':
+    db.connect()
+    rebuild()
+    print("Rebuilt %d rollups." % Rollup.select().count())
+    db.close()
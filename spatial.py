@@ -0,0 +1,109 @@
+# spatial.py
+# bounding boxes of the tracks and the R*Tree index (TrackBounds) to find tracks in a map viewport
+import math
+from app import db
+from models import Track, TrackBounds
+
+BOUNDS_FIELDS = ("min_lat", "min_lon", "max_lat", "max_lon")
+
+
+def bounds_fields(bounds):
+    """return the Track fields of a bounding box [[south, west], [north, east]], as built by lib.geometry
+    """
+    if bounds is None:
+        return dict.fromkeys(BOUNDS_FIELDS)
+    (south, west), (north, east) = bounds
+    return {"min_lat": south, "min_lon": west, "max_lat": north, "max_lon": east}
+
+
+def index_track(track_id, bounds):
+    """add the bounding box of a stored track to the spatial index, call inside the transaction storing the track
+    """
+    if bounds is None:
+        return
+    TrackBounds.replace(id=track_id, **bounds_fields(bounds)).execute()
+
+
+def remove_track(track_id):
+    """remove a track from the spatial index, call inside the transaction deleting the track
+    """
+    TrackBounds.delete().where(TrackBounds.id == track_id).execute()
+
+
+def rebuild():
+    """rebuild the spatial index from the bounding boxes stored with the tracks
+    """
+    TrackBounds.delete().execute()
+    rows = (Track
+            .select(Track.id, Track.min_lat, Track.max_lat, Track.min_lon, Track.max_lon)
+            .where(Track.min_lat.is_null(False)))
+    TrackBounds.insert_from(rows, [TrackBounds.id, TrackBounds.min_lat, TrackBounds.max_lat,
+                                   TrackBounds.min_lon, TrackBounds.max_lon]).execute()
+
+
+def parse_bbox(text):
+    """return (south, west, north, east) of a box given as "west,south,east,north" (Leaflet's toBBoxString)
+
+    A box with west > east covers the antimeridian. Leaflet returns longitudes beyond -180..180 instead,
+    if the map is panned across the antimeridian: these boxes are wrapped, so west > east afterwards.
+
+    @raise ValueError: if the box is not 4 finite numbers or the coordinates are out of range
+    """
+    west, south, east, north = [float(value) for value in text.split(",")]
+    if not all(math.isfinite(value) for value in (west, south, east, north)):
+        raise ValueError("Coordinates of the box must be finite numbers")
+    if not -90 <= south <= north <= 90:
+        raise ValueError("Latitudes of the box must be in -90..90, south <= north")
+    if west > east:
+        if not (-180 <= east and west <= 180):
+            raise ValueError("Longitudes of a box covering the antimeridian must be in -180..180")
+        return south, west, north, east
+    if east - west >= 360:
+        return south, -180.0, north, 180.0
+    return south, wrap_longitude(west), north, wrap_longitude(east)
+
+
+def wrap_longitude(lon):
+    """return the longitude in -180..180
+    """
+    return lon if -180 <= lon <= 180 else (lon + 180) % 360 - 180
+
+
+def tracks_in_bounds(south, west, north, east, limit=None):
+    """return a query of the tracks, whose bounding box intersects the given box, the newest first
+
+    The R*Tree selects the candidates, the exact bounding boxes of the tracks are checked afterwards.
+    A box crossing the antimeridian (west > east) is queried as two boxes west..180 and -180..east.
+
+    @param limit: max. number of tracks, None for all
+    """
+    if west <= east:
+        lon_boxes = [(west, east)]
+    else:
+        lon_boxes = [(west, 180.0), (-180.0, east)]
+
+    candidates = None
+    in_bounds = None
+    for box_west, box_east in lon_boxes:
+        box_candidates = (TrackBounds
+                          .select(TrackBounds.id)
+                          .where(TrackBounds.max_lat >= south, TrackBounds.min_lat <= north,
+                                 TrackBounds.max_lon >= box_west, TrackBounds.min_lon <= box_east))
+        box_in_bounds = (Track.max_lon >= box_west) & (Track.min_lon <= box_east)
+        candidates = box_candidates if candidates is None else candidates | box_candidates
+        in_bounds = box_in_bounds if in_bounds is None else in_bounds | box_in_bounds
+
+    query = (Track
+             .select()
+             .where(Track.id.in_(candidates), Track.max_lat >= south, Track.min_lat <= north, in_bounds)
+             .order_by(Track.date.desc(), Track.id.desc()))  # pylint: disable=E1111
+    if limit is not None:
+        query = query.limit(limit)
+    return query
+
+
+if __name__ == '__main__':
+    db.connect()
+    rebuild()
+    print("Indexed %d tracks." % TrackBounds.select().count())
+    db.close()
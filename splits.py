@@ -0,0 +1,45 @@
+# splits.py
+# split tables (per km) and best efforts of the tracks (Split, BestEffort), analyzed with lib/segments.py
+#
+# They are stored with every new track and updated by recompute.py.
+from models import Split, BestEffort
+from lib import gpx_arrays
+from lib.gpx import Gpx, VALIDATION_OFF
+from lib.segments import TrackSegments
+
+
+def analyze(gpx):
+    """return the splits and best efforts of a processed (not streamed) Gpx object
+
+    @return: tuple (list of split dicts, list of best effort dicts), see lib.segments.TrackSegments
+    """
+    segments = TrackSegments.from_geo_data(gpx.geo_data, gpx.skip_inactive)
+    return segments.splits(), segments.best_efforts()
+
+
+def analyze_file(gpx_file, elevation_filter=""):
+    """process a point store (or a gpx file, without validation) and return its splits and best efforts
+    """
+    gpx = Gpx(gpx_file, True, columnar=gpx_arrays.available(), elevation_filter=elevation_filter)
+    gpx.process(force=True, validation=VALIDATION_OFF)
+    return analyze(gpx)
+
+
+def store_track(track_id, splits, best_efforts):
+    """replace the splits and best efforts of a track, call inside the transaction storing the track
+    """
+    Split.delete().where(Split.track == track_id).execute()
+    BestEffort.delete().where(BestEffort.track == track_id).execute()
+    if splits:
+        Split.insert_many([
+            dict(track=track_id, number=split["number"], distance_m=round(split["distance_m"]),
+                 duration_s=round(split["duration_s"]), moving_s=round(split["moving_s"]),
+                 elevation_up_m=round(split["elevation_up_m"]), elevation_down_m=round(split["elevation_down_m"]))
+            for split in splits
+        ]).execute()
+    if best_efforts:
+        BestEffort.insert_many([
+            dict(track=track_id, distance_m=effort["distance_m"], duration_s=effort["duration_s"],
+                 start_s=round(effort["start_s"]))
+            for effort in best_efforts
+        ]).execute()
@@ -0,0 +1,64 @@
+# storage.py
+# gzip compressed storage of the gpx files in the upload directory
+#
+# usage: python3 storage.py    compress the gpx files of all tracks, that are still stored uncompressed
+import os
+import gzip
+import shutil
+from app import db, APP_ROOT
+from models import Track, Job, increment_counter
+from migrations import upgrade_database
+from lib.gpx import is_gzip_file
+
+COMPRESS_LEVEL = 6
+COMPRESSED_SUFFIX = ".gz"
+
+
+def compress_bytes(content):
+    """return the gzip compressed content of a gpx file, without timestamp, so equal files compress equally
+    """
+    return gzip.compress(content, COMPRESS_LEVEL, mtime=0)
+
+
+def compress_file(fspath):
+    """compress a stored gpx file, the uncompressed file is removed
+
+    @return: path of the compressed file
+    """
+    compressed_fspath = fspath + COMPRESSED_SUFFIX
+    tmp_fspath = compressed_fspath + ".part"
+    with open(fspath, "rb") as gpx_file, gzip.GzipFile(tmp_fspath, "wb", COMPRESS_LEVEL, mtime=0) as compressed:
+        shutil.copyfileobj(gpx_file, compressed)
+    os.replace(tmp_fspath, compressed_fspath)
+    return compressed_fspath
+
+
+def compress_tracks(static_dir=os.path.join(APP_ROOT, "static")):
+    """compress the gpx files of all tracks stored uncompressed and update their paths
+
+    @return: tuple (number of compressed files, bytes before, bytes after)
+    """
+    count = size_before = size_after = 0
+    for track in Track.select(Track.id, Track.path):  # pylint: disable=E1111
+        fspath = os.path.join(static_dir, track.path)
+        if not os.path.isfile(fspath) or is_gzip_file(fspath):
+            continue
+        size_before += os.path.getsize(fspath)
+        compressed_fspath = compress_file(fspath)
+        size_after += os.path.getsize(compressed_fspath)
+        path = track.path + COMPRESSED_SUFFIX
+        with db.atomic():
+            Track.update(path=path).where(Track.id == track.id).execute()
+            Job.update(path=path).where(Job.track == track.id).execute()
+            increment_counter()
+        os.remove(fspath)
+        count += 1
+    return count, size_before, size_after
+
+
+if __name__ == '__main__':
+    db.connect()
+    upgrade_database()
+    compressed, before, after = compress_tracks()
+    print("Compressed %d files: %.1f MB -> %.1f MB" % (compressed, before / 2 ** 20, after / 2 ** 20))
+    db.close()
@@ -0,0 +1,108 @@
+"""shared fixtures of the tests, run them with `python3 -m pytest test` in the trackdb folder
+
+The tests use gpx files of test/integration and small generated tracks, database tests an empty database
+in a temporary folder instead of tracks.db.
+"""
+import os
+import sys
+import math
+import random
+from datetime import datetime, timedelta
+
+import pytest
+
+BASE_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), "..")
+sys.path.insert(0, BASE_DIR)
+
+from app import app, db  # pylint: disable=wrong-import-position
+from models import Track, Statistic, tag_tracks  # pylint: disable=wrong-import-position
+from migrations import upgrade_database  # pylint: disable=wrong-import-position
+import rollups  # pylint: disable=wrong-import-position
+import spatial  # pylint: disable=wrong-import-position
+
+INTEGRATION_DIR = os.path.join(BASE_DIR, "test", "integration")
+INTEGRATION_FILES = [os.path.join(INTEGRATION_DIR, name)
+                     for name in ("valid.gpx", "missing-ele.gpx", "empty-trkseg.gpx")]
+
+GPX_HEADER = """<?xml version="1.0" encoding="UTF-8"?>
+<gpx xmlns="http://www.topografix.com/GPX/1/1" creator="trackdb test" version="1.1">
+<trk><name>generated</name><trkseg>
+"""
+GPX_TRKPT = '<trkpt lat="%.7f" lon="%.7f"><ele>%.1f</ele><time>%s</time></trkpt>\n'
+GPX_TRKPT_WITHOUT_ELE = '<trkpt lat="%.7f" lon="%.7f"><time>%s</time></trkpt>\n'
+GPX_FOOTER = "</trkseg></trk>\n</gpx>\n"
+
+
+def write_gpx(path, count, seed=1, fractional_seconds=False):
+    """write a gpx file with count trackpoints, covering the special cases of the activity detection:
+    pauses, standing still, implausible speeds (gps spikes) and trackpoints without elevation
+
+    @param fractional_seconds: write timestamps with milliseconds
+    """
+    rand = random.Random(seed)
+    lat, lon = 47.5, 11.0
+    timestamp = datetime(2018, 6, 1, 8, 0, 0)
+    with open(path, "w") as gpx_file:
+        gpx_file.write(GPX_HEADER)
+        for i in range(count):
+            if i % 200 == 199:  # pause
+                timestamp += timedelta(seconds=300)
+            elif i % 50 < 5:  # standing still, gps noise only
+                lat += rand.gauss(0, 0.000001)
+                timestamp += timedelta(seconds=2)
+            else:
+                lat += 0.00005 + rand.gauss(0, 0.00001)
+                lon += 0.00007 + rand.gauss(0, 0.00001)
+                timestamp += timedelta(seconds=1, milliseconds=rand.randint(0, 999) if fractional_seconds else 0)
+            time = timestamp.strftime("%Y-%m-%dT%H:%M:%S")
+            time += ".%03dZ" % (timestamp.microsecond // 1000) if fractional_seconds else "Z"
+            if i % 97 == 96:  # gps spike
+                gpx_file.write(GPX_TRKPT % (lat + 0.01, lon, 800.0, time))
+            elif i % 61 == 60:
+                gpx_file.write(GPX_TRKPT_WITHOUT_ELE % (lat, lon, time))
+            else:
+                gpx_file.write(GPX_TRKPT % (lat, lon, 800 + 50 * math.sin(i / 100.0) + rand.gauss(0, 2), time))
+        gpx_file.write(GPX_FOOTER)
+    return path
+
+
+@pytest.fixture
+def generated_gpx(tmp_path):
+    return write_gpx(str(tmp_path / "generated.gpx"), 1000)
+
+
+@pytest.fixture
+def fractional_gpx(tmp_path):
+    return write_gpx(str(tmp_path / "fractional.gpx"), 1000, seed=2, fractional_seconds=True)
+
+
+@pytest.fixture
+def database(tmp_path):
+    """empty database with all tables in a temporary folder
+    """
+    db.init(str(tmp_path / "tracks.db"), pragmas=app.config["DATABASE_PRAGMAS"],
+            timeout=app.config["DATABASE_TIMEOUT"])
+    db.connect()
+    upgrade_database()
+    yield db
+    db.init(app.config["DATABASE"], pragmas=app.config["DATABASE_PRAGMAS"], timeout=app.config["DATABASE_TIMEOUT"])
+
+
+@pytest.fixture
+def store_track(database):  # pylint: disable=redefined-outer-name,unused-argument
+    """return a function storing a track with statistics, tags, rollups and bounding box, like an upload
+    """
+    def store(name, date, tags=(), distance_m=1000, duration_s=600, max_speed=20.0, avg_speed=6.0,
+              elevation_up_m=100, elevation_down_m=90, bounds=None):
+        with db.atomic():
+            track = Track.create(name=name, date=date, path="upload-data/%s.gpx" % name, content_hash=name,
+                                 **spatial.bounds_fields(bounds))
+            statistic = Statistic.create(track=track, distance_m=distance_m, duration_s=duration_s,
+                                         duration_total_s=duration_s, max_speed=max_speed, avg_speed=avg_speed,
+                                         elevation_up_m=elevation_up_m, elevation_down_m=elevation_down_m)
+            tags = set(tags) | {str(date)[:4]}
+            tag_tracks([(track.id, tags)])
+            rollups.add_track(track.date, statistic, tags)
+            spatial.index_track(track.id, bounds)
+        return track
+    return store
@@ -0,0 +1,64 @@
+"""the elevation filters must give the same result point by point (push), on lists (apply) and on arrays (apply_array)
+"""
+import math
+import random
+
+import pytest
+
+from lib.elevation import parse_filters, Kalman
+
+numpy = pytest.importorskip("numpy")
+
+SPECS = ["average:5", "median:5", "median:4", "hysteresis:3", "kalman", "kalman:0.01:25", "kalman:10:0.5",
+         "median:5,hysteresis:3", "average:3,kalman"]
+
+
+def elevations(count, seed=1):
+    rand = random.Random(seed)
+    return [800 + 300 * math.sin(i / 500.0) + rand.gauss(0, 3) for i in range(count)]
+
+
+@pytest.mark.parametrize("spec", SPECS)
+@pytest.mark.parametrize("count", [0, 1, 2, 10, 5000])
+def test_push_apply_apply_array(spec, count):
+    series = elevations(count)
+    elevation_filter = parse_filters(spec)
+    elevation_filter.reset()
+    pushed = [elevation_filter.push(elevation) for elevation in series]
+
+    assert elevation_filter.apply(series) == pytest.approx(pushed, rel=0, abs=1e-12)
+    applied = elevation_filter.apply_array(numpy.array(series, dtype=numpy.float64))
+    assert applied.tolist() == pytest.approx(pushed, rel=0, abs=1e-9)
+
+
+@pytest.mark.parametrize("process_variance, measurement_variance", [(1, 4), (0.001, 100), (100, 0.001), (1, 1)])
+def test_kalman_apply_array_matches_push(process_variance, measurement_variance):
+    series = elevations(20000, seed=2)
+    kalman = Kalman(process_variance, measurement_variance)
+    pushed = [kalman.push(elevation) for elevation in series]
+    push_error = kalman.error
+
+    applied = kalman.apply_array(numpy.array(series, dtype=numpy.float64))
+    assert applied.tolist() == pytest.approx(pushed, rel=0, abs=1e-9)
+    # the state after the series continues like push
+    assert kalman.estimate == pytest.approx(pushed[-1], abs=1e-9)
+    assert kalman.error == pytest.approx(push_error)
+
+
+def test_reset_between_tracks():
+    elevation_filter = parse_filters("median:5,hysteresis:3,kalman")
+    first = elevation_filter.apply(elevations(100, seed=3))
+    elevation_filter.apply(elevations(100, seed=4))
+    assert elevation_filter.apply(elevations(100, seed=3)) == first
+
+
+@pytest.mark.parametrize("spec", ["unknown", "median:5:1", "kalman:1:2:3", "average:x"])
+def test_invalid_specifications(spec):
+    with pytest.raises(ValueError):
+        parse_filters(spec)
+
+
+def test_spec_round_trip():
+    elevation_filter = parse_filters("median:5, hysteresis:3,kalman")
+    assert parse_filters(elevation_filter.spec()).spec() == elevation_filter.spec()
+    assert parse_filters("").spec() == ""
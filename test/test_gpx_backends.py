@@ -0,0 +1,52 @@
+"""the list based, columnar and streaming processing of lib.gpx must calculate the same statistics
+"""
+import pytest
+
+from conftest import INTEGRATION_FILES
+from lib import gpx_arrays
+from lib.gpx import Gpx, VALIDATION_STRUCTURAL
+
+BACKENDS = [
+    {},
+    pytest.param({"columnar": True}, marks=pytest.mark.skipif(not gpx_arrays.available(), reason="requires numpy")),
+    {"streaming": True},
+]
+ELEVATION_FILTERS = ["", "average:5", "median:5,hysteresis:3", "kalman"]
+
+
+def process(gpx_file, elevation_filter="", skip_inactive=True, **backend):
+    return Gpx(gpx_file, skip_inactive, elevation_filter=elevation_filter, **backend).process(
+        force=True, validation=VALIDATION_STRUCTURAL)
+
+
+def assert_same_metadata(metadata, expected):
+    assert metadata.keys() == expected.keys()
+    for key, value in expected.items():
+        assert metadata[key] == pytest.approx(value, rel=1e-9, abs=1e-9), key
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+@pytest.mark.parametrize("gpx_file", INTEGRATION_FILES)
+def test_integration_files(gpx_file, backend):
+    assert_same_metadata(process(gpx_file, **backend), process(gpx_file))
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+@pytest.mark.parametrize("elevation_filter", ELEVATION_FILTERS)
+def test_elevation_filters(generated_gpx, elevation_filter, backend):
+    assert_same_metadata(process(generated_gpx, elevation_filter, **backend), process(generated_gpx, elevation_filter))
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+@pytest.mark.parametrize("skip_inactive", [True, False])
+def test_activity_detection(generated_gpx, skip_inactive, backend):
+    metadata = process(generated_gpx, skip_inactive=skip_inactive, **backend)
+    assert_same_metadata(metadata, process(generated_gpx, skip_inactive=skip_inactive))
+    if skip_inactive:  # pauses and standing still are not part of the active duration
+        assert metadata["duration"] < metadata["total_duration"]
+    assert metadata["max_speed"] <= 30 * 3.6  # gps spikes are ignored, see lib.activity
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_fractional_seconds(fractional_gpx, backend):
+    assert_same_metadata(process(fractional_gpx, **backend), process(fractional_gpx))
@@ -0,0 +1,83 @@
+"""point stores must hold exactly the complete trackpoints of the gpx file, and processing them must give the same
+results as processing the gpx file
+"""
+import pytest
+
+from conftest import INTEGRATION_FILES
+from lib import gpx_arrays, point_store
+from lib.geometry import geometry_from_file
+from lib.gpx import Gpx, VALIDATION_OFF
+from lib.point_store import PointStore, is_point_store
+
+requires_numpy = pytest.mark.skipif(not gpx_arrays.available(), reason="requires numpy")
+BACKENDS = [{}, pytest.param({"columnar": True}, marks=requires_numpy), {"streaming": True}]
+GPX_FILES = [INTEGRATION_FILES[0], "generated", "fractional"]
+
+
+@pytest.fixture(params=GPX_FILES)
+def gpx_file(request, generated_gpx, fractional_gpx):
+    return {"generated": generated_gpx, "fractional": fractional_gpx}.get(request.param, request.param)
+
+
+def write_store(gpx_file, path, streaming=True):
+    Gpx(gpx_file, streaming=streaming, point_store=str(path)).process(force=True, validation=VALIDATION_OFF)
+    return str(path)
+
+
+def reference_points(gpx_file):
+    gpx = Gpx(gpx_file)
+    gpx.process(force=True, validation=VALIDATION_OFF)
+    geo_data = gpx.geo_data
+    return gpx.date, [list(geo_data[key]) for key in ("absolute_timestamps", "lats", "lons", "elevations")]
+
+
+def test_round_trip(gpx_file, tmp_path):
+    store = PointStore(write_store(gpx_file, tmp_path / "track.pts"))
+    date, columns = reference_points(gpx_file)
+    assert store.date == date
+    assert store.count == len(columns[0])
+    assert [list(column) for column in store.columns()] == columns
+
+
+@requires_numpy
+def test_round_trip_arrays(gpx_file, tmp_path):
+    store = PointStore(write_store(gpx_file, tmp_path / "track.pts"))
+    _, columns = reference_points(gpx_file)
+    assert [column.tolist() for column in store.columns(arrays=True)] == columns
+
+
+def test_fractional_seconds(fractional_gpx, generated_gpx, tmp_path):
+    assert PointStore(write_store(fractional_gpx, tmp_path / "fractional.pts")).float_timestamps
+    assert not PointStore(write_store(generated_gpx, tmp_path / "generated.pts")).float_timestamps
+
+
+def test_writers_are_identical(gpx_file, tmp_path, monkeypatch):
+    streamed = write_store(gpx_file, tmp_path / "streamed.pts")
+    extracted = write_store(gpx_file, tmp_path / "extracted.pts", streaming=False)
+    with open(streamed, "rb") as streamed_file, open(extracted, "rb") as extracted_file:
+        content = streamed_file.read()
+        assert extracted_file.read() == content
+
+    for chunk in (1, 7, 100):  # spooling the columns in chunks does not change the file
+        monkeypatch.setattr(point_store, "SPOOL_CHUNK", chunk)
+        with open(write_store(gpx_file, tmp_path / ("chunk%d.pts" % chunk)), "rb") as chunked_file:
+            assert chunked_file.read() == content
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+@pytest.mark.parametrize("elevation_filter", ["", "median:5,hysteresis:3"])
+def test_processing_store_matches_gpx(gpx_file, tmp_path, backend, elevation_filter):
+    store = write_store(gpx_file, tmp_path / "track.pts")
+    expected = Gpx(gpx_file, elevation_filter=elevation_filter, **backend).process(force=True,
+                                                                                   validation=VALIDATION_OFF)
+    metadata = Gpx(store, elevation_filter=elevation_filter, **backend).process()
+    assert metadata.keys() == expected.keys()
+    for key, value in expected.items():
+        assert metadata[key] == pytest.approx(value, rel=1e-9, abs=1e-9), key
+
+
+def test_geometry(gpx_file, tmp_path):
+    store = write_store(gpx_file, tmp_path / "track.pts")
+    assert is_point_store(store)
+    assert not is_point_store(gpx_file)
+    assert geometry_from_file(store) == geometry_from_file(gpx_file)
@@ -0,0 +1,78 @@
+"""the rollups maintained on every added or deleted track must equal the SQL aggregates over the statistics
+"""
+import random
+
+import pytest
+
+import aggregations
+import rollups
+import views
+from app import db
+from models import Track, Tag, Rollup
+
+TAGS = ["hiking", "cycling", "alps", "mallorca"]
+
+
+@pytest.fixture
+def tracks(store_track):
+    rand = random.Random(1)
+    stored = []
+    for number in range(30):
+        date = "%d-%02d-%02d" % (2015 + number % 4, 1 + number % 12, 1 + number % 28)
+        stored.append(store_track("track%02d" % number, date, rand.sample(TAGS, rand.randint(0, 3)),
+                                  distance_m=rand.randint(1000, 100000), duration_s=rand.randint(600, 30000),
+                                  max_speed=round(rand.uniform(5, 60), 1), avg_speed=rand.uniform(3, 25),
+                                  elevation_up_m=rand.randint(0, 2000), elevation_down_m=rand.randint(0, 2000)))
+    return stored
+
+
+def assert_same_statistics(statistics, expected):
+    assert statistics.keys() - {"group"} == expected.keys() - {"group"}
+    for key, value in expected.items():
+        assert statistics[key] == pytest.approx(value), key
+
+
+def assert_rollups_match_aggregates():
+    for tag in [rollups.ALL] + [tag.value for tag in Tag.select()]:
+        sel_tags = [tag] if tag else []
+        tracks = views.tracks_with_tags(sel_tags)
+        for dimension in aggregations.DIMENSIONS:
+            overall, grouped = aggregations.filtered_statistics(tracks, sel_tags, dimension)
+            assert_same_statistics(overall, aggregations.overall_statistics(tracks))
+            expected = aggregations.grouped_statistics(tracks, dimension)
+            assert [group["group"] for group in grouped] == [group["group"] for group in expected]
+            for group, expected_group in zip(grouped, expected):
+                assert_same_statistics(group, expected_group)
+
+
+def test_added_tracks(tracks):  # pylint: disable=redefined-outer-name,unused-argument
+    assert Rollup.select().count() > 0
+    assert_rollups_match_aggregates()
+
+
+def test_deleted_tracks(tracks):  # pylint: disable=redefined-outer-name
+    # delete the tracks with the highest speeds first, so the maximum of the rollups has to be searched again
+    for track in sorted(tracks, key=lambda track: -track.statistics.first().max_speed)[:12]:
+        with db.atomic():
+            rollups.remove_track(track)
+            track.statistics.first().delete_instance()
+            track.delete_instance(recursive=True)
+        assert_rollups_match_aggregates()
+
+
+def test_rebuild(tracks):  # pylint: disable=redefined-outer-name,unused-argument
+    columns = [Rollup.tag, Rollup.period, Rollup.count, Rollup.distance_m, Rollup.duration_s, Rollup.elevation_up_m,
+               Rollup.elevation_down_m, Rollup.max_speed, Rollup.avg_speed_sum]
+    maintained = sorted(Rollup.select(*columns).tuples())
+    rollups.rebuild()
+    rebuilt = sorted(Rollup.select(*columns).tuples())
+    assert len(rebuilt) == len(maintained)
+    for row, expected in zip(rebuilt, maintained):
+        assert row[:2] == expected[:2]
+        assert row[2:] == pytest.approx(expected[2:])
+    assert_rollups_match_aggregates()
+
+
+def test_no_tracks(database):  # pylint: disable=unused-argument
+    assert rollups.overall_statistics()["count"] == 0
+    assert Track.select().count() == 0
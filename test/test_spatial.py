@@ -0,0 +1,76 @@
+"""tracks_in_bounds must find the tracks intersecting a map viewport, also across the antimeridian
+"""
+import math
+
+import pytest
+
+from app import app
+import spatial
+import views  # pylint: disable=unused-import  # registers the routes
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("10,45,12,48", (45, 10, 48, 12)),
+    ("170,-10,-170,10", (-10, 170, 10, -170)),  # west > east: covers the antimeridian
+    ("170,-10,190,10", (-10, 170, 10, -170)),  # Leaflet, panned eastwards across the antimeridian
+    ("-190,-10,-170,10", (-10, 170, 10, -170)),  # Leaflet, panned westwards
+    ("370,45,372,48", (45, 10, 48, 12)),
+    ("-200,-90,200,90", (-90, -180, 90, 180)),  # more than the whole world
+])
+def test_parse_bbox(text, expected):
+    assert spatial.parse_bbox(text) == expected
+
+
+@pytest.mark.parametrize("text", ["", "1,2,3", "a,b,c,d", "nan,0,1,1", "0,0,inf,1", "0,-91,1,0", "0,10,1,5",
+                                  "190,0,-170,1"])
+def test_parse_bbox_invalid(text):
+    with pytest.raises(ValueError):
+        spatial.parse_bbox(text)
+
+
+@pytest.mark.parametrize("lon, expected", [(0, 0), (180, 180), (-180, -180), (190, -170), (-190, 170), (540, -180),
+                                           (725, 5)])
+def test_wrap_longitude(lon, expected):
+    assert math.isclose(spatial.wrap_longitude(lon), expected)
+
+
+@pytest.fixture
+def tracks(store_track):
+    return {
+        "alps": store_track("alps", "2017-07-01", bounds=[[47.0, 10.0], [47.5, 11.0]]),
+        "fiji_east": store_track("fiji_east", "2018-05-01", bounds=[[-17.0, 178.0], [-16.5, 179.5]]),
+        "fiji_west": store_track("fiji_west", "2018-06-01", bounds=[[-17.0, -179.9], [-16.5, -179.0]]),
+        "mallorca": store_track("mallorca", "2016-10-19", bounds=[[39.5, 2.5], [39.9, 3.2]]),
+        "unknown": store_track("unknown", "2019-01-01"),
+    }
+
+
+def names(query):
+    return [track.name for track in query]
+
+
+def test_tracks_in_bounds(tracks):  # pylint: disable=redefined-outer-name,unused-argument
+    assert names(spatial.tracks_in_bounds(-90, -180, 90, 180)) == ["fiji_west", "fiji_east", "alps", "mallorca"]
+    assert names(spatial.tracks_in_bounds(47.2, 10.5, 48, 12)) == ["alps"]  # intersecting, not contained
+    assert names(spatial.tracks_in_bounds(0, 20, 10, 30)) == []
+    assert names(spatial.tracks_in_bounds(-90, -180, 90, 180, limit=2)) == ["fiji_west", "fiji_east"]
+
+
+def test_tracks_across_antimeridian(tracks):  # pylint: disable=redefined-outer-name,unused-argument
+    assert names(spatial.tracks_in_bounds(-20, 170, -10, -170)) == ["fiji_west", "fiji_east"]
+    assert names(spatial.tracks_in_bounds(-20, 179.0, -10, -179.5)) == ["fiji_west", "fiji_east"]
+    assert names(spatial.tracks_in_bounds(-20, 179.6, -10, -179.85)) == ["fiji_west"]
+    assert names(spatial.tracks_in_bounds(-20, 179.6, -10, -179.95)) == []
+
+
+def test_in_bounds_endpoint(tracks):  # pylint: disable=redefined-outer-name,unused-argument
+    client = app.test_client()
+    response = client.get("/tracks/in-bounds/", query_string={"bbox": "170,-20,190,-10"})
+    assert response.status_code == 200
+    assert [track["name"] for track in response.get_json()] == ["fiji_west", "fiji_east"]
+
+    response = client.get("/tracks/in-bounds/", query_string={"bbox": "-180,-90,180,90", "limit": 1})
+    assert [track["name"] for track in response.get_json()] == ["fiji_west"]
+
+    for query in ({"bbox": "nan,0,1,1"}, {"bbox": "0,0,1"}, {"bbox": "0,0,1,1", "limit": "x"}):
+        assert client.get("/tracks/in-bounds/", query_string=query).status_code == 400
@@ -0,0 +1,63 @@
+"""the pages of the track list (keyset pagination) must list every matching track once, newest first
+"""
+import datetime
+
+import pytest
+
+from app import app
+import views
+from models import Track
+
+
+@pytest.fixture
+def tracks(store_track):
+    # several tracks per day, so the pages have to be separated by date and id
+    stored = []
+    for number in range(23):
+        date = datetime.date(2017 + number % 3, 1 + number % 5, 1)
+        tags = ["hiking"] if number % 2 else ["cycling"]
+        if number % 3 == 0:
+            tags.append("alps")
+        stored.append(store_track("track%02d" % number, date, tags))
+    return stored
+
+
+def expected_ids(sel_tags):
+    query = views.tracks_with_tags(sel_tags).order_by(Track.date.desc(), Track.id.desc())
+    return [track.id for track in query]
+
+
+@pytest.mark.parametrize("sel_tags", [[], ["hiking"], ["hiking", "alps"], ["2018"], ["unknown"]])
+@pytest.mark.parametrize("limit", [1, 4, 23, 50])
+def test_pages(tracks, sel_tags, limit):  # pylint: disable=redefined-outer-name,unused-argument
+    ids = []
+    before = None
+    while True:
+        page, before = views.track_page(sel_tags, before, limit)
+        assert len(page) <= limit
+        ids += [track.id for track in page]
+        if before is None:
+            break
+        assert len(page) == limit
+    assert ids == expected_ids(sel_tags)
+
+
+def test_track_list_endpoint(tracks):  # pylint: disable=redefined-outer-name,unused-argument
+    client = app.test_client()
+    ids = []
+    query = {"tag": "hiking", "limit": 3}
+    while True:
+        response = client.get("/tracks/", query_string=query)
+        assert response.status_code == 200
+        data = response.get_json()
+        ids += [track["id"] for track in data["tracks"]]
+        if data["next"] is None:
+            break
+        query = dict(query, **data["next"])
+    assert ids == expected_ids(["hiking"])
+
+
+@pytest.mark.parametrize("query", [{"limit": "x"}, {"before_date": "2017-01-01"}, {"before_date": "2017-01-01",
+                                                                                    "before_id": "x"}])
+def test_invalid_parameters(tracks, query):  # pylint: disable=redefined-outer-name,unused-argument
+    assert app.test_client().get("/tracks/", query_string=query).status_code == 400
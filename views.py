@@ -1,12 +1,28 @@
 # views.py
 import os
+import gzip
 from datetime import date, datetime
-from flask import url_for, request, render_template, redirect, flash
+from flask import url_for, request, render_template, redirect, flash, jsonify, abort, session, Request, Response, send_file
+from werkzeug.exceptions import RequestEntityTooLarge
 from werkzeug.utils import secure_filename
-from models import Track, Statistic, Tag
-from app import app
-from lib.helpers import calc_statistics, mtr_to_distance, sec_to_datestring
-from lib.gpx import Gpx
+from peewee import fn
+from models import Track, Statistic, Tag, TrackTag, Job, Split, BestEffort, tag_tracks, delete_unused_tags, increment_counter, get_counter
+from app import app, db
+import aggregations
+import rollups
+import spatial
+import splits
+import ingest
+import storage
+from lib.helpers import mtr_to_distance, sec_to_datestring, sec_to_clock
+from lib.gpx import Gpx, STATISTICS_VERSION, VALIDATION_STRUCTURAL, VALIDATION_OFF, is_gzip_file
+from lib.instrumentation import StageRecorder, StageStatistics
+from lib.fragment_cache import FragmentCache
+from lib.gpx_cache import ResultCache, read_json, write_json
+from lib.gpx_upload import GpxUploadWriter
+from lib.elevation import parse_filters
+from lib import point_store, activity
+from lib.geometry import DETAIL_TOLERANCES, DEFAULT_DETAIL, geometry_from_file, geojson_feature
 
 # User config
 UPLOAD_DIR = "upload-data"
@@ -14,7 +30,28 @@ app.secret_key = b'\xbf/q|vow\xca>\x13\xc8k\x8a\x8e\x99\x15'  # Secret key is us
 
 # System constants
 UPLOAD_BASE_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), "static")
+CACHE_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), "cache")  # processing results of gpx files
+GEOMETRY_DIR = os.path.join(CACHE_DIR, "geometry")  # simplified track geometries for the map
+POINTS_DIR = os.path.join(CACHE_DIR, "points")  # extracted trackpoints, see lib.point_store
 ALLOWED_EXTENSIONS = set(['gpx'])
+GPX_MIMETYPE = "application/gpx+xml"
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600  # cache lifetime of versioned track files in seconds
+TRACK_PAGE_SIZE = 50  # tracks per page of the track list
+MAX_TRACK_PAGE_SIZE = 500
+IN_BOUNDS_LIMIT = 200  # tracks returned for a map viewport
+MAX_IN_BOUNDS_LIMIT = 1000
+RECENT_JOBS = 5  # number of uploads with processing status shown in /show/
+PROCESSING_METRICS = StageStatistics()  # aggregated stage timings of the gpx files processed by this process
+SHOW_FRAGMENTS = FragmentCache(app.config["SHOW_CACHE_SIZE"])  # rendered tag list, track list and statistics of /show/
+ELEVATION_FILTERS = [  # (specification, label) of the selectable elevation smoothing, see lib.elevation
+    ("", "No smoothing"),
+    ("median:5,hysteresis:3", "Median and hysteresis"),
+    ("average:5", "Moving average"),
+    ("median:5", "Moving median"),
+    ("hysteresis:3", "Hysteresis threshold"),
+    ("kalman", "Kalman filter"),
+]
 
 
 def allowed_file(filename):
@@ -22,6 +59,26 @@ def allowed_file(filename):
            filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
 
+class UploadRequest(Request):
+    """request receiving uploaded gpx files with GpxUploadWriter: stored, hashed and size checked in one pass
+    """
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        if filename is None or not allowed_file(filename):
+            return super()._get_file_stream(total_content_length, content_type, filename, content_length)
+        return GpxUploadWriter(os.path.join(UPLOAD_BASE_DIR, UPLOAD_DIR), app.config["MAX_CONTENT_LENGTH"],
+                               storage.COMPRESS_LEVEL)
+
+
+app.request_class = UploadRequest
+
+
+@app.errorhandler(RequestEntityTooLarge)
+def upload_too_large(e):
+    flash("The file is larger than %g MB." % (app.config["MAX_CONTENT_LENGTH"] / 2 ** 20), "error")
+    return redirect(url_for("add"))
+
+
 @app.route("/")
 def index():
     return redirect(url_for("show"))
@@ -40,53 +97,361 @@ def utility_processor():
     return dict(mtr_to_dst=mtr_to_dst, sec_to_date=sec_to_date)
 
 
+def track_version(track):
+    """return the version parameter of the urls of a track's files, derived from the content hash
+    """
+    return track.content_hash[:12] if track.content_hash else None
+
+
+def cached_response(response, etag, immutable=False, weak=False):
+    """add caching headers to a response and turn it into 304 Not Modified, if the client has a fresh copy
+
+    @param immutable: the url includes the version of the content, clients may cache it forever
+        otherwise clients revalidate the ETag on every use
+    """
+    response.set_etag(etag, weak=weak)
+    if immutable:
+        response.cache_control.no_cache = None  # set by send_file
+        response.cache_control.max_age = IMMUTABLE_MAX_AGE
+        response.cache_control.immutable = True
+    else:
+        response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+
+def is_versioned_request(track):
+    """return True if the request url contains the current version of the track's files
+    """
+    version = track_version(track)
+    return version is not None and request.args.get("v") == version
+
+
+@app.context_processor
+def version_processor():
+    return dict(track_version=track_version)
+
+
+def point_store_path(content_hash):
+    """return the path of the point store of the gpx file with the given content hash
+    """
+    return os.path.join(POINTS_DIR, content_hash[:2], "%s%s" % (content_hash, point_store.SUFFIX))
+
+
+def track_points(content_hash, gpx_fspath):
+    """return the path of the point store of a gpx file, it is extracted from the gpx file on first use
+
+    The gpx file was validated on upload, so it is not validated again.
+    """
+    points_fspath = point_store_path(content_hash)
+    if not os.path.isfile(points_fspath):
+        Gpx(gpx_fspath, streaming=True, point_store=points_fspath).process(force=True, validation=VALIDATION_OFF)
+    return points_fspath
+
+
+def geometry_path(content_hash):
+    """return the path of the stored simplified geometry of the gpx file with the given content hash
+    """
+    return os.path.join(GEOMETRY_DIR, content_hash[:2], "%s.json" % content_hash)
+
+
+def remove_track_files(content_hash):
+    """remove the point store, geometry and cached processing results of a deleted gpx file
+    """
+    for path in (point_store_path(content_hash), geometry_path(content_hash)):
+        if os.path.exists(path):
+            os.remove(path)
+    ResultCache(CACHE_DIR).remove(content_hash)
+
+
+def discard_upload(content_hash, gpx_fspath):
+    """remove the gpx file of a failed upload and its derived files, unless a stored track has the same content
+    """
+    if os.path.exists(gpx_fspath):
+        os.remove(gpx_fspath)
+    if not Track.select().where(Track.content_hash == content_hash).exists():
+        remove_track_files(content_hash)
+
+
+def track_geometry(content_hash, gpx_fspath):
+    """return the simplified geometry of a gpx file, it is built from the point store and stored on first use
+
+    @param content_hash: content hash of the gpx file, None to build the geometry from the gpx file without storing it
+    """
+    if content_hash is None:
+        return geometry_from_file(gpx_fspath)
+
+    geometry_fspath = geometry_path(content_hash)
+    geometry = read_json(geometry_fspath)
+    if geometry is None:
+        geometry = geometry_from_file(track_points(content_hash, gpx_fspath))
+        write_json(geometry_fspath, geometry)
+    return geometry
+
+
+def tracks_with_tags(sel_tags):
+    """return a query of all tracks having all of the selected tags, ordered by date
+
+    Use prefetch(tracks, Statistic) to access the statistics without a query per track.
+    Call order_by on the query to change the order.
+    """
+    tracks = Track.select().order_by(Track.date.asc())  # pylint: disable=E1111
+    if sel_tags:
+        sel_tags = set(sel_tags)
+        tracks = (tracks
+                  .join(TrackTag)
+                  .join(Tag)
+                  .where(Tag.value.in_(sel_tags))
+                  .group_by(Track.id)
+                  .having(fn.COUNT(TrackTag.tag.distinct()) == len(sel_tags)))
+    return tracks
+
+
+def track_page(sel_tags, before=None, limit=TRACK_PAGE_SIZE):
+    """return one page of the tracks having all of the selected tags, newest first (keyset pagination)
+
+    @param before: tuple (date, id) of the last track of the previous page, None for the first page
+    @return: tuple (list of tracks, cursor (date, id) of the next page or None if this is the last page)
+    """
+    tracks = tracks_with_tags(sel_tags).order_by(Track.date.desc(), Track.id.desc())
+    if before is not None:
+        before_date, before_id = before
+        tracks = tracks.where((Track.date < before_date) | ((Track.date == before_date) & (Track.id < before_id)))
+    tracks = list(tracks.limit(limit + 1))
+    if len(tracks) <= limit:
+        return tracks, None
+    tracks = tracks[:limit]
+    return tracks, (str(tracks[-1].date), tracks[-1].id)
+
+
+def selected_track(track_query, track_id):
+    """return the track with track_id, if it matches the filter, else the latest matching track, None if there is none
+    """
+    if track_id:
+        track = track_query.where(Track.id == int(track_id)).first()
+        if track is not None:
+            return track
+    return track_query.order_by(Track.date.desc(), Track.id.desc()).first()
+
+
+@app.route("/tracks/")
+def track_list():
+    """one page of the track list as JSON, for the track dropdown in /show/
+
+    Query parameters: tag (repeated, tracks having all tags), before_date and before_id (cursor of the
+    previous page, see track_page) and limit. The response contains the cursor of the next page.
+    """
+    sel_tags = request.args.getlist("tag")
+    try:
+        limit = min(int(request.args.get("limit", TRACK_PAGE_SIZE)), MAX_TRACK_PAGE_SIZE)
+        before = None
+        if request.args.get("before_date"):
+            before = (request.args["before_date"], int(request.args["before_id"]))
+    except (KeyError, ValueError):
+        abort(400)
+    page, next_page = track_page(sel_tags, before, max(limit, 1))
+    return jsonify({
+        "tracks": [{"id": track.id, "name": track.name, "date": str(track.date)} for track in page],
+        "next": {"before_date": next_page[0], "before_id": next_page[1]} if next_page else None,
+    })
+
+
+def tag_options(sel_tags):
+    """render the options of the tag filter, the selected tags are marked
+    """
+    tags = Tag.select().order_by(Tag.value.asc())  #pylint: disable=E1111
+    for tag in tags:
+        tag.selected = tag.value in sel_tags
+    return render_template("fragments/tag_options.html", tags=tags)
+
+
+def track_options(sel_tags):
+    """render the first page of the track list having all of the selected tags
+    """
+    tracks, next_page = track_page(sel_tags)
+    return render_template("fragments/track_options.html", tracks=tracks, next_page=next_page, sel_tags=sel_tags)
+
+
+def matching_statistics(track_query, sel_tags, group_by):
+    """render the overall and grouped statistics of the tracks having all of the selected tags
+    """
+    overall_statistics, grouped_statistics = aggregations.filtered_statistics(track_query, sel_tags, group_by)
+    return render_template("fragments/matching_statistics.html", overall_statistics=overall_statistics,
+                           grouped_statistics=grouped_statistics, group_by=group_by,
+                           dimensions=list(aggregations.DIMENSIONS))
+
+
+def track_panel(track):
+    """return the view model of the statistics panel of a track: its tags, statistics, best efforts and splits
+    as formatted strings, queried once
+    """
+    statistic = Statistic.get_or_none(Statistic.track == track)
+    panel = {
+        "name": track.name,
+        "date": track.date,
+        "tags": [tag.value for tag in Tag.select(Tag.value).join(TrackTag).where(TrackTag.track == track).order_by(Tag.value)],  #pylint: disable=E1111
+        "statistics": None,
+        "best_efforts": [],
+        "splits": [],
+    }
+    if statistic is not None:
+        panel["statistics"] = {
+            "distance": mtr_to_distance(statistic.distance_m),
+            "duration": sec_to_datestring(statistic.duration_s),
+            "duration_total": sec_to_datestring(statistic.duration_total_s),
+            "max_speed": "%s km/h" % statistic.max_speed,
+            "avg_speed": "%.2f km/h" % statistic.avg_speed,
+            "elevation_up": mtr_to_distance(statistic.elevation_up_m),
+            "elevation_down": mtr_to_distance(statistic.elevation_down_m),
+        }
+    for effort in track.best_efforts.order_by(BestEffort.distance_m):
+        panel["best_efforts"].append({
+            "distance": mtr_to_distance(effort.distance_m),
+            "time": sec_to_clock(effort.duration_s),
+            "pace": "%s /km" % sec_to_clock(effort.duration_s * 1000 / effort.distance_m),
+            "start": sec_to_clock(effort.start_s),
+        })
+    for split in track.splits.order_by(Split.number):
+        number = str(split.number)
+        if split.distance_m < 1000:
+            number += " (%d m)" % split.distance_m
+        panel["splits"].append({
+            "number": number,
+            "time": sec_to_clock(split.duration_s),
+            "moving": sec_to_clock(split.moving_s),
+            "pace": "%s /km" % sec_to_clock(split.moving_s * 1000 / split.distance_m) if split.distance_m else "",
+            "elevation_up": "%d m" % split.elevation_up_m,
+            "elevation_down": "%d m" % split.elevation_down_m,
+        })
+    return panel
+
+
 @app.route("/show/", methods=["GET", "POST"])
 def show():
-    tags = Tag.select(Tag.value).distinct().order_by(Tag.value.asc())  #pylint: disable=E1111
-    
+    # The page only changes with the data generation. Pages with flashed messages are not cached by the browser.
+    # The tag list, track list and statistics are rendered once per generation (SHOW_FRAGMENTS).
+    generation = get_counter()
+    etag = None
+    if request.method == "GET" and not session.get("_flashes"):
+        etag = "show-%d-%s" % (generation, request.args.get("track", ""))
+        if request.if_none_match.contains_weak(etag):
+            return cached_response(Response(status=304), etag, weak=True)
+
     if request.method == "POST":  # Filter the track list based on selected tags
-        # Evaluate selected tags, modify tag object with selection
         sel_tags = request.form.getlist('tag-select')
-        for tag in tags:
-            for sel_tag in sel_tags:
-                if tag.value == sel_tag:
-                    tag.selected = True
-
-        # Query database
-        all_tracks = Track.select().order_by(Track.date.asc())  # pylint: disable=E1111
-        tracks = []
-        for track in all_tracks:
-            tag_elems_for_track = Tag.select().where(Tag.track==track)  # pylint: disable=E1111
-            tags_for_track = []
-            for elem in tag_elems_for_track:
-                tags_for_track.append(elem.value)
-
-            if set(sel_tags).issubset(tags_for_track):
-                tracks.append(track)
-
-        # Pass information about selected map
-        if len(tracks) == 0:  # No available tracks - give warning
-            track_id = None
-        elif request.form.get("track-select") == None or request.form.get("track-select") == "":  # No track selected - return latest map
-            track_id = len(tracks) - 1
-        else:  # Return selected map
-            track_id = int(request.form.get("track-select"))
-
-
+        sel_track_id = request.form.get("track-select")
     else:  # List all tracks
-        tracks = Track.select().order_by(Track.date.asc())  #pylint: disable=E1111
-        # show latest map
-        if len(tracks) == 0:
-            track_id = None
-        else:
-            track_id = len(tracks) - 1
-
-    if track_id:
-        tags_for_track =  Tag.select(Tag.value).where(Tag.track == tracks[track_id])  #pylint: disable=E1111
-    else:
-        tags_for_track = ""
-    overall_statistics = calc_statistics(tracks)
-    return render_template("show.html", tracks=tracks, tags=tags, tags_for_track=tags_for_track, track_id=track_id, overall_statistics=overall_statistics)
+        sel_tags = []
+        sel_track_id = request.args.get("track")
+    tags_key = tuple(sorted(set(sel_tags)))
+
+    # Query database: the selected track (default: latest), the other parts only if they are not cached
+    track_query = tracks_with_tags(sel_tags)
+    try:
+        track = selected_track(track_query, sel_track_id)
+    except ValueError:
+        abort(400)
+
+    tag_html = SHOW_FRAGMENTS.get(generation, ("tags", tags_key), lambda: tag_options(sel_tags))
+    track_html = SHOW_FRAGMENTS.get(generation, ("tracks", tags_key), lambda: track_options(sel_tags))
+    statistics_html = panel_html = ""
+    if track is not None:  # without a matching track, the page shows no statistics
+        group_by = request.form.get("group-by") or "year"
+        if group_by not in aggregations.DIMENSIONS:
+            group_by = "year"
+        statistics_html = SHOW_FRAGMENTS.get(generation, ("statistics", tags_key, group_by),
+                                             lambda: matching_statistics(track_query, sel_tags, group_by))
+        panel_html = SHOW_FRAGMENTS.get(generation, ("track", track.id), lambda: render_template(
+            "fragments/track_panel.html", panel=track_panel(track)))
+    jobs = Job.select().order_by(Job.id.desc()).limit(RECENT_JOBS)  #pylint: disable=E1111
+    html = render_template("show.html", track=track, tag_options=tag_html, track_options=track_html,
+                           matching_statistics=statistics_html, track_panel=panel_html, jobs=jobs)
+    if etag is None:
+        return html
+    return cached_response(Response(html), etag, weak=True)
+
+
+@app.route("/geometry/<int:track_id>/")
+def geometry(track_id):
+    """simplified track geometry as GeoJSON Feature, the level of detail is selected by the query parameter detail
+    """
+    detail = request.args.get("detail", DEFAULT_DETAIL)
+    if detail not in DETAIL_TOLERANCES:
+        abort(400)
+    track = Track.get_or_none(Track.id == track_id)
+    if track is None:
+        abort(404)
+    if track.content_hash is None:
+        return jsonify(geojson_feature(track_geometry(None, os.path.join(UPLOAD_BASE_DIR, track.path)), detail))
+
+    etag = "%s-%s" % (track.content_hash, detail)
+    if request.if_none_match.contains(etag):  # skip reading the geometry
+        return cached_response(Response(status=304), etag, is_versioned_request(track))
+    response = jsonify(geojson_feature(track_geometry(track.content_hash, os.path.join(UPLOAD_BASE_DIR, track.path)), detail))
+    return cached_response(response, etag, is_versioned_request(track))
+
+
+@app.route("/tracks/in-bounds/")
+def tracks_in_bounds():
+    """tracks intersecting a map viewport as JSON, the newest first, the viewport is given by the query parameter
+    bbox=west,south,east,north (as returned by Leaflet's LatLngBounds.toBBoxString, see spatial.parse_bbox)
+    and the number of tracks by limit
+    """
+    try:
+        south, west, north, east = spatial.parse_bbox(request.args.get("bbox", ""))
+        limit = min(int(request.args.get("limit", IN_BOUNDS_LIMIT)), MAX_IN_BOUNDS_LIMIT)
+    except ValueError:
+        abort(400)
+    tracks = spatial.tracks_in_bounds(south, west, north, east, max(limit, 1))
+    return jsonify([{
+        "id": track.id,
+        "name": track.name,
+        "date": str(track.date),
+        "bounds": [[track.min_lat, track.min_lon], [track.max_lat, track.max_lon]],
+        "geometry": url_for("geometry", track_id=track.id),
+    } for track in tracks])
+
+
+@app.route("/download/<int:track_id>/")
+def download(track_id):
+    """the original gpx file of a track, compressed files are sent as they are to clients accepting gzip
+    """
+    track = Track.get_or_none(Track.id == track_id)
+    if track is None:
+        abort(404)
+    gpx_fspath = os.path.join(UPLOAD_BASE_DIR, track.path)
+    download_name = "%s.gpx" % (secure_filename(track.name) or "track")
+    if not is_gzip_file(gpx_fspath):
+        response = send_file(gpx_fspath, mimetype=GPX_MIMETYPE, as_attachment=True, download_name=download_name)
+        if track.content_hash is None:
+            return response
+        return cached_response(response, track.content_hash, is_versioned_request(track))
+
+    if "gzip" in request.accept_encodings:
+        # no range requests: ranges would refer to the compressed bytes, not to the gpx file
+        response = send_file(gpx_fspath, mimetype=GPX_MIMETYPE, as_attachment=True, download_name=download_name,
+                             conditional=False)
+        response.headers["Content-Encoding"] = "gzip"
+        etag = "%s-gzip" % track.content_hash  # the compressed bytes are a different representation
+    else:  # decompress for clients without gzip support
+        def generate():
+            with gzip.open(gpx_fspath, "rb") as gpx_file:
+                for chunk in iter(lambda: gpx_file.read(DOWNLOAD_CHUNK_SIZE), b""):
+                    yield chunk
+        response = Response(generate(), mimetype=GPX_MIMETYPE)
+        response.headers.set("Content-Disposition", "attachment", filename=download_name)
+        etag = track.content_hash
+    response.vary.add("Accept-Encoding")
+    if track.content_hash is None:
+        return response
+    return cached_response(response, etag, is_versioned_request(track))
+
+
+@app.route("/metrics/")
+def metrics():
+    """aggregated duration, point count and memory allocations per gpx processing stage as JSON,
+    and the hit rate of the /show/ cache
+    """
+    return jsonify(dict(PROCESSING_METRICS.as_dict(), show_cache=SHOW_FRAGMENTS.as_dict()))
 
 
 @app.route("/delete/<int:track_id>/")
@@ -94,16 +459,102 @@ def delete(track_id):
     track = Track.get(Track.id == track_id)
     track_name = track.name
     track_path = track.path
+    content_hash = track.content_hash
     gpx_fspath = os.path.join(UPLOAD_BASE_DIR, track_path)
-    track.delete_instance(recursive=True)
+    with db.atomic():
+        rollups.remove_track(track)
+        spatial.remove_track(track.id)
+        track.delete_instance(recursive=True)
+        delete_unused_tags()
+        increment_counter()
     os.remove(gpx_fspath)
+    if content_hash is not None:
+        remove_track_files(content_hash)
     flash("Track '%s' deleted sucessfully." % track_name, "info")
     return redirect(url_for("show"))
 
 
+def process_job(job):
+    """process an uploaded gpx file and store the track, handler of the ingest workers
+
+    @param job: Job of the upload
+    @return: the new Track
+    """
+    gpx_fspath = os.path.join(UPLOAD_BASE_DIR, job.path)
+    try:
+        # Use gpx library to extract meta information from gpx file
+        recorder = StageRecorder(trace_memory=app.config["GPX_TRACE_MEMORY"])
+        gpx = Gpx(gpx_fspath, True, streaming=True, elevation_filter=job.elevation_filter, instrumentation=recorder,
+                  point_store=point_store_path(job.content_hash), max_points=app.config["MAX_TRACKPOINTS"])
+        # Uploads are validated structurally like bulk imports: the elements used for processing are checked while
+        # streaming, files with missing or broken trackpoints fail the job, other schema deviations are accepted
+        gpx_metadata = ResultCache(CACHE_DIR).process(gpx, job.content_hash, force=False,
+                                                      validation=VALIDATION_STRUCTURAL)
+        if recorder.records:  # not taken from the result cache
+            app.logger.info("Processed gpx file '%s' in %.3fs: %s", job.path, recorder.total_seconds(),
+                            recorder.summary())
+            PROCESSING_METRICS.add(recorder)
+    except Exception:
+        discard_upload(job.content_hash, gpx_fspath)  # Clean up
+        raise
+
+    track_name = job.name or "Unnamend activity on %s"% gpx_metadata["date"]
+    tags = set(tag for tag in job.tags.split(",") if tag != "")
+    tags.add(gpx_metadata["date"][:4])  # implicit add of the year
+
+    # Create DB ORM objects
+    new_track = Track(name=track_name, date=gpx_metadata["date"], path=job.path, content_hash=job.content_hash)
+
+    # Read statistics
+    new_track_stats = Statistic(
+        track=new_track,
+        distance_m=gpx_metadata["total_distance"],
+        duration_s=gpx_metadata["duration"],
+        duration_total_s=gpx_metadata["total_duration"],
+        max_speed=gpx_metadata["max_speed"],
+        avg_speed=gpx_metadata["avg_speed"],
+        elevation_up_m=gpx_metadata["total_ascent"],
+        elevation_down_m=gpx_metadata["total_descent"],
+        version=STATISTICS_VERSION,
+        elevation_filter=gpx.elevation_filter.spec(),
+        activity_thresholds=activity.fingerprint()
+    )
+
+    # Precompute the map geometry, it is built on first view otherwise, and read the bounding box from it
+    try:
+        bounds = track_geometry(job.content_hash, gpx_fspath)["bounds"]
+    except Exception as e:
+        app.logger.warning("Could not build geometry of track '%s': %s", track_name, e)
+        bounds = None
+    for field, value in spatial.bounds_fields(bounds).items():
+        setattr(new_track, field, value)
+
+    # Split tables, from the point store written while processing
+    try:
+        track_splits, best_efforts = splits.analyze_file(track_points(job.content_hash, gpx_fspath),
+                                                         job.elevation_filter)
+    except Exception as e:
+        app.logger.warning("Could not analyze the splits of track '%s': %s", track_name, e)
+        track_splits, best_efforts = [], []
+
+    # Store objects in DB
+    try:
+        with db.atomic():
+            new_track.save()
+            new_track_stats.save()
+            tag_tracks([(new_track.id, tags)])
+            rollups.add_track(new_track.date, new_track_stats, tags)
+            spatial.index_track(new_track.id, bounds)
+            splits.store_track(new_track.id, track_splits, best_efforts)
+    except Exception:  # e.g. IntegrityError, if the same file was stored meanwhile
+        discard_upload(job.content_hash, gpx_fspath)
+        raise
+    return new_track
+
+
 @app.route("/add/", methods=["GET", "POST"])
 def add():
-    tags = Tag.select(Tag.value).distinct()  #pylint: disable=E1111
+    tags = Tag.select().order_by(Tag.value.asc())  #pylint: disable=E1111
 
     if request.method == "POST":
         # Validate uploaded file
@@ -117,65 +568,47 @@ def add():
         if not allowed_file(gpx_file.filename):
             flash("Only .gpx files supported!", "error")
             return redirect(request.url)
-
-        # Store gpx file in filesystem
-        gpx_filename = secure_filename(gpx_file.filename)
-        gpx_filename = "%s_%s.gpx" % (gpx_filename[:-4], int(datetime.now().timestamp()))  # add timestamp to filename
-        gpx_fspath = os.path.join(UPLOAD_BASE_DIR, UPLOAD_DIR, gpx_filename)
-        os.makedirs(os.path.dirname(gpx_fspath), exist_ok=True)
-        gpx_file.save(gpx_fspath)
-
+        elevation_filter = request.form.get("elevation-filter", "")
         try:
-            # Use gpx library to extract meta information from gpx file
-            gpx = Gpx(gpx_fspath, True)
-            gpx_metadata = gpx.process(force=True)  # TODO: improve gpx lib and set force to False
-
-            # Read form values: tags and name
-            track_name = request.form.get("name") or "Unnamend activity on %s"% gpx_metadata["date"]
-            tags = request.form.getlist('tag-select')
-            new_tags = request.form.get("new-tags").replace(" ","")
-            if new_tags != "":
-                tags += new_tags.split(",")
-            tags.append(gpx_metadata["date"][:4])  # implicit add of the year
-            tags = set(tags)  # Remove duplicate tags
-
-            # Create DB ORM objects
-            new_track = Track(name=track_name, date=gpx_metadata["date"], path=os.path.join(UPLOAD_DIR, gpx_filename))
-
-            # Read statistics
-            new_track_stats = Statistic(
-                track=new_track,
-                distance_m=gpx_metadata["total_distance"],
-                duration_s=gpx_metadata["duration"],
-                duration_total_s=gpx_metadata["total_duration"],
-                max_speed=gpx_metadata["max_speed"],
-                avg_speed=gpx_metadata["avg_speed"],
-                elevation_up_m=gpx_metadata["total_ascent"],
-                elevation_down_m=gpx_metadata["total_descent"]
-            )
-
-        except Exception as e:
-            flash("Error during gpx file processing: %s" % e, "error")
-
-            # Clean up
-            if 'new_track' in locals():
-                new_track.delete_instance()
-            if 'new_track_stats' in locals():
-                new_track_stats.delete_instance()
-            os.remove(os.path.join(os.path.dirname(os.path.realpath(__file__)), UPLOAD_BASE_DIR, UPLOAD_DIR, gpx_filename))
+            parse_filters(elevation_filter)
+        except ValueError as e:
+            flash("Invalid elevation filter: %s" % e, "error")
             return redirect(request.url)
 
+        # The file was received by GpxUploadWriter, check the size limit, the xml is parsed once by the job
+        upload = gpx_file.stream
+        error = upload.finish()
+        if error is not None:
+            flash(error, "error")
+            return redirect(request.url)
 
-        # Store objects in DB
-        new_track.save()
-        new_track_stats.save()
-
-        for tag in tags:
-            my_tag = Tag(track=new_track, value=tag)
-            my_tag.save()
+        # Skip files, that were uploaded before
+        content_hash = upload.content_hash
+        duplicate = Track.get_or_none(Track.content_hash == content_hash)
+        if duplicate is not None:
+            flash("This file was already uploaded as track '%s'." % duplicate.name, "error")
+            return redirect(request.url)
+        if ingest.is_queued(content_hash):
+            flash("This file was already uploaded and is being processed.", "error")
+            return redirect(request.url)
 
-        
-        flash("Track '%s' added sucessfully." % track_name, "info")
+        # Store gpx file in filesystem
+        gpx_filename = secure_filename(gpx_file.filename)
+        gpx_filename = "%s_%s_%s.gpx%s" % (gpx_filename[:-4], int(datetime.now().timestamp()), content_hash[:8],
+                                           storage.COMPRESSED_SUFFIX)  # add timestamp and hash to filename, stored compressed
+        gpx_fspath = os.path.join(UPLOAD_BASE_DIR, UPLOAD_DIR, gpx_filename)
+        upload.save(gpx_fspath)
+
+        # Read form values: tags and name, the year is added after processing
+        tags = request.form.getlist('tag-select')
+        new_tags = request.form.get("new-tags").replace(" ","")
+        if new_tags != "":
+            tags += new_tags.split(",")
+
+        # Process the file in the background
+        ingest.enqueue(request.form.get("name", ""), os.path.join(UPLOAD_DIR, gpx_filename), content_hash,
+                       sorted(set(tags)), elevation_filter)
+        flash("File '%s' uploaded, the track is added in the background." % gpx_file.filename, "info")
         return redirect(url_for("show"))
     else:
-        return render_template("add.html", tags=tags)
+        return render_template("add.html", tags=tags, elevation_filters=ELEVATION_FILTERS)